@@ -4,7 +4,7 @@ import sys
 import getopt
 import datetime
 import pickle
-from subprocess import Popen, PIPE
+import command_trace
 
 debug = False
 acl_file = "acl-baseline.pkl"
@@ -18,9 +18,7 @@ def get_acl():
     '''
     acl_cmd = "cl-acltool -L ip"
 
-    p = Popen(acl_cmd, shell=True, stdout=PIPE, stderr=PIPE)
-
-    output = p.communicate()[0]
+    output = command_trace.run(acl_cmd)
 
     return output.split("\n")
 
@@ -132,28 +130,39 @@ def print_report(report_dict):
 
 def main(argv):
 
-    options, remainder = getopt.getopt(sys.argv[1:], "", ["baseline", "report"])
+    options, remainder = getopt.getopt(sys.argv[1:], "", ["baseline", "report", "trace-file="])
+    trace_file = None
 
     for opt, arg in options:
         if opt in "--report":
             action = "report"
         if opt in "--baseline":
             action = "baseline"
+        if opt in "--trace-file":
+            # Append every external command to a JSON lines file
+            trace_file = arg
+            command_trace.tracer.open(arg)
+
+    try:
+        current_acl = update_acl_dict(parse_acl(get_acl()))
 
-    current_acl = update_acl_dict(parse_acl(get_acl()))
+        if action == "baseline":
+            with open(acl_file, 'wb') as f:
+                pickle.dump(current_acl, f, pickle.HIGHEST_PROTOCOL)
 
-    if action == "baseline":
-        with open(acl_file, 'wb') as f:
-            pickle.dump(current_acl, f, pickle.HIGHEST_PROTOCOL)
+            print "Baseline created and written to " + acl_file
+            return
 
-        print "Baseline created and written to " + acl_file
-        return
+        if action == "report":
+            with open(acl_file, 'rb') as f:
+                old_acl = pickle.load(f)
 
-    if action == "report":
-        with open(acl_file, 'rb') as f:
-            old_acl = pickle.load(f)
+            print_report(acl_report(old_acl, current_acl))
 
-        print_report(acl_report(old_acl, current_acl))
+    finally:
+        # A single run ends before anyone could send SIGUSR1, print the command timing on the way out
+        if trace_file is not None:
+            command_trace.tracer.dump()
 
 if __name__ == "__main__":
     main(sys.argv[1:])
\ No newline at end of file
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+import unittest
+import artifact_store
+import tempfile
+import shutil
+import gzip
+import json
+import time
+import os
+
+
+class TestArtifactStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store = artifact_store.ArtifactStore(self.tmp_dir, max_bytes=10000, max_age=3600)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_artifact(self, incident, name, data):
+        path = self.store.path(name)
+        self.store.add(incident, path)
+        open(path, "w").write(data)
+        self.store.finalize(incident, path)
+        return path
+
+    def test_compress_and_index(self):
+        incident = self.store.new_incident("10.12.12.2")
+        path = self.write_artifact(incident, "bgp_log_10.12.12.2.log", "vmstat\n" * 1000)
+        self.store.wait()
+
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(gzip.open(path + ".gz").read(), "vmstat\n" * 1000)
+
+        index = json.load(open(os.path.join(self.tmp_dir, artifact_store.index_name)))
+        self.assertEqual(index[incident]["peer"], "10.12.12.2")
+        self.assertEqual([a["path"] for a in index[incident]["artifacts"]], [path + ".gz"])
+
+    def test_finalized_callback(self):
+        stored = []
+        incident = self.store.new_incident("10.12.12.2")
+        path = self.store.path("bgp_log_10.12.12.2.log")
+        self.store.add(incident, path)
+        open(path, "w").write("ss\n")
+        self.store.finalize(incident, path, lambda *args: stored.append(args))
+        self.store.wait()
+
+        self.assertEqual(stored, [(path, path + ".gz", os.path.getsize(path + ".gz"))])
+
+    def test_add_to_evicted_incident(self):
+        # an open incident group whose first artifacts aged out
+        incident = self.store.new_incident("10.12.12.2", now=1)
+        self.write_artifact(incident, "old.log", "old")
+        self.store.wait()
+        self.assertFalse(incident in self.store.incidents)
+
+        path = self.store.path("bgp_auto_capture_10.12.12.5.pcap")
+        self.store.add(incident, path)
+        self.store.wait()
+
+        self.assertEqual(self.store.incidents[incident]["peer"], "10.12.12.2")
+        self.assertEqual([a["path"] for a in self.store.incidents[incident]["artifacts"]], [path])
+
+    def test_size_eviction_oldest_first(self):
+        data = os.urandom(4000)
+        paths = []
+        for i in range(4):
+            incident = self.store.new_incident("10.12.12.2", now=time.time() - 10 + i)
+            paths.append(self.write_artifact(incident, "capture" + str(i) + ".pcap", data))
+        self.store.wait()
+
+        self.assertTrue(self.store.total_bytes() <= 10000)
+        self.assertFalse(os.path.exists(paths[0] + ".gz"))
+        self.assertTrue(os.path.exists(paths[3] + ".gz"))
+
+    def test_age_eviction(self):
+        old = self.store.new_incident("10.12.12.2", now=1)
+        old_path = self.write_artifact(old, "old.log", "old")
+        new = self.store.new_incident("10.23.23.3")
+        new_path = self.write_artifact(new, "new.log", "new")
+        self.store.wait()
+
+        self.assertFalse(os.path.exists(old_path + ".gz"))
+        self.assertTrue(os.path.exists(new_path + ".gz"))
+        self.assertFalse(old in self.store.incidents)
+
+    def test_on_evict(self):
+        evicted = []
+        self.store.on_evict = evicted.append
+        old = self.store.new_incident("10.12.12.2", now=1)
+        old_path = self.write_artifact(old, "old.log", "old")
+        self.store.wait()
+
+        self.assertEqual(evicted, [old_path + ".gz"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+import datetime
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+import Queue
+
+debug = False
+
+'''
+artifact_store manages the logs and captures written while troubleshooting.
+
+Every trigger opens an incident. Its artifacts are written uncompressed while
+they are live, then handed to finalize(). A background thread gzips them,
+records them in an index (bgp_incidents.json) and evicts the oldest
+artifacts once the store is over its disk budget or they are older than
+the age limit.
+
+All disk work (compression, index writes, deletes) happens on the background
+thread, so the monitor never waits on flash.
+'''
+
+index_name = "bgp_incidents.json"
+
+
+class ArtifactStore(object):
+
+    '''
+    A directory of incident artifacts with a size and age budget.
+    '''
+
+    def __init__(self, directory=".", max_bytes=64 * 1024 * 1024, max_age=7 * 86400, compress=True, on_evict=None):
+        '''
+        directory = where artifacts and the index live
+        max_bytes = disk budget for finalized artifacts
+        max_age = seconds an artifact is kept
+        compress = gzip artifacts when they are finalized
+        on_evict = optional, called from the background thread with the path of every artifact deleted by eviction
+        incidents = incident id -> {"peer", "started", "artifacts": [{"path", "bytes", "finalized"}]}
+        '''
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compress = compress
+        self.on_evict = on_evict
+        self.index_file = os.path.join(directory, index_name)
+        self.lock = threading.Lock()
+        self.jobs = Queue.Queue()
+        self.worker = None
+        self.incidents = {}
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        if os.path.exists(self.index_file):
+            try:
+                self.incidents = json.load(open(self.index_file))
+            except ValueError:
+                self.incidents = {}
+
+    def new_incident(self, peer, now=None):
+        '''
+        Opens an incident for a peer.
+
+        Returns the incident id, ex. "10.12.12.2_10182026_140102"
+        '''
+
+        if now is None:
+            now = time.time()
+
+        incident = peer + "_" + datetime.datetime.fromtimestamp(now).strftime("%m%d%Y_%H%M%S")
+
+        with self.lock:
+            # Two triggers in the same second share the incident
+            self.incidents.setdefault(incident, {"peer": peer, "started": now, "artifacts": []})
+
+        return incident
+
+    def path(self, name):
+        '''
+        Returns where an artifact named name should be written
+        '''
+
+        return os.path.join(self.directory, name)
+
+    def add(self, incident, path):
+        '''
+        Records a live (still being written) artifact under an incident
+        '''
+
+        with self.lock:
+            # Eviction drops an incident once its finalized artifacts are gone, while its group may still be open
+            record = self.incidents.setdefault(incident, {"peer": incident.split("_")[0],
+                                                          "started": time.time(), "artifacts": []})
+            record["artifacts"].append({"path": path, "bytes": 0, "finalized": False})
+
+        self._submit("save")
+
+    def finalize(self, incident, path, callback=None):
+        '''
+        Marks an artifact complete. It is compressed, indexed and
+        counted against the budget in the background.
+
+        Keyword Args:
+        incident - incident id from new_incident()
+        path - the artifact as it was written
+        callback - optional, called from the background thread with (path, final path, bytes) once it is stored
+        '''
+
+        self._submit("finalize", incident, path, callback)
+
+    def wait(self):
+        '''
+        Blocks until the background thread is idle. Used at shutdown and in testing.
+        '''
+
+        self.jobs.join()
+
+    def total_bytes(self):
+        '''
+        Returns bytes used by finalized artifacts
+        '''
+
+        with self.lock:
+            return sum(artifact["bytes"] for incident in self.incidents.values()
+                       for artifact in incident["artifacts"] if artifact["finalized"])
+
+    def _submit(self, *job):
+        with self.lock:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._run)
+                self.worker.daemon = True
+                self.worker.start()
+
+        self.jobs.put(job)
+
+    def _run(self):
+        '''
+        Background thread. Runs jobs in order.
+        '''
+
+        while True:
+            job = self.jobs.get()
+
+            try:
+                if job[0] == "finalize":
+                    stored = self._finalize(job[1], job[2])
+
+                    # before evicting, the callback must know the final path if the artifact is evicted right away
+                    if stored is not None and job[3] is not None:
+                        job[3](job[2], stored[0], stored[1])
+
+                    self._evict()
+
+                self._save()
+
+            except (IOError, OSError) as e:
+                if debug:
+                    print "Artifact store error: " + str(e)
+
+            finally:
+                self.jobs.task_done()
+
+    def _finalize(self, incident, path):
+        '''
+        Compresses an artifact and records its final size
+
+        Returns (final path, bytes), or None if the artifact is gone
+        '''
+
+        if not os.path.exists(path):
+            return None
+
+        final_path = path
+
+        if self.compress and not path.endswith(".gz"):
+            final_path = path + ".gz"
+            source = open(path, "rb")
+            target = gzip.open(final_path, "wb", 6)
+            shutil.copyfileobj(source, target, 64 * 1024)
+            target.close()
+            source.close()
+            os.remove(path)
+
+        size = os.path.getsize(final_path)
+
+        with self.lock:
+            record = self.incidents.setdefault(incident, {"peer": incident.split("_")[0],
+                                                          "started": time.time(), "artifacts": []})
+            artifacts = [a for a in record["artifacts"] if a["path"] != path]
+            artifacts.append({"path": final_path, "bytes": size, "finalized": True})
+            record["artifacts"] = artifacts
+
+        if debug:
+            print "Stored " + final_path + " (" + str(size) + " bytes)"
+
+        return final_path, size
+
+    def _evict(self, now=None):
+        '''
+        Deletes the oldest finalized artifacts until the store is within its size and age limits
+        '''
+
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            candidates = sorted((incident["started"], artifact["path"], artifact, incident_id)
+                                for incident_id, incident in self.incidents.items()
+                                for artifact in incident["artifacts"] if artifact["finalized"])
+            total = sum(candidate[2]["bytes"] for candidate in candidates)
+            evict = []
+
+            for started, path, artifact, incident_id in candidates:
+                if total <= self.max_bytes and now - started <= self.max_age:
+                    break
+
+                total -= artifact["bytes"]
+                evict.append(path)
+                self.incidents[incident_id]["artifacts"].remove(artifact)
+
+                if not self.incidents[incident_id]["artifacts"]:
+                    del self.incidents[incident_id]
+
+        for path in evict:
+            if debug:
+                print "Evicting " + path
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+            if self.on_evict is not None:
+                self.on_evict(path)
+
+    def _save(self):
+        '''
+        Writes the index atomically
+        '''
+
+        with self.lock:
+            data = json.dumps(self.incidents, indent=1, sort_keys=True)
+
+        temp_file = self.index_file + ".tmp"
+        index = open(temp_file, "w")
+        index.write(data)
+        index.close()
+        os.rename(temp_file, self.index_file)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+import unittest
+import bgp_parser
+import synthetic_bgp
+import datetime
+
+summary_output = """BGP router identifier 10.2.2.2, local AS number 65222
+RIB entries 7, using 784 bytes of memory
+Peers 3, using 17 KiB of memory
+
+Neighbor        V    AS MsgRcvd MsgSent   TblVer  InQ OutQ Up/Down  State/PfxRcd
+192.168.1.1     4 65111   17758   17788        0    0    0 01w3d19h        2
+192.168.2.3     4 65333      70      80        0    0    0 01w5d03h Active
+2001:db8:100::1
+                4 65444      71      81        0    0    0 00:01:02       12
+
+Total number of neighbors 3
+"""
+
+summary_json = """{
+  "routerId":"10.2.2.2",
+  "as":65222,
+  "peers":{
+    "192.168.1.1":{"remoteAs":65111,"version":4,"msgRcvd":17758,"msgSent":17788,"peerUptime":"01w3d19h","prefixReceivedCount":2,"state":"Established"},
+    "192.168.2.3":{"remoteAs":65333,"version":4,"msgRcvd":70,"msgSent":80,"peerUptime":"01w5d03h","prefixReceivedCount":0,"state":"Active"}
+  }
+}
+"""
+
+neighbors_output = """BGP neighbor is 192.168.1.1, remote AS 65111, local AS 65222, external link
+  BGP version 4, remote router ID 10.1.1.1
+  BGP state = Established, up for 01w4d15h
+  Last read 00:00:55, Last write 01w4d15h
+  Hold time is 180, keepalive interval is 60 seconds
+  Neighbor capabilities:
+    4 Byte AS: advertised and received
+BGP neighbor is 192.168.2.3, remote AS 65333, local AS 65222, external link
+  BGP version 4, remote router ID 0.0.0.0
+  BGP state = Active
+  Last read 01w4d15h, Last write 01w4d15h
+  Hold time is 6, keepalive interval is 2 seconds
+"""
+
+neighbors_json = """{
+  "192.168.1.1":{"remoteAs":65111,"bgpState":"Established","bgpTimerLastRead":55000,
+                 "bgpTimerHoldTimeMsecs":180000,"bgpTimerKeepAliveIntervalMsecs":60000},
+  "192.168.2.3":{"remoteAs":65333,"bgpState":"Active","bgpTimerLastRead":1004400000,
+                 "bgpTimerHoldTimeMsecs":6000,"bgpTimerKeepAliveIntervalMsecs":2000}
+}
+"""
+
+
+class TestParseTimer(unittest.TestCase):
+
+    def test_clock(self):
+        self.assertEqual(bgp_parser.parse_timer("01:13:55"), datetime.timedelta(hours=1, minutes=13, seconds=55))
+
+    def test_weeks(self):
+        self.assertEqual(bgp_parser.parse_timer("01w4d15h"), datetime.timedelta(weeks=1, days=4, hours=15))
+
+    def test_days(self):
+        self.assertEqual(bgp_parser.parse_timer("1d02h03m"), datetime.timedelta(days=1, hours=2, minutes=3))
+
+    def test_never(self):
+        self.assertEqual(bgp_parser.parse_timer("never"), None)
+
+
+class TestParseSummary(unittest.TestCase):
+
+    def test_text(self):
+        result = bgp_parser.parse_summary(summary_output)
+        expected = [bgp_parser.PeerSummary("192.168.1.1", 4, 65111, 17758, 17788, "01w3d19h", "Established", 2),
+                    bgp_parser.PeerSummary("192.168.2.3", 4, 65333, 70, 80, "01w5d03h", "Active", None),
+                    bgp_parser.PeerSummary("2001:db8:100::1", 4, 65444, 71, 81, "00:01:02", "Established", 12)]
+        self.assertEqual(result, expected)
+
+    def test_json_matches_text(self):
+        self.assertEqual(bgp_parser.parse_summary(summary_json), bgp_parser.parse_summary(summary_output)[:2])
+
+    def test_json_address_family(self):
+        nested = '{"ipv4Unicast":' + summary_json + '}'
+        self.assertEqual(bgp_parser.parse_summary(nested), bgp_parser.parse_summary(summary_json))
+
+
+class TestParseNeighbors(unittest.TestCase):
+
+    def test_text(self):
+        result = bgp_parser.parse_neighbors(neighbors_output)
+        self.assertEqual(result["192.168.1.1"],
+                         bgp_parser.NeighborState("192.168.1.1", "Established", datetime.timedelta(seconds=55), 180, 60,
+                                                  65111))
+        self.assertEqual(result["192.168.2.3"],
+                         bgp_parser.NeighborState("192.168.2.3", "Active", datetime.timedelta(weeks=1, days=4, hours=15), 6, 2,
+                                                  65333))
+
+    def test_json_matches_text(self):
+        self.assertEqual(bgp_parser.parse_neighbors(neighbors_json), bgp_parser.parse_neighbors(neighbors_output))
+
+
+class TestSyntheticOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.peers = synthetic_bgp.make_peers(300)
+
+    def test_neighbors_round_trip(self):
+        expected = dict((peer.ip, peer) for peer in self.peers)
+        self.assertEqual(bgp_parser.parse_neighbors(synthetic_bgp.neighbors_text(self.peers)), expected)
+        self.assertEqual(bgp_parser.parse_neighbors(synthetic_bgp.neighbors_json(self.peers)), expected)
+
+    def test_summary_round_trip(self):
+        text = bgp_parser.parse_summary(synthetic_bgp.summary_text(self.peers))
+        self.assertEqual([(peer.ip, peer.state) for peer in text], [(peer.ip, peer.state) for peer in self.peers])
+        self.assertEqual(bgp_parser.parse_summary(synthetic_bgp.summary_json(self.peers)),
+                         sorted(text))
+
+    def test_format_timer(self):
+        for seconds in [55, 3600 * 5 + 7, 86400 * 4 + 3600 * 15, 86400 * 11 + 3600 * 15]:
+            delta = datetime.timedelta(seconds=seconds)
+            formatted = synthetic_bgp.format_timer(delta)
+            # Quagga drops seconds past a day and minutes past a week
+            self.assertTrue(delta - bgp_parser.parse_timer(formatted) < datetime.timedelta(hours=1), formatted)
+
+
+if __name__ == '__main__':
+    unittest.main()
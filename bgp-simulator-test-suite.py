@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+import unittest
+import bgp_simulator
+import bgp_neighbor_capture as bgp
+import datetime
+
+
+class TestPeerScript(unittest.TestCase):
+
+    def setUp(self):
+        self.script = bgp_simulator.PeerScript("10.0.0.1", 60, 180)
+
+    def test_healthy(self):
+        self.assertEqual(self.script.last_message(125), 120)
+        self.assertTrue(self.script.established(125))
+
+    def test_silent(self):
+        self.script.silent(600, 120)
+        self.assertEqual(self.script.last_message(700), 540)
+        self.assertEqual(self.script.state(700).last_read, datetime.timedelta(seconds=160))
+        self.assertTrue(self.script.established(700))
+        self.assertEqual(self.script.last_message(725), 720)
+
+    def test_hold_expiry(self):
+        self.script.silent(600, 300)
+        self.assertTrue(self.script.established(779))
+        self.assertFalse(self.script.established(780))
+        self.assertTrue(self.script.established(900))
+
+    def test_flap(self):
+        self.script.flap(100, 300, 60, 2)
+        self.assertEqual([self.script.established(t) for t in [99, 100, 159, 160, 400, 460]],
+                         [True, False, False, True, False, True])
+
+
+class TestSimulation(unittest.TestCase):
+
+    def build_scripts(self):
+        healthy = bgp_simulator.PeerScript("10.0.0.1", 60, 180)
+        silent = bgp_simulator.PeerScript("10.0.0.2", 60, 180)
+        silent.silent(600, 120)
+        down = bgp_simulator.PeerScript("10.0.0.3", 60, 180)
+        down.down(1200)
+        return [healthy, silent, down]
+
+    def check_result(self, result):
+        self.assertEqual(result.detections, [bgp_simulator.Detection("10.0.0.2", "silent", 600, 60),
+                                             bgp_simulator.Detection("10.0.0.3", "down", 1200, 0)])
+        self.assertEqual(result.false_positives, 0)
+        self.assertTrue(result.checks > 60)
+
+    def test_detection_latency(self):
+        orig_send_command = bgp.send_command
+        result = bgp_simulator.Simulation(self.build_scripts(), 1800).run()
+
+        self.check_result(result)
+        # every patched global is restored
+        self.assertTrue(bgp.send_command is orig_send_command)
+
+    def test_batch_json(self):
+        self.check_result(bgp_simulator.Simulation(self.build_scripts(), 1800, batch=True, json_output=True).run())
+
+    def test_adaptive(self):
+        scripts = bgp_simulator.build_scenario(40, 3600)
+        hold_times = dict((script.ip, script.hold_time) for script in scripts)
+        fixed = bgp_simulator.Simulation(scripts, 3600).run()
+        adaptive = bgp_simulator.Simulation(scripts, 3600, adaptive=True).run()
+
+        self.assertTrue(adaptive.checks < fixed.checks)
+        self.assertEqual(adaptive.false_positives, 0)
+
+        # faults that take the session down are still noticed inside the hold time
+        for detection in adaptive.detections:
+            if detection.kind == "down":
+                self.assertTrue(detection.latency < hold_times[detection.ip], detection)
+
+    def test_sniff(self):
+        scripts = bgp_simulator.build_scenario(40, 3600)
+        polled = bgp_simulator.Simulation(scripts, 3600).run()
+        sniffed = bgp_simulator.Simulation(scripts, 3600, sniff=True).run()
+
+        self.assertEqual(sniffed.false_positives, 0)
+
+        # silences are noticed 1.25 keepalives after the last message, not up to a keepalive later
+        for before, after in zip(polled.detections, sniffed.detections):
+            if before.kind == "silent":
+                self.assertTrue(after.latency < before.latency, (before, after))
+
+    def test_scenario(self):
+        result = bgp_simulator.Simulation(bgp_simulator.build_scenario(40, 1800), 1800).run()
+        self.assertEqual(result.false_positives, 0)
+        self.assertTrue("False positives: 0" in bgp_simulator.format_report(result))
+
+
+if __name__ == '__main__':
+    unittest.main()
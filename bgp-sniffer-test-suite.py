@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+import unittest
+import bgp_sniffer
+import deadline_scheduler
+import pcap_format
+import socket
+import sys
+import time
+
+keepalive = "\xff" * 16 + "\x00\x13\x04"
+update = "\xff" * 16 + "\x00\x17\x02" + "\x00" * 4
+
+
+def build_packet(src, dst, sport, dport, payload="", flags=pcap_format.TCP_ACK | pcap_format.TCP_PSH, seq=0):
+    '''
+    Builds an IPv4/TCP packet as a SOCK_DGRAM packet socket returns it, without the Ethernet header
+    '''
+
+    return pcap_format.build_ipv4_tcp(src, dst, sport, dport, payload, flags, seq)[14:]
+
+
+class TestAssemble(unittest.TestCase):
+
+    def test_jumps(self):
+        program = bgp_sniffer.assemble([(None, bgp_sniffer.BPF_JMP_JEQ_K, 1, "yes", None),
+                                        (None, bgp_sniffer.BPF_RET_K, 0, None, None),
+                                        ("yes", bgp_sniffer.BPF_RET_K, 100, None, None)])
+
+        self.assertEqual(bgp_sniffer.sock_filter.unpack_from(program, 0), (bgp_sniffer.BPF_JMP_JEQ_K, 1, 0, 1))
+        self.assertEqual(len(program), 3 * bgp_sniffer.sock_filter.size)
+
+    def test_backward_jump(self):
+        self.assertRaises(ValueError, bgp_sniffer.assemble, [("top", bgp_sniffer.BPF_JMP_JEQ_K, 1, "top", None)])
+
+
+class TestHandle(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = deadline_scheduler.VirtualClock(100)
+        self.sniffer = bgp_sniffer.Sniffer(clock=self.clock)
+
+    def test_keepalive(self):
+        packet = build_packet("10.1.1.1", "10.1.1.2", 179, 40000, keepalive + keepalive, seq=1000)
+        self.assertEqual(self.sniffer.handle(packet, 0, 99.5), ["KEEPALIVE", "KEEPALIVE"])
+
+        peer = self.sniffer.peers["10.1.1.1"]
+        self.assertEqual((peer.last_message, peer.last_keepalive, peer.keepalives), (99.5, 99.5, 2))
+        self.assertEqual(self.sniffer.age("10.1.1.1"), 0.5)
+        self.assertEqual(self.sniffer.age("10.1.1.2"), None)
+
+    def test_update_split_across_segments(self):
+        self.sniffer.handle(build_packet("10.1.1.1", "10.1.1.2", 179, 40000, update[:10], seq=1), 0, 10)
+        self.assertEqual(self.sniffer.handle(build_packet("10.1.1.1", "10.1.1.2", 179, 40000, update[10:], seq=11),
+                                             0, 11), ["UPDATE"])
+
+        peer = self.sniffer.peers["10.1.1.1"]
+        self.assertEqual((peer.last_message, peer.last_keepalive, peer.messages), (11, None, 2))
+
+    def test_ignored(self):
+        # our own keepalive, a pure ACK, a retransmission and another port
+        self.sniffer.handle(build_packet("10.1.1.2", "10.1.1.1", 40000, 179, keepalive), bgp_sniffer.PACKET_OUTGOING, 1)
+        self.sniffer.handle(build_packet("10.1.1.1", "10.1.1.2", 179, 40000, flags=pcap_format.TCP_ACK), 0, 1)
+        self.sniffer.handle(build_packet("10.1.1.3", "10.1.1.2", 22, 40000, keepalive), 0, 1)
+        self.assertEqual(self.sniffer.peers, {})
+
+        self.sniffer.handle(build_packet("10.1.1.1", "10.1.1.2", 179, 40000, keepalive, seq=5), 0, 1)
+        self.sniffer.handle(build_packet("10.1.1.1", "10.1.1.2", 179, 40000, keepalive, seq=5), 0, 2)
+        self.assertEqual(self.sniffer.peers["10.1.1.1"].last_message, 1)
+
+    def test_reset_forgets_stream(self):
+        self.sniffer.handle(build_packet("10.1.1.1", "10.1.1.2", 179, 40000, keepalive, seq=5), 0, 1)
+        self.sniffer.handle(build_packet("10.1.1.1", "10.1.1.2", 179, 40000, flags=pcap_format.TCP_RST, seq=24), 0, 2)
+        self.assertEqual(self.sniffer.streams, {})
+
+    def test_reader_survives_bad_packet(self):
+        packets = [build_packet("10.1.1.1", "10.1.1.2", 179, 40000, keepalive, seq=5),
+                   build_packet("10.1.1.1", "10.1.1.2", 179, 40000, keepalive, seq=24)]
+        sniffer = self.sniffer
+        handle = sniffer.handle
+
+        class FakeSocket(object):
+            def fileno(sock):
+                return sys.stdin.fileno()
+
+            def recvfrom(sock, size):
+                if not packets:
+                    sniffer.running = False
+                    raise socket.timeout()
+
+                return packets.pop(0), ("lo", 0x0800, 0)
+
+        def broken_once(data, pkttype, now):
+            sniffer.handle = handle
+            raise ValueError("can't decode")
+
+        sniffer.sock = FakeSocket()
+        sniffer.handle = broken_once
+        sniffer.running = True
+        sniffer.run()
+
+        self.assertEqual(sniffer.peers["10.1.1.1"].keepalives, 1)
+
+
+class TestLoopback(unittest.TestCase):
+
+    def setUp(self):
+        self.sniffer = bgp_sniffer.Sniffer("lo")
+        self.sockets = []
+
+        try:
+            self.sniffer.start()
+            listener = socket.socket()
+            self.sockets.append(listener)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind(("127.0.0.2", 179))
+        except socket.error as e:
+            self.tearDown()
+            self.skipTest("needs CAP_NET_RAW and CAP_NET_BIND_SERVICE: " + str(e))
+
+        listener.listen(1)
+        self.client = socket.socket()
+        self.sockets.append(self.client)
+        self.client.bind(("127.0.0.3", 0))
+        self.client.connect(("127.0.0.2", 179))
+        self.server = listener.accept()[0]
+        self.sockets.append(self.server)
+
+    def tearDown(self):
+        self.sniffer.stop()
+
+        for sock in self.sockets:
+            sock.close()
+
+    def test_keepalives(self):
+        self.client.sendall(keepalive)
+        self.server.recv(100)
+
+        for wait in range(50):
+            if "127.0.0.3" in self.sniffer.peers:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(self.sniffer.peers["127.0.0.3"].keepalives, 1)
+        self.assertTrue(0 <= self.sniffer.age("127.0.0.3") < 1)
+        self.assertEqual(self.sniffer.age("127.0.0.2"), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
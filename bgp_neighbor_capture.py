@@ -4,86 +4,308 @@
 # Author: Pete Lumbis, plumbis@cumulusnetworks.com
 # 
 
-from subprocess import Popen, PIPE
+from multiprocessing.pool import ThreadPool
+import os
+import socket
 import sys
 import datetime
-import time
 import getopt
+import threading
+import vtysh_session
+import bgp_parser
+import deadline_scheduler
+import diag_collector
+import capture_engine
+import artifact_store
+import monitor_metrics
+import command_trace
+import sock_diag
+import bgp_sniffer
+import system_stats
+import route_lookup
+import incident_groups
+import incident_hysteresis
+import incident_history
+import liveness_prober
 
 debug = False  # Global debug flag
+worker_count = 16  # Number of threads checking neighbors in parallel
+
+neighbor_table = None  # NeighborStateTable when polling in batch mode
+poll_policy = None  # AdaptivePolling when --adaptive. None polls every peer once per keepalive
+tcp_table = None  # sock_diag.SessionTable when --sock-diag. Kernel TCP state as an early warning
+sniffer = None  # bgp_sniffer.Sniffer when --sniff. Exact time of each peer's last BGP message
+prober = None  # liveness_prober.Prober when --probe. Bursts of ICMP loss or latency start troubleshooting early
+routes = None  # route_lookup.RouteCache. Scopes captures, counters and ping to a peer's interface. None uses all
+incidents = incident_groups.IncidentGroups(30, lambda: clock())  # Peers failing together share one incident. None for one per peer
+hysteresis = None  # incident_hysteresis.Hysteresis. None starts and stops troubleshooting on every check
+sniff_margin = 0.05  # seconds past the moment a sniffed peer becomes overdue that it is checked
+vtysh_pool = None  # vtysh_session.VtyshPool when using persistent vtysh sessions
+json_output = False  # Send "show ... json" commands and parse them with the JSON backend
+clock = deadline_scheduler.monotonic  # Time source for liveliness checks. Replaced with a VirtualClock in tests
+
+collector = diag_collector.DiagnosticCollector()  # Runs start_logging commands in the background
+captures = capture_engine.CaptureManager()  # One tcpdump shared by every neighbor being captured
+flight_recorder = None  # capture_engine.FlightRecorder, always on unless --flight-seconds=0
+flight_seconds = 30  # Seconds of BGP traffic kept by the flight recorder
+flight_bytes = 4 * 1024 * 1024  # Memory cap of the flight recorder
+artifacts = None  # artifact_store.ArtifactStore for logs and captures. None writes plain files to the cwd
+history = None  # incident_history.IncidentHistory, a SQLite record of every session. None keeps no history
+snapshot_seconds = 10  # Seconds system_snapshot samples /proc and /sys for during an incident
+metrics = monitor_metrics.Metrics()  # Served on --metrics-port in the Prometheus text format
+
+debug_lock = threading.Lock()
+debugging_neighbors = set()  # IPs that currently have BGP debugs enabled
 
 '''
 bgp_neighbor_capture will monitor the state of BGP neighbors
 and automatically begin collecting data when a peer may eventually go down.
 This is based on not hearing from a peer in 1.5 keepalive intervals.
 
-Currently this is single threaded. It is written to work with
-multiple BGP peers, but a new thread needs to be spawned per peer.
-As a result, this proof-of-concept code only works for the first 
-Established BGP peer in "show ip bgp summary"
-
-TODO: Multithread
-TODO: Track neighbor source interface for ping
-TODO: When multithreaded, if troubleshooting more than one neighbor, don't duplicate data
-TODO: issuing the ping blocks the termination of other things. Need to figure out how to do that independently
+Every Established BGP peer in "show ip bgp summary" is monitored.
+A single dispatcher loop (NeighborMonitor) tracks when each peer is next due
+and hands the check to a pool of worker threads, so every peer is polled on
+its own keepalive cadence and a slow peer only ties up one worker.
+
+Per-peer timers, detection latency, troubleshooting sessions, capture bytes and
+vtysh latency are kept in monitor_metrics and served with --metrics-port=N.
+
+With --sniff=<interface|any> the time of each peer's last message comes from
+a packet socket (bgp_sniffer) instead of vtysh's one second "Last read", and
+the next check of a peer is scheduled for the moment it would become overdue,
+so a silent peer is noticed within sniff_margin of 1.25 keepalives.
+
+With --probe=<seconds> every peer is also pinged at that interval (see liveness_prober).
+A burst of lost or slow probes gets the peer checked at once. If the kernel's TCP state
+(--sock-diag) agrees the session is in trouble, troubleshooting starts while the peer is still
+sending keepalives, instead of 1.25 keepalives after it goes silent. Probes alone never
+count as a miss, so a path that only drops ICMP can't hold a session open.
+
+When troubleshooting starts, the kernel is asked (over netlink, see route_lookup)
+which interface and next hop lead to the peer. The capture, the interface counters
+and the ping are limited to that interface instead of every port on the box, unless
+the peer is behind an ECMP route and the session's path isn't known.
+
+Peers that start failing within 30 seconds of each other and share an interface,
+next hop or remote AS are troubleshot as one incident (see incident_groups):
+one capture and one system snapshot, instead of one per peer.
+
+Troubleshooting starts and stops with hysteresis (see incident_hysteresis):
+a peer has to pass several checks in a row, and the session has to have run
+for a minimum time and a cooldown, before the capture and debugs are stopped.
+A peer that fails again while cooling down extends its session instead of
+starting a new capture.
+
+Every session is recorded in a SQLite database (see incident_history) with its
+trigger, peak silence, artifacts and a summary of the system snapshot, so past
+incidents can be queried by peer, interface or time.
 '''
 
 
+metrics.describe("bgp_monitor_last_read_seconds", "gauge", "Seconds since the last BGP message from the peer")
+metrics.describe("bgp_monitor_hold_time_seconds", "gauge", "Negotiated hold time of the peer")
+metrics.describe("bgp_monitor_keepalive_seconds", "gauge", "Negotiated keepalive interval of the peer")
+metrics.describe("bgp_monitor_detection_latency_seconds", "histogram",
+                 "Seconds from the peer's last BGP message to the start of troubleshooting",
+                 (1, 5, 10, 15, 30, 45, 60, 90, 120, 180, 300))
+metrics.describe("bgp_monitor_troubleshooting_sessions_total", "counter", "Troubleshooting sessions started")
+metrics.describe("bgp_monitor_troubleshooting_active", "gauge", "Neighbors currently being troubleshot")
+metrics.describe("bgp_monitor_correlated_peers_total", "counter",
+                 "Troubleshooting sessions that joined another peer's incident instead of starting their own")
+metrics.describe("bgp_monitor_troubleshooting_extended_total", "counter",
+                 "Troubleshooting sessions extended by a relapse during their cooldown instead of restarted")
+metrics.describe("bgp_monitor_capture_bytes_total", "counter", "Bytes of pcap written by captures and the flight recorder")
+metrics.describe("bgp_monitor_vtysh_seconds", "histogram", "vtysh command latency by command")
+
+timer_cache = {}  # seconds -> shared datetime.timedelta. Peers mostly use a handful of timer values
+
+
+def seconds_to_timedelta(seconds):
+    '''
+    Returns a datetime.timedelta of seconds, shared between every caller asking for the same value.
+    timedelta is immutable, so thousands of Neighbors with 60/180 timers hold two objects.
+    '''
+
+    delta = timer_cache.get(seconds)
+
+    if delta is None:
+        delta = timer_cache.setdefault(seconds, datetime.timedelta(seconds=seconds))
+
+    return delta
+
+
 class Neighbor(object):
 
     '''
     A Neighbor object represents the information about a BGP peer.
+
+    __slots__ keeps each instance small so a registry of 10k peers stays cheap.
     '''
 
-    def __init__(self, ip):
+    __slots__ = ["ip", "keepalive", "hold_time", "last_read", "last_run", "poll_interval", "troubleshooting",
+                 "process", "collection", "incident", "route", "remote_as", "group", "incident_state", "silence",
+                 "warning", "session"]
+
+    def __init__(self, ip, state=None):
         '''
         ip = IP address of the peer
+        state = optional bgp_parser.NeighborState already polled for this peer (ex. from a bulk load).
+                Without it the constructor polls vtysh for the last read time.
         keepalive = currently negotiated keepalive timer
         hold_time = currently negotiated hold timer
         last_read = the last time we heard a BGP message. Based on "Last Read" line in "show ip bgp neighbor"
-        last_run = the last time this neighbor was checked for liveliness
+        last_run = the clock() time this neighbor was last checked for liveliness
+        poll_interval = seconds between liveliness checks. The keepalive unless poll_policy changes it
         troubleshooting = is this Neighbor currently being troubleshot
-        process = a Popen process. Used to terminated tcpdump background capture
-
-        times are kept as datetime.timedelta() instead of datetime.time() to make the math easier.
+        process = the neighbor's capture_engine.Subscription. Used to terminate the background capture
+        collection = the diag_collector.Collection of the current start_logging run
+        incident = artifact_store incident id of the current troubleshooting session
+        route = route_lookup.Route to the peer when troubleshooting started, None if unknown
+        remote_as = the peer's AS, None if unknown
+        group = incident_groups.IncidentGroup the Neighbor is troubleshot in, None when not grouped
+        incident_state = incident_hysteresis.PeerIncident, where the Neighbor is in starting and stopping troubleshooting
+        silence = seconds since the last message at the latest check
+        warning = TCP state or probe warning at the latest check, None if both looked healthy
+        session = incident_history.Session of the current troubleshooting session, None without history
+
+        timers and last_read are kept as datetime.timedelta() to make the math easier.
+        last_run is a float on the monotonic clock so it is unaffected by midnight or clock changes.
         '''
 
         self.ip = ip
-        self.keepalive = datetime.timedelta()
-        self.hold_time = datetime.timedelta()
-        self.last_read = get_last_read(ip)
-        self.last_run = datetime.timedelta()
+        self.keepalive = seconds_to_timedelta(0)
+        self.hold_time = seconds_to_timedelta(0)
+        self.last_run = 0.0
+        self.poll_interval = 0.0
         self.troubleshooting = False
-        self.process = []
+        self.process = None
+        self.collection = None
+        self.incident = None
+        self.route = None
+        self.remote_as = None
+        self.group = None
+        self.incident_state = incident_hysteresis.PeerIncident()
+        self.silence = 0.0
+        self.warning = None
+        self.session = None
+
+        if state is None:
+            self.last_read = get_last_read(ip)
+        else:
+            self.last_read = state.last_read
+            self.remote_as = state.remote_as
+            self.set_timers((state.hold_time, state.keepalive))
 
     def set_timers(self, holdtime_ka_tuple):
         '''
         Sets/updates timers for a BGP neighbor.
-        Timers = hold_time, keepalive, last_run (to right now)
+        Timers = hold_time, keepalive, last_run (to right now), poll_interval (to the keepalive)
 
         Keyword Arguments:
         holdtime_ka_tuple = a tuple of (<holdtime>, <keepalive>) ints. 
         '''
 
-        self.hold_time = datetime.timedelta(seconds=holdtime_ka_tuple[0])
-        self.keepalive = datetime.timedelta(seconds=holdtime_ka_tuple[1])
-        now = datetime.datetime.now()
-        self.last_run = datetime.timedelta(hours=now.hour, minutes=now.minute, seconds=now.second)
+        self.hold_time = seconds_to_timedelta(holdtime_ka_tuple[0])
+        self.keepalive = seconds_to_timedelta(holdtime_ka_tuple[1])
+        self.last_run = clock()
+        self.poll_interval = float(holdtime_ka_tuple[1])
+
+        metrics.set("bgp_monitor_hold_time_seconds", holdtime_ka_tuple[0], peer=self.ip)
+        metrics.set("bgp_monitor_keepalive_seconds", holdtime_ka_tuple[1], peer=self.ip)
 
     def set_proc(self, proc):
         ''' 
-        Sets the Popen process for this Neighbor.
+        Sets the capture process (Subscription) for this Neighbor.
 
-        Currently assumes only a single process would exist, so static insert is used.
+        Only a single capture exists per Neighbor.
         '''
 
-        self.process.insert(0, proc)
+        self.process = proc
 
     def get_proc(self):
         '''
-        Returns the Popen process of this Neighbor
+        Returns the capture process (Subscription) of this Neighbor
         '''
-        return self.process[0]
+        return self.process
+
+
+class NeighborRegistry(object):
+
+    '''
+    Neighbor objects indexed by IP.
+
+    bulk_load() builds every Established peer from a single "show ip bgp neighbor"
+    (all peers), so startup costs one vtysh call no matter how many peers there are.
+    '''
+
+    def __init__(self):
+        self.neighbors = {}
+
+    def __len__(self):
+        return len(self.neighbors)
+
+    def __contains__(self, ip):
+        return ip in self.neighbors
+
+    def __iter__(self):
+        return iter(self.neighbors.values())
+
+    def get(self, ip):
+        return self.neighbors.get(ip)
+
+    def ips(self):
+        return set(self.neighbors)
+
+    def insert(self, neighbor):
+        '''
+        Registers an existing Neighbor object, replacing any Neighbor with the same IP
+        '''
+
+        self.neighbors[neighbor.ip] = neighbor
+
+    def add(self, ip, state=None):
+        '''
+        Adds a Neighbor for ip, unless it is already registered.
+
+        Returns the Neighbor
+        '''
+
+        neighbor = self.neighbors.get(ip)
+
+        if neighbor is None:
+            neighbor = Neighbor(ip, state)
+            self.neighbors[ip] = neighbor
+
+        return neighbor
+
+    def remove(self, ip):
+        '''
+        Removes and returns the Neighbor for ip, or None if it wasn't registered
+        '''
+
+        return self.neighbors.pop(ip, None)
+
+    def bulk_load(self, neighbor_output=None):
+        '''
+        Registers every Established peer from one "show ip bgp neighbor" (all peers).
+
+        Keyword Args:
+        (optional) neighbor_output - String output of "show ip bgp neighbor". Used in testing without Quagga
+
+        Returns number of neighbors added
+        '''
+
+        if neighbor_output is None:
+            neighbor_output = send_command(show_command("show ip bgp neighbor"))
+
+        added = 0
+
+        for ip, state in bgp_parser.parse_neighbors(neighbor_output).items():
+            if state.state == "Established" and ip not in self.neighbors:
+                self.add(ip, state)
+                added += 1
+
+        return added
 
 
 def start_troubleshooting(Neighbor):
@@ -100,13 +322,67 @@ def start_troubleshooting(Neighbor):
         return
 
     Neighbor.troubleshooting = True
+    metrics.inc("bgp_monitor_troubleshooting_sessions_total")
+    metrics.inc("bgp_monitor_troubleshooting_active")
+
+    if routes is not None:
+        Neighbor.route = routes.get(Neighbor.ip)
+
+    if incidents is not None:
+        Neighbor.group, opened = incidents.join(Neighbor, lambda: open_incident(Neighbor))
+        Neighbor.incident = Neighbor.group.incident
+    else:
+        Neighbor.incident = open_incident(Neighbor)
+        opened = True
+
+    if history is not None:
+        reason = trigger_reason(Neighbor)
+
+        if not opened:
+            reason += ", failing with " + Neighbor.group.leader.ip
+
+        Neighbor.session = history.open(Neighbor.ip, Neighbor.incident, neighbor_interface(Neighbor),
+                                        Neighbor.remote_as, reason)
+        Neighbor.session.observe(Neighbor.silence)
 
     start_debugging(Neighbor)
-    start_capture(Neighbor)
 
-    # start_logging will block all other commands. Run last.
+    if not opened:
+        # Failing together with peers already being troubleshot. Share their capture and system snapshot.
+        metrics.inc("bgp_monitor_correlated_peers_total")
+        join_capture(Neighbor, Neighbor.group)
+        return
+
+    start_capture(Neighbor)
     start_logging(Neighbor)
 
+    if Neighbor.group is not None:
+        Neighbor.group.collection = Neighbor.collection
+
+
+def trigger_reason(Neighbor):
+    '''
+    Returns a short description of why the Neighbor is being troubleshot, ex. "no message for 76.0s"
+    '''
+
+    reason = "no message for %.1fs" % Neighbor.silence
+
+    if Neighbor.warning is not None:
+        reason += ", " + Neighbor.warning
+
+    return reason
+
+
+def open_incident(Neighbor):
+    '''
+    Returns a new artifact_store incident id for the Neighbor, or None if there is no store
+    '''
+
+    if artifacts is None:
+        return None
+
+    return artifacts.new_incident(Neighbor.ip)
+
 
 def stop_troubleshooting(Neighbor):
     '''
@@ -123,10 +399,34 @@ def stop_troubleshooting(Neighbor):
     if debug:
         print "Stopping..."
 
-    stop_logging(Neighbor)
-    stop_debugging(Neighbor)
-    stop_capture(Neighbor)
+    group = Neighbor.group
+
+    if group is None:
+        stop_logging(Neighbor)
+        stop_debugging(Neighbor)
+        stop_capture(Neighbor)
+    else:
+        stop_debugging(Neighbor)
+        Neighbor.group = None
+        # The group owns the collection and capture, only drop this peer's references to them
+        Neighbor.collection = None
+        Neighbor.set_proc(None)
+
+        # The group's capture and system snapshot run until its last member recovers
+        if incidents.leave(group, Neighbor.ip):
+            if group.collection is not None:
+                group.collection.cancel()
+
+            for subscription in group.subscriptions:
+                subscription.terminate()
+
+    if history is not None and Neighbor.session is not None:
+        history.close(Neighbor.session, Neighbor.incident_state.extensions)
+
+    Neighbor.session = None
     Neighbor.troubleshooting = False
+    Neighbor.incident_state.reset()
+    metrics.inc("bgp_monitor_troubleshooting_active", -1)
 
 
 def start_debugging(Neighbor):
@@ -139,100 +439,279 @@ def start_debugging(Neighbor):
 
     debug_list = ["debug bgp keepalives", "debug bgp updates in", "debug bgp updates out"]
 
-    for debug in debug_list:
-        send_command(debug + " " + Neighbor.ip)
+    with debug_lock:
+        debugging_neighbors.add(Neighbor.ip)
+
+        for debug in debug_list:
+            send_command(debug + " " + Neighbor.ip)
 
 
 def stop_debugging(Neighbor):
     '''
-    Disables all BGP debugs
+    Disables all BGP debugs once no other neighbor is being troubleshot.
+
+    "no debug bgp" is global, so it is only sent after the last
+    neighbor under investigation recovers.
 
     Keyword Args:
     Neighbor - Neighbor object to undebug
     '''
 
-    send_command("no debug bgp")
+    with debug_lock:
+        debugging_neighbors.discard(Neighbor.ip)
+
+        if not debugging_neighbors:
+            send_command("no debug bgp")
 
 
 def start_logging(Neighbor):
     '''
     Collects system data and logs it to a file.
 
+    The commands run concurrently in the background (see diag_collector), so this
+    returns immediately and the monitor keeps checking other neighbors.
+
     Keyword Args:
     Neighbor - Neighbor object to collect data about
     '''
 
-    info_file = "bgp_log_" + Neighbor.ip + "_" + datetime.datetime.now().strftime("%m%d%Y_%H%M%S") + ".log"
+    info_file = new_artifact(Neighbor, "bgp_log_" + Neighbor.ip + "_" + datetime.datetime.now().strftime("%m%d%Y_%H%M%S") + ".log")
 
     if debug:
         print "Log File: " + info_file
     # Current data to collect:
-    #   Top 10 proceses by CPU utilization (thanks nixcraft!)
-    #   Memory utilization
-    #   socket information
-    #   data plane interface data
+    #   per-second CPU, memory and interface counters, top 10 processes by CPU (read in-process from /proc and /sys)
+    #   socket information (read in-process from sock_diag, "ss" if netlink isn't available)
     #   attempt to ping neighbor  
+    # counters and ping are limited to the neighbor's interface when its route is known
 
-    command_list = ["ps -eo pcpu,pid,user,args | sort -k 1 -r | head -10",
-                    "vmstat",
-                    "ss",
-                    "cl-netstat",
-                    "ping -c 5 " + Neighbor.ip,
-                    ]
+    interface = neighbor_interface(Neighbor)
 
-    raw_file = open(info_file, 'a')
+    if interface is None:
+        command_list = [system_collector(None, history_stats(Neighbor)), socket_snapshot, "ping -c 5 " + Neighbor.ip]
+    else:
+        command_list = [system_collector([interface], history_stats(Neighbor)), socket_snapshot,
+                        "ping -c 5 -I " + interface + " " + Neighbor.ip]
 
-    for command in command_list:
+    Neighbor.collection = collector.collect(info_file, command_list, callback=artifact_callback(Neighbor))
 
-        if debug:
-            print "Collecting " + command
 
-        raw_file.write(command + "\n")
-        raw_file.write("==================\n")
-        p = Popen(command, shell=True, stdout=PIPE, stderr=PIPE)
-        raw_file.write(p.communicate()[0])
-        raw_file.write("\n\n")
+def system_collector(interfaces=None, summary_callback=None):
+    '''
+    Returns the diag_collector command for a system snapshot: a function returning
+    a per-second time series of CPU, memory and interface counters over snapshot_seconds,
+    and the processes that used the most CPU in that time.
+    Read from /proc and /sys, where ps, vmstat and cl-netstat would each start processes.
+
+    Keyword Args:
+    interfaces - interface names to report counters for. Defaults to every interface
+    summary_callback - optional, called with system_stats.summarize() of the snapshot
+    '''
+
+    def system_snapshot():
+        sampler = system_stats.Sampler(snapshot_seconds, interfaces=interfaces)
+        lines = sampler.collect()
+
+        if summary_callback is not None:
+            summary_callback(sampler.summary())
+
+        return lines
+
+    return system_snapshot
+
+
+def history_stats(Neighbor):
+    '''
+    Returns a function that records summary statistics under the Neighbor's
+    current history session, or None if there is no history
+    '''
+
+    if history is None or Neighbor.session is None:
+        return None
+
+    # Bind the session now, it may have ended by the time the statistics are ready
+    session = Neighbor.session
+
+    return lambda stats: history.add_stats(session, stats)
+
+
+def neighbor_interface(Neighbor):
+    '''
+    Returns the name of the interface the Neighbor is reached through, or None if it isn't known
+    '''
+
+    if Neighbor.route is None:
+        return None
+
+    # Behind ECMP the kernel only told us the path it picked for our query, not the session's
+    if not route_lookup.path_known(Neighbor.route):
+        return None
 
-    raw_file.close()
+    return Neighbor.route.interface
+
+
+def socket_snapshot():
+    '''
+    Returns list of lines describing every TCP socket, read over netlink (sock_diag).
+    Falls back to running "ss" if netlink sock_diag isn't available.
+    '''
+
+    try:
+        return sock_diag.format_sessions(sock_diag.dump())
+    except (socket.error, OSError) as e:
+        if debug:
+            print "sock_diag failed, running ss: " + str(e)
+        return command_trace.run("ss").splitlines()
 
 
 def stop_logging(Neighbor):
     '''
-    Disables any logging
+    Stops any diagnostic commands still running for the Neighbor
 
+    Keyword Args:
+    Neighbor - Neighbor object to stop logging
     '''
-    # Nothing currently to disable. Stub for future use.
-    pass
+
+    if Neighbor.collection is not None:
+        Neighbor.collection.cancel()
+        Neighbor.collection = None
 
 
 def start_capture(Neighbor):
     '''
-    Starts a tcpdump capture on the interface the Neighbor lives on.
+    Starts a tcpdump capture on the interface the Neighbor lives on,
+    or on every interface if its route isn't known.
 
     Keyword Arguments:
     Neighbor - the neighbor object to capture
 
-    Returns:
-    Popen process. 
+    The capture is a subscription to a tcpdump shared with every other neighbor
+    being troubleshot. Only packets to or from the Neighbor are written to its file.
+
+    If the flight recorder is running, the BGP packets from before the trigger
+    are written next to the live capture as bgp_flight_<ip>_<time>.pcap
     '''
 
-    # TCPdump is dumb and can't limit a single capture based on size.
+    timestamp = datetime.datetime.now().strftime("%m%d%Y_%H%M%S")
+
+    if flight_recorder is not None:
+        flight_file = new_artifact(Neighbor, "bgp_flight_" + Neighbor.ip + "_" + timestamp + ".pcap")
+        flight_recorder.freeze(flight_file, Neighbor.ip)
+        capture_callback(Neighbor)(flight_file)
+
     # 10k packets is arbritary. This is about 15megs at 1500 bytes of .64 megs at 64k. I assume we can detect the trend either way.
 
-    capture_string = "nohup tcpdump -W 1 -c 10000 -s 0 -w 'bgp_auto_capture_" + Neighbor.ip + "_" + datetime.datetime.now().strftime("%m%d%Y_%H%M%S") + ".pcap' -i any not port 22"
+    capture_file = new_artifact(Neighbor, "bgp_auto_capture_" + Neighbor.ip + "_" + timestamp + ".pcap")
+
+    interface = neighbor_interface(Neighbor) or "any"
+
+    if debug:
+        print "Capturing " + Neighbor.ip + " on " + interface
+
+    Neighbor.set_proc(captures.subscribe(Neighbor.ip, capture_file, interface=interface, max_packets=10000,
+                                         callback=capture_callback(Neighbor)))
+
+    if Neighbor.group is not None:
+        Neighbor.group.share_capture(interface, Neighbor.get_proc())
+
+
+def join_capture(Neighbor, group):
+    '''
+    Adds a correlated Neighbor to its group's capture on the Neighbor's interface,
+    or starts a capture for the group there if it has none.
+
+    Keyword Args:
+    Neighbor - the Neighbor joining the group
+    group - incident_groups.IncidentGroup
+    '''
 
-    Neighbor.set_proc(Popen(capture_string, shell=True, stdout=PIPE, stderr=PIPE))
+    interface = neighbor_interface(Neighbor) or "any"
+    subscription = group.capture_on(interface) or group.capture_on("any")
+
+    if subscription is not None:
+        subscription.add_peer(Neighbor.ip)
+        return
+
+    timestamp = datetime.datetime.now().strftime("%m%d%Y_%H%M%S")
+    capture_file = new_artifact(Neighbor, "bgp_auto_capture_" + Neighbor.ip + "_" + timestamp + ".pcap")
+
+    group.share_capture(interface, captures.subscribe(Neighbor.ip, capture_file, interface=interface,
+                                                      max_packets=10000, callback=capture_callback(Neighbor)))
+
+
+def new_artifact(Neighbor, name):
+    '''
+    Returns the path to write a log or capture to, recording it under the Neighbor's incident.
+
+    Keyword Args:
+    Neighbor - Neighbor object being troubleshot
+    name - file name. ex. "bgp_log_10.1.1.1_10182026_140102.log"
+    '''
+
+    if artifacts is None:
+        path = name
+    else:
+        path = artifacts.path(name)
+        artifacts.add(Neighbor.incident, path)
+
+    if history is not None and Neighbor.session is not None:
+        history.add_artifact(Neighbor.session, path)
+
+    return path
+
+
+def artifact_callback(Neighbor):
+    '''
+    Returns a function that hands a finished artifact to the artifact store
+    for compression and eviction, or None if there is no store.
+    '''
+
+    if artifacts is None:
+        return None
+
+    # Bind the incident now, the Neighbor may be troubleshooting a new one when the file completes
+    incident = Neighbor.incident
+    stored = history.finalize_artifact if history is not None else None
+
+    return lambda path: artifacts.finalize(incident, path, stored)
+
+
+def capture_callback(Neighbor):
+    '''
+    Returns a function that counts the bytes of a finished pcap and hands it to artifact_callback()
+    '''
+
+    finalize = artifact_callback(Neighbor)
+    record = history_stats(Neighbor)
+
+    def capture_done(path):
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = None
+
+        if size is not None:
+            metrics.inc("bgp_monitor_capture_bytes_total", size)
+
+            if record is not None:
+                record({"capture_bytes": size})
+
+        if finalize is not None:
+            finalize(path)
+
+    return capture_done
 
 
 def stop_capture(Neighbor):
     '''
-    Kill the TCPdump process
+    Stops the Neighbor's capture. tcpdump exits when no neighbor is capturing.
 
     Keyword Args:
     Neighbor - Neighbor object to disable TCP dump
     '''
 
     Neighbor.get_proc().terminate()
+    Neighbor.set_proc(None)
 
     if debug:
         print "Capture terminated"
@@ -241,40 +720,159 @@ def stop_capture(Neighbor):
 def neighbor_received_message(Neighbor):
     '''
     Takes in a Neighbor object and determines if a message has been heard.
-    It waits at least 1 keepalive period since last run before checking for valid messages
+    It waits at least 1 poll interval (normally a keepalive) since last run before checking for valid messages
 
     Returns:
-        True - A message was received or the polling wait time has not yet expired
-        False - A message was not received since at least 1.5 keepalives
+        True - A message was received
+        False - A message was not received since at least 1.25 keepalives
+        None - The polling wait time has not yet expired, nothing was checked
     '''
 
-    time = datetime.datetime.now()
-    now = datetime.timedelta(hours=time.hour, minutes=time.minute, seconds=time.second)
+    now = clock()
+    warning = tcp_warning(Neighbor)
+    probe = probe_warning(Neighbor)
 
-    # don't do anything if we haven't waited at least one keepalive since last check
-    if now < Neighbor.last_run + Neighbor.keepalive:
-        return True
+    # don't do anything if we haven't waited at least one poll interval since last check,
+    # unless the kernel's TCP state or the prober says the session is in trouble
+    if now < Neighbor.last_run + Neighbor.poll_interval and warning is None and probe is None:
+        return None
+
+    if debug and warning is not None:
+        print "Neighbor " + Neighbor.ip + " TCP warning: " + warning
+
+    if debug and probe is not None:
+        print "Neighbor " + Neighbor.ip + " probe warning: " + probe
 
     Neighbor.last_run = now 
-    current_read = get_last_read(Neighbor.ip)
+    current_read, sniffed = last_heard(Neighbor)
+    metrics.set("bgp_monitor_last_read_seconds", current_read.total_seconds(), peer=Neighbor.ip)
 
-    # how much to pad the keepalive to worry
-    jittered_keepalive = Neighbor.keepalive.seconds * 1.25  
+    # kept for the incident history
+    Neighbor.silence = current_read.total_seconds()
+    warnings = []
+
+    if warning is not None:
+        warnings.append("TCP " + warning)
+
+    if probe is not None:
+        warnings.append("probe " + probe)
+
+    Neighbor.warning = ", ".join(warnings) or None
+
+    if Neighbor.session is not None:
+        Neighbor.session.observe(Neighbor.silence)
 
-    # don't do anything if we heard a message    
-    if current_read.seconds < jittered_keepalive:
+    if poll_policy is not None:
+        Neighbor.poll_interval = poll_policy.next_interval(Neighbor, current_read,
+                                                           warning is not None or probe is not None)
+    elif sniffed:
+        Neighbor.poll_interval = Neighbor.keepalive.total_seconds()
+
+    # how much to pad the keepalive to worry
+    jittered_keepalive = Neighbor.keepalive.total_seconds() * 1.25  
+
+    # don't do anything if we heard a message. A probe alarm only brings the check forward,
+    # it starts troubleshooting before the session misses keepalives if the TCP state agrees.
+    if current_read.total_seconds() < jittered_keepalive and (probe is None or warning is None):
+        if sniffed:
+            # the exact time of the last message is known, look again right when it would be overdue
+            Neighbor.poll_interval = jittered_keepalive - current_read.total_seconds() + sniff_margin
         return True
 
+    # First detection of this silence. Later checks are the same incident.
+    if not Neighbor.troubleshooting:
+        metrics.observe("bgp_monitor_detection_latency_seconds", current_read.total_seconds())
+
     return False
 
 
-def get_last_read(neighbor_ip):
+def last_heard(Neighbor):
+    '''
+    Returns (datetime.timedelta since the last message from the Neighbor, True if it came from the sniffer).
+    Peers the sniffer hasn't heard from yet fall back to vtysh "Last read".
+
+    A silence seen only by the sniffer is confirmed with vtysh first. If the reader thread died,
+    the socket is dropping packets or the peer's path moved off the sniffed interface, the
+    sniffer's age grows without bound while the peer is fine.
+    '''
+
+    if sniffer is not None:
+        age = sniffer.age(Neighbor.ip)
+
+        if age is not None:
+            heard = datetime.timedelta(seconds=age)
+
+            if age < Neighbor.keepalive.total_seconds() * 1.25:
+                return heard, True
+
+            last_read = get_last_read(Neighbor.ip)
+
+            # "Last read" only has one second resolution
+            if last_read + datetime.timedelta(seconds=1) < heard:
+                if debug:
+                    print "Sniffer hasn't heard " + Neighbor.ip + " for " + str(heard) + ", vtysh has " + str(last_read)
+
+                return last_read, False
+
+            return heard, True
+
+    return get_last_read(Neighbor.ip), False
+
+
+def probe_warning(Neighbor):
+    '''
+    Returns the prober's description of a loss or latency burst on the path to the Neighbor,
+    or None if the probes look healthy or probing is off
+    '''
+
+    if prober is None:
+        return None
+
+    return prober.warning(Neighbor.ip)
+
+
+def tcp_warning(Neighbor):
+    '''
+    Checks the kernel's view of the Neighbor's TCP session (sock_diag), which costs
+    no vtysh call and has millisecond resolution.
+
+    Returns a string describing what looks wrong, or None if the session looks
+    healthy or TCP inspection is off
+    '''
+
+    if tcp_table is None:
+        return None
+
+    try:
+        session = tcp_table.get(Neighbor.ip)
+    except (socket.error, OSError) as e:
+        if debug:
+            print "sock_diag failed: " + str(e)
+        return None
+
+    if session is None or session.state != "ESTABLISHED":
+        return "no established TCP session"
+
+    if session.last_data_recv is not None and session.last_data_recv >= Neighbor.keepalive.total_seconds():
+        return "no data received for %.3fs" % session.last_data_recv
+
+    if session.retransmits:
+        return "retransmitting (%d)" % session.retransmits
+
+    if session.probes:
+        return "%d unanswered zero window probes" % session.probes
+
+    return None
+
+
+def get_last_read(neighbor_ip, test_output=None):
     '''
     Returns datetime.timedelta object of last read value
     based on the line "Last read" in the output of "show ip bgp neighbor"
 
     Keyword Args:
     neighbor_ip - string IP address of the neighbor to find
+    (optional) test_output - String output of neighbor. Used in testing without Quagga
 
     Returns:
     datetime.timedelta() object of the Last Read value
@@ -290,34 +888,83 @@ def get_last_read(neighbor_ip):
         Neighbor capabilities:
     '''
 
+    state = get_neighbor_state(neighbor_ip, test_output)
+
     # if parsing fails, this should make it look like the neighbor isn't up
-    dt = datetime.timedelta(hours=99) 
-
-    for line in send_command("show ip bgp neighbor " + neighbor_ip).split("\n"):
-        if line.strip().find("Last read") > -1:
-            read_list = line.strip()[10:line.find(",") - 2].split(":")
-            dt = datetime.timedelta(hours=int(read_list[0]),
-                                    minutes=int(read_list[1]),
-                                    seconds=int(read_list[2]))
-            break
+    if state is None or state.last_read is None:
+        return datetime.timedelta(hours=99)
+
+    return state.last_read
+
+
+def get_neighbor_state(neighbor_ip, test_output=None):
+    '''
+    Looks up the parsed "show ip bgp neighbor" state of a single neighbor.
+    Uses the batch neighbor_table when it is enabled.
+
+    Keyword Args:
+    neighbor_ip - string IP address of the neighbor to find
+    (optional) test_output - String output of neighbor. Used in testing without Quagga
 
-    return dt
+    Returns bgp_parser.NeighborState, or None if the neighbor isn't configured
+    '''
+
+    if test_output is None:
+        if neighbor_table is not None:
+            return neighbor_table.get(neighbor_ip)
+
+        test_output = send_command(show_command("show ip bgp neighbor " + neighbor_ip))
+
+    return bgp_parser.parse_neighbors(test_output).get(neighbor_ip)
+
+
+def show_command(command):
+    '''
+    Returns the command with " json" appended when the JSON parser backend is in use
+    '''
+
+    if json_output:
+        return command + " json"
+
+    return command
 
 
 def send_command(command):
     '''
     Send a command to Linux. Assumes Quagga will receive the command by default.
 
+    If persistent sessions are enabled the command goes to a pooled vtysh session.
+    A one-off vtysh process is only started if the pool fails.
+
     Keyword Arguments:
     command - string to send. ex. "show ip bgp summary"
 
     Returns: string output of the command
     '''
 
-    cmd = "vtysh -c '" + command + "'"
-    p = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE)
+    start = clock()
+
+    try:
+        if vtysh_pool is not None:
+            try:
+                return vtysh_pool.send(command)
+            except vtysh_session.VtyshError as e:
+                if debug:
+                    print "vtysh session failed, spawning vtysh: " + str(e)
+
+        return command_trace.run("vtysh -c '" + command + "'")
 
-    return p.communicate()[0]
+    finally:
+        metrics.observe("bgp_monitor_vtysh_seconds", clock() - start, command=command_template(command))
+
+
+def command_template(command):
+    '''
+    Returns the command with addresses replaced, so per-peer commands share one metric series.
+    ex. "show ip bgp neighbor 10.1.1.1" -> "show ip bgp neighbor <ip>"
+    '''
+
+    return command_trace.template(command)
 
 
 def get_hold_time(neighbor_ip, test_output=None):
@@ -341,25 +988,12 @@ def get_hold_time(neighbor_ip, test_output=None):
         Neighbor capabilities:
     '''
 
-    if test_output is None:
-        output = send_command("show ip bgp neighbor " + neighbor_ip)
-    else:
-        output = test_output
-
-    hold_time = 0
-    keepalive = 0
-
-    for line in output.split("\n"):
-        if line.find("Hold time") > 0:
-            for word in line.split(" "):
-                if len(word) > 0:
-                    if word[0].isdigit():
-                        if hold_time == 0:
-                            hold_time = int(word[:len(word) - 1])
-                        else:
-                            keepalive = int(word)
+    state = get_neighbor_state(neighbor_ip, test_output)
+
+    if state is None:
+        return (0, 0)
 
-    return (hold_time, keepalive)
+    return (state.hold_time, state.keepalive)
 
 
 def extract_established_neighbors(list_of_neighbor_lines):
@@ -416,35 +1050,149 @@ def parse_bgp_summary(summary_output):
         Total number of neighbors 3
     '''
 
-    output_list = summary_output.split("\n")
-
-    neighbor_line = 0
-    last_neighbor = 0
-    counting_neighbors = False
     neighbor_line_list = []
+    counting_neighbors = False
 
-    for line in output_list:
+    for line in summary_output.split("\n"):
+
+        if line[:12] == "Total number":
+            break
+
+        if counting_neighbors and len(line.strip()) > 0:
+            neighbor_line_list.append(line)
 
         if line[:8] == "Neighbor":
             counting_neighbors = True
 
-        if not line[:8] == "Neighbor":
-            if not counting_neighbors:
-                neighbor_line += 1
-            last_neighbor += 1
+    return neighbor_line_list
 
-        if line[:12] == "Total number":
-            break
 
-    last_neighbor -= 1  # Remove blank line before "Total number of neighbors" line
+class NeighborStateTable(object):
+
+    '''
+    Per-IP cache of bgp_parser.NeighborState built from a single "show ip bgp neighbor".
+
+    When set as the global neighbor_table, get_last_read(), get_hold_time() and
+    bgp_neighbor_up() read from this table instead of issuing a vtysh command per peer.
+    The table is reused for half of the shortest poll interval of the monitored peers,
+    so every neighbor checked in the same tick shares one vtysh call, and a peer on 60s
+    keepalives isn't behind a full reparse every second. Parsing the whole table takes
+    about 0.6s for 10000 peers, so that is the most peers fast (1s keepalive) timers can
+    share one table with.
+    '''
+
+    def __init__(self, max_age=None, intervals=None, min_age=1):
+        '''
+        max_age = seconds a poll is reused before "show ip bgp neighbor" is sent again, None to derive it
+        intervals = function returning the poll intervals of the monitored peers, max_age is half the shortest
+        min_age = shortest derived max_age, and the max_age while no interval is known
+        table = IP -> bgp_parser.NeighborState from the last poll
+        updated = clock() time of the last poll, None before the first poll
+        age = max_age of the last poll
+        '''
 
-    counter = neighbor_line + 1
+        self.max_age = max_age
+        self.intervals = intervals
+        self.min_age = min_age
+        self.lock = threading.Lock()
+        self.table = {}
+        self.updated = None
+        self.age = min_age
 
-    while counter < last_neighbor:
-        neighbor_line_list.append(output_list[counter])
-        counter += 1
+    def refresh(self):
+        '''
+        Polls every neighbor with one "show ip bgp neighbor"
+        '''
+
+        self.table = bgp_parser.parse_neighbors(send_command(show_command("show ip bgp neighbor")))
+        self.updated = clock()
+        self.age = self.next_age()
+
+    def next_age(self):
+        '''
+        Returns the seconds the current poll can be reused for
+        '''
+
+        if self.max_age is not None:
+            return self.max_age
+
+        # Once per poll, not per get(), it walks every peer
+        intervals = [interval for interval in self.intervals() if interval > 0] if self.intervals else []
+
+        if not intervals:
+            return self.min_age
+
+        return max(min(intervals) / 2.0, self.min_age)
+
+    def get(self, ip):
+        '''
+        Returns the bgp_parser.NeighborState for ip, or None if the peer is not configured.
+        Polls first if the table is older than its age.
+        '''
+
+        with self.lock:
+            if self.updated is None or clock() - self.updated >= self.age:
+                self.refresh()
+
+            return self.table.get(ip)
 
-    return neighbor_line_list
+
+class AdaptivePolling(object):
+
+    '''
+    Stretches the poll interval of steady peers and shortens it for peers that look unwell.
+
+    Every check that finds a message within the last keepalive grows the interval
+    by growth, up to max_interval(). A last read of a keepalive or more (the age is
+    growing), or a peer being troubleshot, drops the interval to fast_interval() at once.
+
+    The longest interval keeps detection inside the hold time. A peer that goes
+    silent right after a healthy check has a last read under one keepalive, so it is
+    noticed at most keepalive + max_interval after its last message:
+
+        max_interval = hold_margin * hold time - keepalive    (102s for 60/180, 1.7s for 1/3)
+
+    A check that sees the age growing switches to fast polling, so a silence caught
+    early is still flagged at 1.25 keepalives plus one fast interval.
+    '''
+
+    def __init__(self, growth=1.5, hold_margin=0.9, fast_fraction=0.25, min_interval=0.5):
+        '''
+        growth = interval multiplier after each healthy check
+        hold_margin = fraction of the hold time a silence must be detected within
+        fast_fraction = fast poll interval as a fraction of the keepalive
+        min_interval = shortest poll interval in seconds
+        '''
+
+        self.growth = growth
+        self.hold_margin = hold_margin
+        self.fast_fraction = fast_fraction
+        self.min_interval = min_interval
+
+    def max_interval(self, Neighbor):
+        keepalive = Neighbor.keepalive.total_seconds()
+
+        return max(self.hold_margin * Neighbor.hold_time.total_seconds() - keepalive, keepalive)
+
+    def fast_interval(self, Neighbor):
+        return max(Neighbor.keepalive.total_seconds() * self.fast_fraction, self.min_interval)
+
+    def next_interval(self, Neighbor, last_read, suspect=False):
+        '''
+        Returns seconds until the Neighbor's next check
+
+        Keyword Args:
+        Neighbor - the Neighbor just checked
+        last_read - datetime.timedelta since the last message, from get_last_read()
+        suspect - another signal (ex. TCP state) says the session is in trouble
+        '''
+
+        keepalive = Neighbor.keepalive.total_seconds()
+
+        if suspect or Neighbor.troubleshooting or last_read.total_seconds() >= keepalive:
+            return self.fast_interval(Neighbor)
+
+        return min(max(Neighbor.poll_interval, keepalive) * self.growth, self.max_interval(Neighbor))
 
 
 def bgp_neighbor_up(neighbor_ip):
@@ -457,63 +1205,526 @@ def bgp_neighbor_up(neighbor_ip):
     Returns True if neighbor is Established, else False
     '''
 
-    output = send_command("show ip bgp neighbor " + neighbor_ip)
+    state = get_neighbor_state(neighbor_ip)
 
-    for line in output.split("\n"):
-        if line.find("BGP state") > 0:
-            return line.strip().split(" ")[3] == "Established,"  # comma in output, easier than splicing
+    return state is not None and state.state == "Established"
 
 
-def main(argv):
-    global debug
+def get_established_neighbors():
+    '''
+    Returns list of IPs (as string) of every Established neighbor in "show ip bgp summary"
+    '''
+
+    summary = bgp_parser.parse_summary(send_command(show_command("show ip bgp summary")))
+
+    return [peer.ip for peer in summary if peer.state == "Established"]
+
+
+def detect_json_output():
+    '''
+    Returns True if the routing suite supports "show ip bgp summary json"
+    '''
+
+    return bgp_parser.is_json(send_command("show ip bgp summary json"))
+
+
+def check_neighbor(Neighbor):
+    '''
+    Runs a single liveliness check of a Neighbor and starts or stops
+    troubleshooting based on the result.
+
+    Keyword Args:
+    Neighbor - the Neighbor object to check
+
+    Returns True if the neighbor is still Established, else False
+    '''
+
+    if not bgp_neighbor_up(Neighbor.ip):
+        if debug:
+            print "Neighbor " + Neighbor.ip + " down"
+        stop_troubleshooting(Neighbor)
+        return False
+
+    # Check if we heard a message from the neighbor
+    received = neighbor_received_message(Neighbor)
+
+    # Not due yet (ex. an early check_now()). Not a healthy check, hysteresis must not count it.
+    if received is None:
+        return True
+
+    if hysteresis is not None:
+        extensions = Neighbor.incident_state.extensions
+        action = hysteresis.update(Neighbor.incident_state, received)
+
+        if Neighbor.incident_state.extensions > extensions:
+            metrics.inc("bgp_monitor_troubleshooting_extended_total")
+    else:
+        action = incident_hysteresis.STOP if received else incident_hysteresis.START
+
+    if action == incident_hysteresis.START:
+        if debug:
+            print "Troubleshooting Neighbor " + Neighbor.ip
+        start_troubleshooting(Neighbor)
+    elif action == incident_hysteresis.STOP:
+        if debug:
+            print "Neighbor " + Neighbor.ip + " alive, waiting"
+        stop_troubleshooting(Neighbor)
+
+    return True
+
+
+class NeighborMonitor(object):
 
-    options, remainder = getopt.getopt(sys.argv[1:], "", ["debug"])
+    '''
+    Schedules check_neighbor() for many Neighbor objects at once.
+
+    The dispatcher thread only decides which peers are due, using a
+    deadline_scheduler.DeadlineScheduler keyed on the monotonic clock, and sleeps
+    exactly until the next deadline. The checks themselves (vtysh calls, troubleshooting)
+    run on a pool of worker threads, so a peer that is slow to answer never delays
+    the check of another peer.
+
+    A neighbor is out of the scheduler while its check is running and is
+    rescheduled one poll interval (a keepalive unless poll_policy is set) later
+    when the check finishes.
+
+    In daemon mode (reconcile_interval set) the monitor never exits. Every
+    reconcile_interval seconds it re-reads "show ip bgp summary" and diffs it
+    against the registry: new Established peers are polled and monitored, peers
+    that are gone or no longer Established are retired (stopping any capture),
+    and unchanged peers keep their timers without being queried again.
+
+    With tcp_table set (--sock-diag) the kernel's TCP state of every peer is read
+    every tcp_table.max_age seconds, one dump for all of them, and a peer with a new
+    tcp_warning() is checked right away instead of at the end of its poll interval.
+    '''
+
+    reconcile_key = "reconcile"  # scheduler key of the periodic reconcile. Never a valid IP.
+    tcp_watch_key = "tcp-watch"  # scheduler key of the periodic TCP state check. Never a valid IP.
+
+    def __init__(self, list_of_neighbors, workers=worker_count, reconcile_interval=None):
+        '''
+        list_of_neighbors = Neighbor objects to monitor (a list or NeighborRegistry)
+        workers = number of threads used to run checks
+        reconcile_interval = seconds between peer set reconciles, None to exit once every neighbor is down
+        registry = NeighborRegistry of the neighbors being monitored
+        scheduler = DeadlineScheduler of neighbor IP -> next check time
+        tcp_warned = IPs that had a TCP warning at the last TCP state check
+        '''
+
+        self.pool = ThreadPool(workers)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.reconcile_interval = reconcile_interval
+        self.registry = NeighborRegistry()
+        self.scheduler = deadline_scheduler.DeadlineScheduler(clock)
+        self.tcp_warned = set()
+
+        for neighbor in list_of_neighbors:
+            self._add(neighbor)
+
+        if reconcile_interval is not None:
+            self.scheduler.schedule_in(self.reconcile_key, reconcile_interval)
+
+        if tcp_table is not None:
+            self.scheduler.schedule_in(self.tcp_watch_key, tcp_table.max_age)
+
+    def run(self):
+        '''
+        Dispatches checks until every neighbor has gone down, or forever in daemon mode.
+        '''
+
+        try:
+            while True:
+                with self.lock:
+                    if not self.registry and self.reconcile_interval is None:
+                        break
+
+                    for key in self.scheduler.pop_due():
+                        if key == self.reconcile_key:
+                            self.pool.apply_async(self._reconcile)
+                        elif key == self.tcp_watch_key:
+                            self.pool.apply_async(self._watch_tcp)
+                        else:
+                            self.pool.apply_async(self._check, (self.registry.get(key),))
+
+                    wait_time = self.scheduler.time_until_next()
+                    self.wakeup.clear()
+
+                # Sleep until the next neighbor is due or a worker finishes.
+                # Always use a timeout, an untimed wait can't be interrupted with ctrl+c.
+                if wait_time is None:
+                    wait_time = 1
+
+                self.wakeup.wait(wait_time)
+
+        finally:
+            self.stop()
+
+    def run_pending(self):
+        '''
+        Runs every due check and reconcile on the calling thread instead of the workers.
+        Used to drive the monitor step by step on a VirtualClock (see bgp_simulator).
+
+        Returns number of keys run
+        '''
+
+        # Look neighbors up as they are popped, like run(). A reconcile earlier in the batch may retire one.
+        with self.lock:
+            due = [(key, self.registry.get(key)) for key in self.scheduler.pop_due()]
+
+        for key, neighbor in due:
+            if key == self.reconcile_key:
+                self._reconcile()
+            elif key == self.tcp_watch_key:
+                self._watch_tcp()
+            else:
+                self._check(neighbor)
+
+        return len(due)
+
+    def check_now(self, ip):
+        '''
+        Moves the next check of a neighbor to now, ex. when the prober sees the path to it losing packets.
+        Safe to call from any thread. A neighbor whose check is already running is left alone.
+        '''
+
+        with self.lock:
+            if ip in self.scheduler:
+                self.scheduler.schedule(ip, clock())
+                self.wakeup.set()
+
+    def ips(self):
+        '''
+        Returns set of the IPs being monitored. Safe to call from any thread.
+        '''
+
+        with self.lock:
+            return self.registry.ips()
+
+    def stop(self):
+        '''
+        Stops troubleshooting any remaining neighbors and shuts down the workers.
+        '''
+
+        self.pool.terminate()
+
+        for neighbor in list(self.registry):
+            stop_troubleshooting(neighbor)
+
+    def reconcile(self, established_ips):
+        '''
+        Diffs the Established peers from "show ip bgp summary" against the registry.
+        New peers are polled and added, missing peers are retired, others are untouched.
+
+        Keyword Args:
+        established_ips - list of Established peer IPs, ex. from get_established_neighbors()
+
+        Returns tuple of (added IPs, removed IPs)
+        '''
+
+        established = set(established_ips)
+
+        with self.lock:
+            current = self.registry.ips()
+
+        removed = current - established
+        added = []
+
+        for ip in removed:
+            self._retire(ip)
+
+        for ip in established - current:
+            state = get_neighbor_state(ip)
+
+            if state is None or state.state != "Established":
+                continue
+
+            with self.lock:
+                self._add(Neighbor(ip, state))
+
+            added.append(ip)
+
+        if debug and (added or removed):
+            print "Reconcile added " + repr(sorted(added)) + " removed " + repr(sorted(removed))
+
+        return sorted(added), sorted(removed)
+
+    def _add(self, neighbor):
+        '''
+        Starts monitoring a neighbor. Caller holds self.lock (or is the constructor).
+        '''
+
+        self.registry.insert(neighbor)
+        self.scheduler.schedule(neighbor.ip, neighbor.last_run + neighbor.poll_interval)
+
+    def _retire(self, ip):
+        '''
+        Stops monitoring a neighbor and any troubleshooting still running for it.
+        '''
+
+        with self.lock:
+            neighbor = self.registry.remove(ip)
+            self.scheduler.cancel(ip)
+
+        if neighbor is not None:
+            stop_troubleshooting(neighbor)
+
+        metrics.remove(peer=ip)
+
+    def _reconcile(self):
+        '''
+        Worker side of the periodic reconcile
+        '''
+
+        try:
+            self.reconcile(get_established_neighbors())
+        except Exception as e:
+            if debug:
+                print "Reconcile failed: " + repr(e)
+
+        with self.lock:
+            self.scheduler.schedule_in(self.reconcile_key, self.reconcile_interval)
+            self.wakeup.set()
+
+    def _watch_tcp(self):
+        '''
+        Worker side of the periodic TCP state check. Checks peers with a new tcp_warning() now.
+        '''
+
+        with self.lock:
+            neighbors = list(self.registry)
+
+        warned = set()
+
+        try:
+            for neighbor in neighbors:
+                if tcp_warning(neighbor) is not None:
+                    warned.add(neighbor.ip)
+        except Exception as e:
+            if debug:
+                print "TCP state check failed: " + repr(e)
+
+        # Only a new warning. A peer that stays in trouble is on fast polling after its check.
+        for ip in warned - self.tcp_warned:
+            self.check_now(ip)
+
+        self.tcp_warned = warned
+
+        with self.lock:
+            self.scheduler.schedule_in(self.tcp_watch_key, tcp_table.max_age)
+            self.wakeup.set()
+
+    def _check(self, Neighbor):
+        '''
+        Worker side of the dispatcher. Runs check_neighbor() and reschedules
+        the neighbor one poll interval from now, or drops it if it went down.
+        '''
+
+        try:
+            up = check_neighbor(Neighbor)
+        except Exception as e:
+            if debug:
+                print "Check of " + Neighbor.ip + " failed: " + repr(e)
+            up = True
+
+        with self.lock:
+            retired = self.registry.get(Neighbor.ip) is not Neighbor
+
+            if up and not retired:
+                self.scheduler.schedule_in(Neighbor.ip, Neighbor.poll_interval)
+            elif not retired:
+                self.registry.remove(Neighbor.ip)
+                metrics.remove(peer=Neighbor.ip)
+
+            self.wakeup.set()
+
+        # Reconciled away while the check was running
+        if retired:
+            stop_troubleshooting(Neighbor)
+
+
+def main(argv):
+    global debug, worker_count, neighbor_table, poll_policy, tcp_table, sniffer, prober, vtysh_pool, json_output
+    global flight_recorder, flight_seconds, flight_bytes, artifacts, routes, incidents, hysteresis, history
+
+    options, remainder = getopt.getopt(sys.argv[1:], "", ["debug", "workers=", "batch", "persistent=",
+                                                          "flight-seconds=", "flight-bytes=",
+                                                          "artifact-dir=", "artifact-mb=", "artifact-days=",
+                                                          "daemon=", "metrics-port=", "trace-file=",
+                                                          "adaptive", "sock-diag", "sniff=",
+                                                          "group-window=", "enter-misses=", "exit-checks=",
+                                                          "min-capture=", "cooldown=", "history-db=",
+                                                          "history-days=", "probe="])
+
+    artifact_dir = "."
+    artifact_mb = 64
+    artifact_days = 7
+    reconcile_interval = None
+    metrics_port = None
+    history_db = None
+    history_days = 400
+    hysteresis = incident_hysteresis.Hysteresis(clock=lambda: clock())
 
     for opt, arg in options:
         if opt in "--debug":
             debug = True
 
-    # Get a list of all Established neighbor IPs
-    ip_list = extract_established_neighbors(
-        parse_bgp_summary(
-            send_command("show ip bgp summary")))
+            # and in every module the monitor runs, their errors are only printed with debug on
+            for module in [vtysh_session, diag_collector, capture_engine, artifact_store, command_trace, sock_diag,
+                           bgp_sniffer, system_stats, route_lookup, incident_groups, incident_hysteresis,
+                           incident_history, liveness_prober]:
+                module.debug = True
+        if opt in "--workers":
+            worker_count = int(arg)
+        if opt in "--batch":
+            # One "show ip bgp neighbor" per tick for all peers
+            neighbor_table = NeighborStateTable()
+        if opt in "--adaptive":
+            # Poll steady peers less often and suspicious peers more often
+            poll_policy = AdaptivePolling()
+        if opt in "--sock-diag":
+            # Read each peer's TCP state from the kernel as an early warning
+            tcp_table = sock_diag.SessionTable(lambda: clock())
+        if opt in "--sniff":
+            # Timestamp every BGP message off a packet socket. "any" listens on every interface
+            sniffer = bgp_sniffer.Sniffer(None if arg == "any" else arg, lambda: clock())
+        if opt in "--probe":
+            # ICMP echo every peer every <arg> seconds (ex. 0.2), loss or latency bursts trigger troubleshooting
+            prober = liveness_prober.Prober(float(arg), clock=lambda: clock())
+        if opt in "--persistent":
+            # Pool of long lived vtysh sessions instead of a vtysh process per command
+            vtysh_pool = vtysh_session.VtyshPool(int(arg))
+        if opt in "--flight-seconds":
+            flight_seconds = int(arg)
+        if opt in "--flight-bytes":
+            flight_bytes = int(arg)
+        if opt in "--artifact-dir":
+            artifact_dir = arg
+        if opt in "--artifact-mb":
+            artifact_mb = int(arg)
+        if opt in "--artifact-days":
+            artifact_days = int(arg)
+        if opt in "--daemon":
+            # Keep running, re-reading the peer list every <arg> seconds
+            reconcile_interval = int(arg)
+        if opt in "--metrics-port":
+            metrics_port = int(arg)
+        if opt in "--group-window":
+            # Seconds within which related failing peers share an incident, 0 troubleshoots each peer alone
+            incidents = incident_groups.IncidentGroups(int(arg), lambda: clock()) if int(arg) > 0 else None
+        if opt in "--enter-misses":
+            # Missed checks in a row that start troubleshooting
+            hysteresis.enter_after = int(arg)
+        if opt in "--exit-checks":
+            # Healthy checks in a row before troubleshooting can stop
+            hysteresis.exit_after = int(arg)
+        if opt in "--min-capture":
+            # Seconds every troubleshooting session runs for at least
+            hysteresis.min_duration = int(arg)
+        if opt in "--cooldown":
+            # Seconds a recovered peer keeps its capture in case it fails again
+            hysteresis.cooldown = int(arg)
+        if opt in "--history-db":
+            # SQLite incident history, "none" to keep no history. Defaults to bgp_incidents.db in the artifact dir
+            history_db = arg
+        if opt in "--history-days":
+            history_days = int(arg)
+        if opt in "--trace-file":
+            # Append every external command to a JSON lines file
+            command_trace.tracer.open(arg)
+
+    # kill -USR1 prints per command timing to stderr
+    command_trace.install_signal()
+
+    if metrics_port is not None:
+        # Prometheus scrape endpoint on localhost
+        monitor_metrics.serve(metrics, metrics_port)
+
+    # Compress logs and captures and keep them within a disk budget
+    artifacts = artifact_store.ArtifactStore(artifact_dir, artifact_mb * 1024 * 1024, artifact_days * 86400)
+
+    # Every troubleshooting session, queryable with incident_history.py
+    if history_db is None:
+        history_db = os.path.join(artifact_dir, incident_history.db_name)
+
+    if history_db != "none":
+        history = incident_history.IncidentHistory(history_db, history_days)
+        artifacts.on_evict = history.remove_artifact
+
+    # Prefer structured output if the routing suite supports it
+    json_output = detect_json_output()
 
-    list_of_neighbors = []
+    if debug:
+        print "JSON output: " + repr(json_output)
 
-    if len(ip_list) < 1:
+    # Build a Neighbor object out of every Established peer with a single vtysh call
+    registry = NeighborRegistry()
+    registry.bulk_load()
+
+    if len(registry) < 1 and reconcile_interval is None:
         print "No Up neighbors"
         return False
 
-    # Build a Neighbor object out of each peer
-    for ip in ip_list:
-        neighbor = Neighbor(ip)
-        neighbor.set_timers(get_hold_time(ip))
-        list_of_neighbors.append(neighbor)
+    # Keep the last few seconds of BGP traffic so captures include the lead up to a failure
+    if flight_seconds > 0:
+        flight_recorder = capture_engine.FlightRecorder(window=flight_seconds, max_bytes=flight_bytes)
+        flight_recorder.start()
 
-    # No thread support today, so neighbor is static. 
-    # In the future a thread would be spawned for each Neighbor object
-    neighbor1 = list_of_neighbors[0]
+    # Which interface each peer is behind, kept current by route change notifications
+    routes = route_lookup.RouteCache()
 
-    # keep checking if the neighbor is alive, if not, bail.
-    while(bgp_neighbor_up(neighbor1.ip)): 
+    try:
+        routes.start()
+    except socket.error as e:
+        if debug:
+            print "Route notifications unavailable, routes expire after " + str(routes.max_age) + "s: " + str(e)
 
-        # Check if we heard a message from the neighbor
-        if not neighbor_received_message(neighbor1):
-            if debug:
-                print "Troubleshooting Neighbor"
-            start_troubleshooting(neighbor1)
-        else:
-            if debug:
-                print "Neighbor alive, waiting"
-            stop_troubleshooting(neighbor1)
+    if sniffer is not None:
+        try:
+            sniffer.start()
+        except socket.error as e:
+            print "Packet socket unavailable, using vtysh Last read: " + str(e)
+            sniffer = None
 
-        # Pause the loop for a keepalive
-        time.sleep(neighbor1.keepalive.seconds)
+    monitor = NeighborMonitor(registry, worker_count, reconcile_interval)
 
-    if debug:
-        print "Neighbor down"
+    if neighbor_table is not None:
+        neighbor_table.intervals = lambda: [neighbor.poll_interval for neighbor in registry]
+
+    if prober is not None:
+        # Probe whatever is being monitored, and check a peer right away when its probes go bad
+        prober.targets = monitor.ips
+        prober.on_alarm = monitor.check_now
+
+        try:
+            prober.start()
+        except socket.error as e:
+            print "Raw ICMP sockets unavailable, not probing: " + str(e)
+            prober = None
+
+    # keep checking every neighbor until they have all gone down (or forever as a daemon)
+    monitor.run()
+
+    if prober is not None:
+        prober.stop()
 
-    stop_troubleshooting(neighbor1)
+    if flight_recorder is not None:
+        flight_recorder.stop()
+
+    if sniffer is not None:
+        sniffer.stop()
+
+    routes.stop()
+
+    # Let the last artifacts finish compressing
+    artifacts.wait()
+
+    if history is not None:
+        history.close_database()
+
+    if debug:
+        print "All neighbors down"
 
 
 if __name__ == "__main__":
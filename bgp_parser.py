@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+from collections import namedtuple
+import datetime
+import json
+import re
+
+'''
+bgp_parser turns "show ip bgp summary" and "show ip bgp neighbor" output into records.
+
+Two backends return the same records:
+    JSON - the output of "show ip bgp summary json" / "show ip bgp neighbor json"
+           when the routing suite supports it
+    text - a single pass over the CLI output using compiled regular expressions
+
+parse_summary() and parse_neighbors() pick the backend based on the output itself,
+so callers only decide which command to send.
+'''
+
+# One row of "show ip bgp summary".
+# state is "Established" when the peer has a prefix count, else the state shown (ex. "Active")
+# prefixes is an int, or None if the peer isn't Established
+PeerSummary = namedtuple("PeerSummary", ["ip", "version", "remote_as", "msg_rcvd", "msg_sent",
+                                         "up_down", "state", "prefixes"])
+
+# Parsed state of a single peer from "show ip bgp neighbor"
+# last_read is a datetime.timedelta (None if never read), hold_time and keepalive are ints (seconds)
+# remote_as is an int, None if unknown. It is optional when building a NeighborState by hand.
+NeighborState = namedtuple("NeighborState", ["ip", "state", "last_read", "hold_time", "keepalive", "remote_as"])
+NeighborState.__new__.__defaults__ = (None,)
+
+# "00:00:55", "01:13:55"
+clock_timer = re.compile(r"^(\d+):(\d+):(\d+)$")
+# "01w4d15h", "1d02h03m", "4d15h"
+unit_timer = re.compile(r"(\d+)([wdhms])")
+unit_seconds = {"w": 604800, "d": 86400, "h": 3600, "m": 60, "s": 1}
+
+# "192.168.1.1     4 65111   17758   17788        0    0    0 01w3d19h        2"
+summary_line = re.compile(r"^(\S+)\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s+\d+\s+\d+\s+\d+\s+(\S+)\s+(.+?)\s*$")
+neighbor_line = re.compile(r"^BGP neighbor is ([^,\s]+),(?: remote AS (\d+),)?")
+state_line = re.compile(r"^\s*BGP state = ([\w/]+)")
+last_read_line = re.compile(r"^\s*Last read ([^,\s]+)")
+hold_time_line = re.compile(r"^\s*Hold time is (\d+), keepalive interval is (\d+) seconds")
+
+
+def parse_timer(timer):
+    '''
+    Converts a Quagga uptime/last read timer into a timedelta
+
+    Keyword Args:
+    timer - string. ex. "00:00:55", "01w4d15h", "1d02h03m" or "never"
+
+    Returns datetime.timedelta, or None if the timer is "never" or can't be parsed
+    '''
+
+    match = clock_timer.match(timer)
+
+    if match:
+        return datetime.timedelta(hours=int(match.group(1)),
+                                  minutes=int(match.group(2)),
+                                  seconds=int(match.group(3)))
+
+    units = unit_timer.findall(timer)
+
+    # every character must belong to a <number><unit> pair
+    if not units or sum(len(number) + 1 for number, unit in units) != len(timer):
+        return None
+
+    return datetime.timedelta(seconds=sum(int(number) * unit_seconds[unit] for number, unit in units))
+
+
+def is_json(output):
+    '''
+    Returns True if the output looks like JSON rather than CLI text
+    '''
+
+    return output.lstrip()[:1] == "{"
+
+
+def parse_summary(output):
+    '''
+    Parses "show ip bgp summary" or "show ip bgp summary json"
+
+    Returns list of PeerSummary in the order they were shown
+    '''
+
+    if is_json(output):
+        return parse_summary_json(output)
+
+    return parse_summary_text(output)
+
+
+def parse_neighbors(output):
+    '''
+    Parses "show ip bgp neighbor [json]" for one or many peers
+
+    Returns dict of IP string -> NeighborState
+    '''
+
+    if is_json(output):
+        return parse_neighbors_json(output)
+
+    return parse_neighbors_text(output)
+
+
+def parse_summary_text(output):
+    '''
+    Parses the CLI output of "show ip bgp summary" in a single pass.
+
+    Long (IPv6) neighbor addresses are printed on their own line with the
+    rest of the row on the next line. Those rows are joined before matching.
+    '''
+
+    '''
+    Sample Output:
+        Neighbor        V    AS MsgRcvd MsgSent   TblVer  InQ OutQ Up/Down  State/PfxRcd
+        192.168.1.1     4 65111   17758   17788        0    0    0 01w3d19h        2
+        192.168.2.3     4 65333      70      80        0    0    0 01w5d03h Active
+        2001:db8:100::1
+                        4 65444      70      80        0    0    0 01w5d03h Active
+
+        Total number of neighbors 3
+    '''
+
+    peers = []
+    in_table = False
+    wrapped_ip = None
+
+    for line in output.split("\n"):
+        if not in_table:
+            in_table = line.startswith("Neighbor")
+            continue
+
+        if line.startswith("Total number"):
+            break
+
+        if wrapped_ip is not None:
+            line = wrapped_ip + " " + line.strip()
+            wrapped_ip = None
+
+        elif len(line.split()) == 1:
+            wrapped_ip = line.strip()
+            continue
+
+        match = summary_line.match(line)
+
+        if not match:
+            continue
+
+        state = match.group(7)
+
+        if state.isdigit():
+            prefixes = int(state)
+            state = "Established"
+        else:
+            prefixes = None
+
+        peers.append(PeerSummary(match.group(1), int(match.group(2)), int(match.group(3)),
+                                 int(match.group(4)), int(match.group(5)), match.group(6),
+                                 state, prefixes))
+
+    return peers
+
+
+def parse_neighbors_text(output):
+    '''
+    Parses the CLI output of "show ip bgp neighbor" in a single pass.
+    '''
+
+    '''
+    Sample Output (one block per peer):
+        BGP neighbor is 192.168.1.1, remote AS 65111, local AS 65222, external link
+          BGP version 4, remote router ID 10.1.1.1
+          BGP state = Established, up for 01w4d15h
+          Last read 00:00:55, Last write 01w4d15h
+          Hold time is 180, keepalive interval is 60 seconds
+    '''
+
+    neighbors = {}
+    fields = None
+
+    for line in output.split("\n"):
+        match = neighbor_line.match(line)
+
+        if match:
+            fields = {"ip": match.group(1), "state": "", "last_read": None, "hold_time": 0, "keepalive": 0,
+                      "remote_as": int(match.group(2)) if match.group(2) else None}
+            neighbors[fields["ip"]] = fields
+            continue
+
+        if fields is None:
+            continue
+
+        match = state_line.match(line)
+        if match:
+            fields["state"] = match.group(1)
+            continue
+
+        match = last_read_line.match(line)
+        if match:
+            fields["last_read"] = parse_timer(match.group(1))
+            continue
+
+        match = hold_time_line.match(line)
+        if match:
+            fields["hold_time"] = int(match.group(1))
+            fields["keepalive"] = int(match.group(2))
+
+    return dict((ip, NeighborState(**fields)) for ip, fields in neighbors.items())
+
+
+def parse_summary_json(output):
+    '''
+    Parses "show ip bgp summary json".
+
+    Handles both the flat Quagga layout ({"peers": {...}}) and the
+    per address family layout ({"ipv4Unicast": {"peers": {...}}}).
+    '''
+
+    summary = json.loads(output)
+
+    if "peers" not in summary:
+        for value in summary.values():
+            if isinstance(value, dict) and "peers" in value:
+                summary = value
+                break
+
+    peers = []
+
+    for ip, peer in sorted(summary.get("peers", {}).items()):
+        state = peer.get("state", "")
+        prefixes = peer.get("prefixReceivedCount", peer.get("pfxRcd"))
+
+        if state != "Established":
+            prefixes = None
+
+        peers.append(PeerSummary(str(ip), peer.get("version", 4), peer.get("remoteAs", 0),
+                                 peer.get("msgRcvd", 0), peer.get("msgSent", 0),
+                                 str(peer.get("peerUptime", "")), str(state), prefixes))
+
+    return peers
+
+
+def parse_neighbors_json(output):
+    '''
+    Parses "show ip bgp neighbor json". Timers are reported in milliseconds.
+    '''
+
+    neighbors = {}
+
+    for ip, peer in json.loads(output).items():
+        if not isinstance(peer, dict) or "bgpState" not in peer:
+            continue
+
+        last_read = peer.get("bgpTimerLastRead")
+        if last_read is not None:
+            last_read = datetime.timedelta(milliseconds=last_read)
+
+        neighbors[str(ip)] = NeighborState(str(ip), str(peer["bgpState"]), last_read,
+                                           peer.get("bgpTimerHoldTimeMsecs", 0) // 1000,
+                                           peer.get("bgpTimerKeepAliveIntervalMsecs", 0) // 1000,
+                                           peer.get("remoteAs"))
+
+    return neighbors
@@ -0,0 +1,496 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+from collections import namedtuple
+import datetime
+import getopt
+import math
+import random
+import sys
+import time
+import bgp_neighbor_capture as bgp
+import bgp_parser
+import deadline_scheduler
+import incident_groups
+import synthetic_bgp
+
+debug = False
+
+'''
+bgp_simulator measures how quickly bgp_neighbor_capture notices a failing peer,
+without a router and without waiting in real time.
+
+Each peer follows a PeerScript: healthy (a keepalive every keepalive interval),
+silent for a while (hold timer expiry takes the session down if the silence
+outlasts it), flapping, or going down. A SimulatedRouter stands in for vtysh:
+it answers the monitor's "show ip bgp ..." commands from the scripts at the
+current virtual time, in text or json (see synthetic_bgp).
+
+The real NeighborMonitor runs against a deadline_scheduler.VirtualClock, and
+run_pending() does each check inline. The clock jumps from one deadline to the
+next, so an hour of monitoring 1000 peers takes seconds. Captures and diagnostic
+commands are replaced with no-ops, since only the decisions are being measured.
+
+The report covers:
+
+    detection latency - scripted fault start to first trigger (or drop of a down peer)
+    missed faults - faults that ended without being noticed
+    false positives - troubleshooting started when no fault was active
+    CPU - process CPU seconds the monitor used per simulated hour, with the
+          simulated router's own time left out
+
+Usage: bgp_simulator.py [--peers=200] [--hours=1] [--seed=1] [--batch] [--json] [--reconcile=30] [--adaptive]
+       [--sniff]
+'''
+
+# A scripted fault. end is float("inf") for a peer that never recovers.
+Fault = namedtuple("Fault", ["kind", "start", "end"])
+
+# How a fault was noticed. latency is None if it was missed.
+Detection = namedtuple("Detection", ["ip", "kind", "start", "latency"])
+
+
+class PeerScript(object):
+
+    '''
+    Scripted behavior of one simulated peer over virtual time.
+    '''
+
+    def __init__(self, ip, keepalive=60, hold_time=180, phase=0.0):
+        '''
+        ip = peer IP
+        keepalive/hold_time = negotiated timers in seconds
+        phase = offset of this peer's keepalives from time 0
+        faults = list of Fault
+        '''
+
+        self.ip = ip
+        self.keepalive = keepalive
+        self.hold_time = hold_time
+        self.phase = phase
+        self.faults = []
+
+    def silent(self, start, seconds):
+        '''
+        The peer sends nothing for seconds. Past the hold time the session goes down until it resumes.
+        '''
+
+        self.faults.append(Fault("silent", start, start + seconds))
+
+    def down(self, start, seconds=None):
+        '''
+        The session drops (ex. NOTIFICATION, interface down) for seconds, or for good
+        '''
+
+        self.faults.append(Fault("down", start, float("inf") if seconds is None else start + seconds))
+
+    def flap(self, start, period, down_for, count):
+        '''
+        The session drops for down_for seconds every period seconds, count times
+        '''
+
+        for flap in range(count):
+            self.down(start + flap * period, down_for)
+
+    def established(self, now):
+        for fault in self.faults:
+            if fault.kind == "down" and fault.start <= now < fault.end:
+                return False
+
+            # hold timer expired during the silence
+            if fault.kind == "silent" and fault.start + self.hold_time <= now < fault.end:
+                return False
+
+        return True
+
+    def last_message(self, now):
+        '''
+        Returns the virtual time of the last message heard from the peer
+        '''
+
+        sent = self.phase + math.floor((now - self.phase) / self.keepalive) * self.keepalive
+        moved = True
+
+        # step back over keepalives that fall inside a fault
+        while moved:
+            moved = False
+
+            for fault in self.faults:
+                if fault.start <= sent < fault.end:
+                    sent = self.phase + (math.ceil((fault.start - self.phase) / self.keepalive) - 1) * self.keepalive
+                    moved = True
+
+        # an OPEN/keepalive as soon as a fault ends
+        return max([sent] + [fault.end for fault in self.faults if fault.end <= now])
+
+    def state(self, now):
+        '''
+        Returns bgp_parser.NeighborState of the peer at virtual time now
+        '''
+
+        return bgp_parser.NeighborState(self.ip, "Established" if self.established(now) else "Active",
+                                        datetime.timedelta(seconds=int(now - self.last_message(now))),
+                                        self.hold_time, self.keepalive)
+
+
+class SimulatedRouter(object):
+
+    '''
+    Answers the monitor's vtysh commands from PeerScripts. Drop in for bgp_neighbor_capture.send_command.
+    '''
+
+    def __init__(self, scripts, clock):
+        '''
+        scripts = IP -> PeerScript
+        clock = the VirtualClock the monitor runs on
+        commands = number of commands answered
+        cpu = process CPU seconds spent building answers, so it can be left out of the monitor's cost
+        '''
+
+        self.scripts = scripts
+        self.clock = clock
+        self.commands = 0
+        self.cpu = 0.0
+
+    def send_command(self, command):
+        start = time.clock()
+
+        try:
+            return self.answer(command)
+        finally:
+            self.commands += 1
+            self.cpu += time.clock() - start
+
+    def answer(self, command):
+        json_output = command.endswith(" json")
+
+        if json_output:
+            command = command[:-len(" json")]
+
+        words = command.split(" ")
+        now = self.clock()
+
+        if command == "show ip bgp summary":
+            peers = [script.state(now) for script in self.scripts.values()]
+            return synthetic_bgp.summary_json(peers) if json_output else synthetic_bgp.summary_text(peers)
+
+        if words[:4] == ["show", "ip", "bgp", "neighbor"]:
+            if len(words) == 5:
+                peers = [self.scripts[words[4]].state(now)] if words[4] in self.scripts else []
+            else:
+                peers = [script.state(now) for script in self.scripts.values()]
+
+            return synthetic_bgp.neighbors_json(peers) if json_output else synthetic_bgp.neighbors_text(peers)
+
+        # debugs and anything else
+        return ""
+
+
+class ScriptedSniffer(object):
+
+    '''
+    Stands in for bgp_sniffer.Sniffer with the exact time of each peer's last message from its PeerScript.
+    '''
+
+    def __init__(self, scripts, clock):
+        self.scripts = scripts
+        self.clock = clock
+
+    def age(self, ip):
+        script = self.scripts.get(ip)
+
+        if script is None:
+            return None
+
+        now = self.clock()
+
+        return now - script.last_message(now)
+
+
+class NullSink(object):
+
+    '''
+    Stands in for the capture manager, diagnostic collector and the handles they
+    return, so triggering troubleshooting runs no tcpdump or shell commands.
+    '''
+
+    def subscribe(self, ip, path, **kwargs):
+        return self
+
+    def collect(self, log_file, command_list, **kwargs):
+        return self
+
+    def add_peer(self, ip):
+        pass
+
+    def terminate(self):
+        pass
+
+    def cancel(self):
+        pass
+
+
+class SimulationResult(object):
+
+    def __init__(self, peers, duration, checks, commands, wall, cpu, router_cpu, detections, false_positives):
+        self.peers = peers
+        self.duration = duration
+        self.checks = checks
+        self.commands = commands
+        self.wall = wall
+        self.cpu = cpu
+        self.router_cpu = router_cpu
+        self.detections = detections
+        self.false_positives = false_positives
+
+    def cpu_per_hour(self):
+        return self.cpu / (self.duration / 3600.0)
+
+
+class Simulation(object):
+
+    '''
+    Runs the real NeighborMonitor against scripted peers on a virtual clock.
+    '''
+
+    # bgp_neighbor_capture globals swapped for the run and restored afterwards
+    patched = ["clock", "send_command", "captures", "collector", "flight_recorder", "artifacts",
+               "json_output", "neighbor_table", "poll_policy", "sniffer", "prober", "routes",
+               "incidents", "hysteresis", "history", "start_troubleshooting"]
+
+    def __init__(self, scripts, duration=3600, batch=False, json_output=False, reconcile_interval=30,
+                 adaptive=False, sniff=False):
+        '''
+        scripts = list of PeerScript
+        duration = virtual seconds to simulate
+        batch = poll every peer with one "show ip bgp neighbor" (--batch)
+        json_output = use the json parser backend
+        reconcile_interval = daemon mode reconcile, so peers that recover are monitored again
+        adaptive = use bgp_neighbor_capture.AdaptivePolling (--adaptive)
+        sniff = last message times from a ScriptedSniffer (--sniff)
+        '''
+
+        self.scripts = dict((script.ip, script) for script in scripts)
+        self.duration = duration
+        self.batch = batch
+        self.json_output = json_output
+        self.reconcile_interval = reconcile_interval
+        self.adaptive = adaptive
+        self.sniff = sniff
+
+    def run(self):
+        '''
+        Returns SimulationResult
+        '''
+
+        clock = deadline_scheduler.VirtualClock(0.0)
+        router = SimulatedRouter(self.scripts, clock)
+        saved = dict((name, getattr(bgp, name)) for name in self.patched)
+        triggers = []
+        drops = []
+        checks = 0
+
+        def start_troubleshooting(neighbor):
+            if not neighbor.troubleshooting:
+                triggers.append((clock(), neighbor.ip))
+
+            saved["start_troubleshooting"](neighbor)
+
+        wall_start = time.time()
+        cpu_start = time.clock()
+
+        try:
+            bgp.clock = clock
+            bgp.send_command = router.send_command
+            bgp.captures = bgp.collector = NullSink()
+            bgp.flight_recorder = None
+            bgp.artifacts = None
+            bgp.json_output = self.json_output
+            bgp.neighbor_table = bgp.NeighborStateTable() if self.batch else None
+            bgp.poll_policy = bgp.AdaptivePolling() if self.adaptive else None
+            bgp.sniffer = ScriptedSniffer(self.scripts, clock) if self.sniff else None
+            bgp.prober = None
+            bgp.routes = None
+            bgp.incidents = incident_groups.IncidentGroups(clock=clock)
+            bgp.hysteresis = None
+            bgp.history = None
+            bgp.start_troubleshooting = start_troubleshooting
+
+            registry = bgp.NeighborRegistry()
+            registry.bulk_load()
+            monitor = bgp.NeighborMonitor(registry, 1, self.reconcile_interval)
+            monitored = monitor.registry.ips()
+
+            while True:
+                checks += monitor.run_pending()
+                current = monitor.registry.ips()
+                drops.extend((clock(), ip) for ip in monitored - current)
+                monitored = current
+
+                deadline = monitor.scheduler.next_deadline()
+
+                if deadline is None or deadline > self.duration:
+                    break
+
+                clock.advance(max(deadline - clock(), 0))
+
+            monitor.stop()
+
+        finally:
+            for name, value in saved.items():
+                setattr(bgp, name, value)
+
+        cpu = time.clock() - cpu_start - router.cpu
+        detections, false_positives = self.score(triggers, drops)
+
+        return SimulationResult(len(self.scripts), self.duration, checks, router.commands,
+                                time.time() - wall_start, cpu, router.cpu, detections, false_positives)
+
+    def score(self, triggers, drops):
+        '''
+        Matches triggers and drops to scripted faults.
+
+        Returns (list of Detection, number of false positive triggers)
+        '''
+
+        noticed = {}
+
+        for when, ip in triggers + drops:
+            noticed.setdefault(ip, []).append(when)
+
+        trigger_times = {}
+
+        for when, ip in triggers:
+            trigger_times.setdefault(ip, []).append(when)
+
+        detections = []
+        false_positives = 0
+
+        for ip, script in sorted(self.scripts.items()):
+            times = sorted(noticed.get(ip, []))
+            explained = set()
+
+            for fault in sorted(script.faults, key=lambda f: f.start):
+                if fault.start >= self.duration:
+                    continue
+
+                # a peer is checked once a keepalive, allow two to notice the end of a short fault
+                window_end = min(fault.end, self.duration) + script.keepalive * 2
+                matched = [when for when in times if fault.start <= when <= window_end]
+                explained.update(matched)
+                latency = matched[0] - fault.start if matched else None
+                detections.append(Detection(ip, fault.kind, fault.start, latency))
+
+            false_positives += len([when for when in trigger_times.get(ip, []) if when not in explained])
+
+        return detections, false_positives
+
+
+def build_scenario(count, duration=3600, seed=1):
+    '''
+    Returns list of count PeerScript: mostly healthy, with silent, hold expiry,
+    flapping and down peers spread through the run.
+    '''
+
+    rng = random.Random(seed)
+    scripts = []
+
+    for index in range(count):
+        keepalive = 60 if index % 5 else 10
+        script = PeerScript(synthetic_bgp.peer_ip(index), keepalive, keepalive * 3, rng.uniform(0, keepalive))
+        start = rng.uniform(0.1, 0.7) * duration
+        kind = index % 20
+
+        if kind in (1, 2):
+            # silence the monitor should catch before the hold timer
+            script.silent(start, keepalive * rng.uniform(1.6, 2.8))
+        elif kind == 3:
+            # hold timer expires
+            script.silent(start, keepalive * rng.uniform(3.5, 6))
+        elif kind == 4:
+            script.flap(start, keepalive * 10, keepalive * 2, 3)
+        elif kind == 5:
+            script.down(start)
+
+        scripts.append(script)
+
+    return scripts
+
+
+def format_report(result):
+    lines = ["Simulated %.1fh of %d peers in %.2fs: %d checks, %d vtysh commands" %
+             (result.duration / 3600.0, result.peers, result.wall, result.checks, result.commands),
+             "",
+             "%-8s %6s %8s %6s %8s %8s %8s %8s" % ("fault", "count", "detected", "missed", "min", "avg", "p95", "max")]
+
+    for kind in sorted(set(d.kind for d in result.detections)):
+        detections = [d for d in result.detections if d.kind == kind]
+        latencies = sorted(d.latency for d in detections if d.latency is not None)
+
+        if latencies:
+            p95 = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+            stats = "%7.1fs %7.1fs %7.1fs %7.1fs" % (latencies[0], sum(latencies) / len(latencies), p95, latencies[-1])
+        else:
+            stats = "%8s %8s %8s %8s" % ("-", "-", "-", "-")
+
+        lines.append("%-8s %6d %8d %6d %s" % (kind, len(detections), len(latencies),
+                                              len(detections) - len(latencies), stats))
+
+    lines.append("")
+    lines.append("False positives: %d" % result.false_positives)
+    lines.append("Monitor CPU: %.3fs per simulated hour (simulated router %.3fs excluded)" %
+                 (result.cpu_per_hour(), result.router_cpu))
+
+    if debug:
+        for detection in result.detections:
+            lines.append("  " + repr(detection))
+
+    return "\n".join(lines)
+
+
+def main(argv):
+    global debug
+
+    options, remainder = getopt.getopt(argv, "", ["debug", "peers=", "hours=", "seed=", "batch", "json",
+                                                  "reconcile=", "adaptive", "sniff"])
+    peers = 200
+    hours = 1.0
+    seed = 1
+    batch = False
+    json_output = False
+    reconcile_interval = 30
+    adaptive = False
+    sniff = False
+
+    for opt, arg in options:
+        if opt in "--debug":
+            debug = True
+        if opt in "--peers":
+            peers = int(arg)
+        if opt in "--hours":
+            hours = float(arg)
+        if opt in "--seed":
+            seed = int(arg)
+        if opt in "--batch":
+            batch = True
+        if opt in "--json":
+            json_output = True
+        if opt in "--reconcile":
+            reconcile_interval = int(arg)
+        if opt in "--adaptive":
+            adaptive = True
+        if opt in "--sniff":
+            sniff = True
+
+    duration = hours * 3600
+    simulation = Simulation(build_scenario(peers, duration, seed), duration, batch, json_output, reconcile_interval,
+                            adaptive, sniff)
+
+    print format_report(simulation.run())
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
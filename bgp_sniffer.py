@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+import ctypes
+import fcntl
+import socket
+import struct
+import threading
+import time
+import deadline_scheduler
+import pcap_analyzer
+import pcap_format
+
+debug = False
+
+'''
+bgp_sniffer timestamps every BGP message the router receives, per peer,
+by reading TCP port 179 off a packet socket (AF_PACKET).
+
+A classic BPF program is attached to the socket, so the kernel drops everything
+that isn't TCP port 179 before it is copied to us. On a router doing nothing
+but keepalives that is a few packets per peer per minute, and the reader thread
+sleeps in recvfrom() the rest of the time.
+
+Each direction of each session is reassembled with pcap_analyzer.TcpStream.
+Any new data from a peer counts as hearing from it (what Quagga's "Last read" means),
+complete KEEPALIVEs are also recorded on their own. Times are on the monotonic
+clock with the kernel's receive timestamp (SIOCGSTAMP) taken into account, so
+they are accurate to well under a millisecond, not just to when we got around to reading.
+
+Sniffer.age(ip) answers "how long since this peer last sent anything" without
+a vtysh call, for bgp_neighbor_capture --sniff.
+'''
+
+ETH_P_ALL = 0x0003  # from <linux/if_ether.h>
+SO_ATTACH_FILTER = 26  # from <asm-generic/socket.h>
+SIOCGSTAMP = 0x8906  # receive time of the last packet read
+PACKET_OUTGOING = 4  # sockaddr_ll pkttype of packets we sent
+
+BGP_PORT = 179
+snap_length = 65535  # bytes read per packet
+
+# classic BPF opcodes, from <linux/filter.h>
+BPF_LD_B_ABS = 0x30  # A = packet[k]
+BPF_LD_H_ABS = 0x28  # A = packet[k:k+2]
+BPF_LD_H_IND = 0x48  # A = packet[X+k:X+k+2]
+BPF_LDX_B_MSH = 0xb1  # X = 4 * (packet[k] & 0xf), the IPv4 header length
+BPF_ALU_AND_K = 0x54  # A &= k
+BPF_JMP_JEQ_K = 0x15  # A == k
+BPF_JMP_JSET_K = 0x45  # A & k
+BPF_RET_K = 0x06  # accept k bytes, 0 drops the packet
+
+sock_filter = struct.Struct("=HBBI")
+
+# "tcp port 179" for a SOCK_DGRAM packet socket, where the packet starts at the IP header.
+# (label, opcode, k, jump if true, jump if false). A jump of None falls through to the next instruction.
+# IPv6 extension headers and IPv4 fragments past the first aren't matched, BGP sessions don't use them.
+bgp_filter = [
+    (None, BPF_LD_B_ABS, 0, None, None),
+    (None, BPF_ALU_AND_K, 0xf0, None, None),
+    (None, BPF_JMP_JEQ_K, 0x40, None, "ipv6"),
+    (None, BPF_LD_B_ABS, 9, None, None),
+    (None, BPF_JMP_JEQ_K, socket.IPPROTO_TCP, None, "drop"),
+    (None, BPF_LD_H_ABS, 6, None, None),
+    (None, BPF_JMP_JSET_K, 0x1fff, "drop", None),
+    (None, BPF_LDX_B_MSH, 0, None, None),
+    (None, BPF_LD_H_IND, 0, None, None),
+    (None, BPF_JMP_JEQ_K, BGP_PORT, "accept", None),
+    (None, BPF_LD_H_IND, 2, None, None),
+    (None, BPF_JMP_JEQ_K, BGP_PORT, "accept", "drop"),
+    ("ipv6", BPF_JMP_JEQ_K, 0x60, None, "drop"),
+    (None, BPF_LD_B_ABS, 6, None, None),
+    (None, BPF_JMP_JEQ_K, socket.IPPROTO_TCP, None, "drop"),
+    (None, BPF_LD_H_ABS, 40, None, None),
+    (None, BPF_JMP_JEQ_K, BGP_PORT, "accept", None),
+    (None, BPF_LD_H_ABS, 42, None, None),
+    (None, BPF_JMP_JEQ_K, BGP_PORT, "accept", "drop"),
+    ("accept", BPF_RET_K, snap_length, None, None),
+    ("drop", BPF_RET_K, 0, None, None),
+]
+
+
+def assemble(program):
+    '''
+    Assembles a classic BPF program written as (label, opcode, k, jump if true, jump if false)
+
+    Returns the packed struct sock_filter array
+    '''
+
+    labels = dict((line[0], index) for index, line in enumerate(program) if line[0] is not None)
+    instructions = []
+
+    for index, (label, opcode, k, jump_true, jump_false) in enumerate(program):
+        offsets = []
+
+        for target in (jump_true, jump_false):
+            if target is None:
+                offsets.append(0)
+            elif labels[target] <= index:
+                raise ValueError("BPF can only jump forward: " + target)
+            else:
+                offsets.append(labels[target] - index - 1)
+
+        instructions.append(sock_filter.pack(opcode, offsets[0], offsets[1], k))
+
+    return "".join(instructions)
+
+
+def attach_filter(sock, program):
+    '''
+    Attaches an assembled BPF program to sock (SO_ATTACH_FILTER)
+    '''
+
+    instructions = ctypes.create_string_buffer(program, len(program))
+    # struct sock_fprog { unsigned short len; struct sock_filter *filter; }, the kernel copies the program
+    fprog = struct.pack("HL", len(program) // sock_filter.size, ctypes.addressof(instructions))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+
+def open_socket(interface=None):
+    '''
+    Opens a packet socket that receives TCP port 179.
+
+    Keyword Args:
+    interface - interface name, None for every interface
+
+    Returns socket.socket
+
+    Raises socket.error, ex. without CAP_NET_RAW
+    '''
+
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_DGRAM, socket.htons(ETH_P_ALL))
+
+    try:
+        attach_filter(sock, assemble(bgp_filter))
+
+        if interface is not None:
+            sock.bind((interface, ETH_P_ALL))
+
+        # wake up once a second to notice stop()
+        sock.settimeout(1)
+    except:
+        sock.close()
+        raise
+
+    return sock
+
+
+def receive_delay(sock):
+    '''
+    Returns seconds between the kernel receiving the last packet read from sock and now.
+    0 if the kernel timestamp isn't available.
+    '''
+
+    try:
+        seconds, microseconds = struct.unpack("ll", fcntl.ioctl(sock.fileno(), SIOCGSTAMP, struct.pack("ll", 0, 0)))
+    except IOError:
+        return 0.0
+
+    return max(time.time() - (seconds + microseconds / 1000000.0), 0.0)
+
+
+class PeerActivity(object):
+
+    '''
+    What has been heard from one peer.
+    '''
+
+    __slots__ = ["ip", "last_message", "last_keepalive", "messages", "keepalives"]
+
+    def __init__(self, ip):
+        '''
+        ip = peer IP
+        last_message = clock() time new data last arrived from the peer
+        last_keepalive = clock() time of the last complete KEEPALIVE, None before the first
+        messages = number of segments with new data
+        keepalives = number of KEEPALIVEs
+        '''
+
+        self.ip = ip
+        self.last_message = None
+        self.last_keepalive = None
+        self.messages = 0
+        self.keepalives = 0
+
+
+class Sniffer(object):
+
+    '''
+    Reads BGP packets on a background thread and keeps a PeerActivity per peer.
+    '''
+
+    def __init__(self, interface=None, clock=deadline_scheduler.monotonic):
+        '''
+        interface = interface to listen on, None for all of them
+        clock = time source that PeerActivity times and age() use
+        peers = peer IP -> PeerActivity
+        streams = (src, sport, dst, dport) -> pcap_analyzer.TcpStream, one per direction
+        '''
+
+        self.interface = interface
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.peers = {}
+        self.streams = {}
+        self.sock = None
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        '''
+        Opens the packet socket and starts the reader thread
+
+        Raises socket.error if the socket can't be opened
+        '''
+
+        self.sock = open_socket(self.interface)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="bgp-sniffer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def run(self):
+        while self.running:
+            try:
+                data, address = self.sock.recvfrom(snap_length)
+            except socket.timeout:
+                continue
+            except socket.error as e:
+                if debug:
+                    print "Sniffer read failed: " + str(e)
+                continue
+
+            # one packet we can't decode must not stop the reader for good
+            try:
+                self.handle(data, address[2], self.clock() - receive_delay(self.sock))
+            except Exception as e:
+                if debug:
+                    print "Sniffer failed to decode a packet: " + repr(e)
+
+    def handle(self, data, pkttype, now):
+        '''
+        Records one packet.
+
+        Keyword Args:
+        data - packet starting at the IP header
+        pkttype - sockaddr_ll packet type. Packets we sent are skipped
+        now - clock() time the packet was received
+
+        Returns list of the BGP message types the packet completed
+        '''
+
+        if pkttype == PACKET_OUTGOING:
+            return []
+
+        info = pcap_format.decode_packet(pcap_format.LINKTYPE_RAW, data)
+
+        if info is None or info.sport is None:
+            return []
+
+        if info.sport != BGP_PORT and info.dport != BGP_PORT:
+            return []
+
+        key = (info.src, info.sport, info.dst, info.dport)
+
+        with self.lock:
+            if info.flags & (pcap_format.TCP_FIN | pcap_format.TCP_RST):
+                self.streams.pop(key, None)
+                return []
+
+            stream = self.streams.get(key)
+
+            # a new session. A stream stuck behind a segment we never saw skips it on its own.
+            if stream is None:
+                stream = pcap_analyzer.TcpStream()
+                self.streams[key] = stream
+
+            retransmitted, messages = stream.add_segment(info.seq, info.flags, str(info.payload))
+
+            if retransmitted or not info.payload:
+                return messages
+
+            peer = self.peers.get(info.src)
+
+            if peer is None:
+                peer = PeerActivity(info.src)
+                self.peers[info.src] = peer
+
+            peer.last_message = now
+            peer.messages += 1
+
+            if "KEEPALIVE" in messages:
+                peer.last_keepalive = now
+                peer.keepalives += messages.count("KEEPALIVE")
+
+        return messages
+
+    def age(self, ip):
+        '''
+        Returns seconds since the peer last sent data, or None if nothing has been heard from it
+        '''
+
+        with self.lock:
+            peer = self.peers.get(ip)
+
+            if peer is None:
+                return None
+
+            return self.clock() - peer.last_message
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+import unittest
+import capture_engine
+import pcap_format
+import tempfile
+import shutil
+import time
+import os
+
+
+class TestCaptureEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp_dir, "source.pcap")
+
+        writer = pcap_format.PcapWriter(self.source, pcap_format.LINKTYPE_ETHERNET)
+        for i in range(10):
+            writer.write(1000 + i, pcap_format.build_ipv4_tcp("10.12.12.2", "10.12.12.1", 179, 40000, seq=i))
+            writer.write(1000 + i, pcap_format.build_ipv4_tcp("10.23.23.3", "10.23.23.2", 40001, 179, seq=i))
+            writer.write(1000 + i, pcap_format.build_ipv4_tcp("10.23.23.3", "10.23.23.2", 40002, 80, seq=i))
+        writer.close()
+
+        # Give both subscriptions time to attach before packets arrive
+        self.engine = capture_engine.CaptureEngine(command="sleep 0.3; cat " + self.source + "; exec sleep 10")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read_capture(self, path):
+        reader = pcap_format.PcapReader(open(path, "rb"))
+        return [pcap_format.decode_packet(reader.linktype, data) for ts, header, data in reader]
+
+    def test_demultiplex(self):
+        path1 = os.path.join(self.tmp_dir, "peer1.pcap")
+        path2 = os.path.join(self.tmp_dir, "peer2.pcap")
+        peer1 = self.engine.subscribe("10.12.12.2", path1)
+        peer2 = self.engine.subscribe("10.23.23.3", path2, bgp_only=True)
+        process = self.engine.process
+
+        time.sleep(1)
+        peer1.terminate()
+        self.assertTrue(self.engine.process is process)
+        peer2.terminate()
+        self.assertTrue(self.engine.process is None)
+
+        packets1 = self.read_capture(path1)
+        packets2 = self.read_capture(path2)
+        self.assertEqual(len(packets1), 10)
+        self.assertEqual(set(p.src for p in packets1), set(["10.12.12.2"]))
+        self.assertEqual(len(packets2), 10)
+        self.assertEqual(set(p.dport for p in packets2), set([179]))
+
+    def test_add_peer(self):
+        path = os.path.join(self.tmp_dir, "group.pcap")
+        group = self.engine.subscribe("10.12.12.2", path)
+        group.add_peer("10.23.23.3")
+
+        time.sleep(1)
+        group.terminate()
+        self.assertEqual(len(self.read_capture(path)), 30)
+
+    def test_max_packets(self):
+        path = os.path.join(self.tmp_dir, "peer1.pcap")
+        self.engine.subscribe("10.23.23.3", path, max_packets=5)
+
+        time.sleep(1)
+        self.assertEqual(len(self.read_capture(path)), 5)
+        self.assertEqual(self.engine.subscriptions, [])
+        self.assertTrue(self.engine.process is None)
+
+
+class TestFlightRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.recorder = capture_engine.FlightRecorder(window=5, max_bytes=1000, command="exec sleep 10")
+        self.packet1 = pcap_format.build_ipv4_tcp("10.12.12.2", "10.12.12.1", 179, 40000)
+        self.packet2 = pcap_format.build_ipv4_tcp("10.23.23.3", "10.23.23.2", 40001, 179)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def record(self, ts, data):
+        record = pcap_format.pack_record(ts, data)
+        info = pcap_format.decode_packet(pcap_format.LINKTYPE_ETHERNET, data)
+        self.recorder.receive(ts, info, record[:16], record[16:])
+
+    def test_time_window(self):
+        for ts in range(20):
+            self.record(1000 + ts, self.packet1)
+
+        self.assertEqual([record[0] for record in self.recorder.ring], range(1014, 1020))
+
+    def test_byte_cap(self):
+        for ts in range(20):
+            self.record(1000 + ts / 100.0, self.packet1)
+
+        self.assertTrue(self.recorder.bytes <= 1000)
+        self.assertEqual(self.recorder.bytes, len(self.recorder.ring) * (16 + len(self.packet1)))
+
+    def test_freeze_one_peer(self):
+        for ts in range(4):
+            self.record(1000 + ts, self.packet1)
+            self.record(1000 + ts, self.packet2)
+
+        path = os.path.join(self.tmp_dir, "flight.pcap")
+        self.assertEqual(self.recorder.freeze(path, "10.23.23.3", seconds=1), 2)
+
+        reader = pcap_format.PcapReader(open(path, "rb"))
+        self.assertEqual([ts for ts, header, data in reader], [1002.0, 1003.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+from subprocess import Popen, PIPE
+from collections import deque
+import os
+import threading
+import pcap_format
+
+debug = False
+
+'''
+capture_engine shares one tcpdump between every neighbor being troubleshot.
+
+A CaptureEngine runs a single tcpdump per interface that writes pcap to a pipe.
+Its reader thread decodes each packet once and copies it into the pcap file of
+every Subscription whose filter matches (the peer IP, optionally only TCP 179).
+
+tcpdump is started when the first neighbor subscribes and stopped when the last
+one unsubscribes, so a link failure that takes down 20 peers costs one capture,
+not 20 full copies of the same traffic.
+
+A FlightRecorder is an always-on sink on its own BGP-only engine. It keeps the
+last few seconds of TCP 179 packets in a bounded ring, so when troubleshooting
+starts the packets leading up to the failure can be written out too.
+
+Anything with matches(info), receive(ts, info, header, data) and close() can be
+attached to an engine as a sink.
+'''
+
+
+class Subscription(object):
+
+    '''
+    One neighbor's view of a shared capture, written to its own pcap file.
+    '''
+
+    def __init__(self, engine, ip, path, bgp_only=False, max_packets=10000, callback=None):
+        '''
+        engine = the CaptureEngine feeding this subscription
+        ip = peer IP. Packets to or from this IP are written
+        ips = every peer IP written, ip plus any added with add_peer()
+        path = pcap file to write
+        bgp_only = only write TCP port 179 packets
+        max_packets = stop writing after this many packets (same limit as the old tcpdump -c)
+        callback = called with path once the file is closed
+        writer = pcap_format.PcapWriter, created when the link type is known
+        '''
+
+        self.engine = engine
+        self.ip = ip
+        self.ips = set([ip])
+        self.path = path
+        self.bgp_only = bgp_only
+        self.max_packets = max_packets
+        self.callback = callback
+        self.writer = None
+        self.closed = False
+
+    def matches(self, info):
+        '''
+        Returns True if a decoded packet belongs to this subscription
+        '''
+
+        if info.src not in self.ips and info.dst not in self.ips:
+            return False
+
+        if self.bgp_only:
+            return info.sport == pcap_format.BGP_PORT or info.dport == pcap_format.BGP_PORT
+
+        return True
+
+    def add_peer(self, ip):
+        '''
+        Also writes packets to or from ip, for peers correlated into the same incident
+        '''
+
+        # copy on write, the engine reader thread may be in matches()
+        self.ips = self.ips | set([ip])
+
+    def receive(self, ts, info, header, data):
+        '''
+        Writes a raw pcap record. Called from the engine reader thread.
+        '''
+
+        if self.writer is None:
+            self.open()
+
+        self.writer.write_raw(header, data)
+
+        if self.writer.packets >= self.max_packets:
+            self.terminate()
+
+    def open(self):
+        '''
+        Creates the pcap file using the engine's link type
+        '''
+
+        self.writer = pcap_format.PcapWriter(self.path, self.engine.linktype or pcap_format.LINKTYPE_LINUX_SLL,
+                                             self.engine.snaplen)
+
+    def terminate(self):
+        '''
+        Stops writing and closes the file. Named after Popen.terminate() so it
+        can be stored and stopped like the per-neighbor tcpdump process it replaces.
+        '''
+
+        self.engine.remove_sink(self)
+
+    def close(self):
+        '''
+        Closes the pcap file. Called by the engine once the subscription is removed.
+        '''
+
+        if self.closed:
+            return
+
+        self.closed = True
+
+        if self.writer is None:
+            self.open()
+
+        self.writer.close()
+
+        if debug:
+            print "Capture " + self.path + " closed with " + str(self.writer.packets) + " packets"
+
+        if self.callback is not None:
+            self.callback(self.path)
+
+
+class CaptureEngine(object):
+
+    '''
+    A single tcpdump shared by any number of Subscriptions.
+    '''
+
+    def __init__(self, interface="any", capture_filter="not port 22", command=None):
+        '''
+        interface = interface to capture on
+        capture_filter = tcpdump filter applied before demultiplexing
+        command = shell command producing pcap on stdout. Defaults to tcpdump on interface.
+        subscriptions = list of attached sinks
+        linktype/snaplen = from the pcap header, once the capture has started
+        '''
+
+        self.interface = interface
+        self.capture_filter = capture_filter
+        self.command = command or ("exec tcpdump -U -s 0 -w - -i " + interface + " " + capture_filter)
+        # Reentrant: a subscription that hits max_packets unsubscribes from inside the reader loop
+        self.lock = threading.RLock()
+        self.subscriptions = []
+        self.process = None
+        self.reader = None
+        self.linktype = None
+        self.snaplen = 65535
+
+    def subscribe(self, ip, path, bgp_only=False, max_packets=10000, callback=None):
+        '''
+        Adds a subscription, starting tcpdump if this is the first one.
+
+        Returns Subscription
+        '''
+
+        subscription = Subscription(self, ip, path, bgp_only, max_packets, callback)
+        self.add_sink(subscription)
+
+        return subscription
+
+    def add_sink(self, sink):
+        '''
+        Attaches a sink (Subscription, FlightRecorder), starting tcpdump if needed.
+        '''
+
+        with self.lock:
+            self.subscriptions.append(sink)
+
+            if self.process is None:
+                self._start()
+
+    def remove_sink(self, sink):
+        '''
+        Removes a sink and closes it, stopping tcpdump if it was the last one.
+        '''
+
+        with self.lock:
+            if sink in self.subscriptions:
+                self.subscriptions.remove(sink)
+
+            sink.close()
+
+            if not self.subscriptions:
+                self._stop()
+
+    def _start(self):
+        '''
+        Starts tcpdump and the reader thread. Caller holds self.lock.
+        '''
+
+        if debug:
+            print "Starting shared capture: " + self.command
+
+        devnull = open(os.devnull, "w")
+        self.process = Popen(self.command, shell=True, stdout=PIPE, stderr=devnull, bufsize=-1)
+        devnull.close()
+
+        self.reader = threading.Thread(target=self._read, args=(self.process,))
+        self.reader.daemon = True
+        self.reader.start()
+
+    def _stop(self):
+        '''
+        Stops tcpdump. The reader thread exits at end of stream. Caller holds self.lock.
+        '''
+
+        if self.process is None:
+            return
+
+        try:
+            self.process.terminate()
+        except OSError:
+            pass
+
+        self.process = None
+
+        if debug:
+            print "Shared capture on " + self.interface + " stopped"
+
+    def _read(self, process):
+        '''
+        Reader thread. Decodes each packet once and fans it out to matching subscriptions.
+        '''
+
+        try:
+            reader = pcap_format.PcapReader(process.stdout)
+        except ValueError:
+            return
+
+        with self.lock:
+            self.linktype = reader.linktype
+            self.snaplen = reader.snaplen
+
+        for ts, header, data in reader:
+            info = pcap_format.decode_packet(reader.linktype, data)
+
+            if info is None:
+                continue
+
+            with self.lock:
+                if self.process is not process:
+                    break
+
+                for sink in [s for s in self.subscriptions if s.matches(info)]:
+                    sink.receive(ts, info, header, data)
+
+        process.stdout.close()
+        process.wait()
+
+        # tcpdump exited on its own, allow the next subscribe() to restart it
+        with self.lock:
+            if self.process is process:
+                self.process = None
+
+
+class CaptureManager(object):
+
+    '''
+    Hands out Subscriptions from one CaptureEngine per interface.
+    '''
+
+    def __init__(self, capture_filter="not port 22"):
+        self.capture_filter = capture_filter
+        self.lock = threading.Lock()
+        self.engines = {}
+
+    def subscribe(self, ip, path, interface="any", bgp_only=False, max_packets=10000, callback=None):
+        '''
+        Subscribes to the capture on interface, creating the engine if needed.
+
+        Returns Subscription
+        '''
+
+        with self.lock:
+            engine = self.engines.get(interface)
+
+            if engine is None:
+                engine = CaptureEngine(interface, self.capture_filter)
+                self.engines[interface] = engine
+
+        return engine.subscribe(ip, path, bgp_only, max_packets, callback)
+
+
+class FlightRecorder(object):
+
+    '''
+    Bounded ring of the most recent BGP packets, frozen to a pcap on demand.
+
+    Packets are kept as the (header, data) strings the engine read, so recording
+    and freezing never copy packet bytes. The ring is trimmed to the last
+    window seconds and to at most max_bytes of packet data, whichever is smaller.
+    '''
+
+    def __init__(self, interface="any", window=30, max_bytes=4 * 1024 * 1024, command=None):
+        '''
+        window = seconds of traffic to keep
+        max_bytes = cap on memory used by recorded packets
+        ring = deque of (timestamp, src, dst, header, data)
+        '''
+
+        self.window = window
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.ring = deque()
+        self.bytes = 0
+        self.linktype = pcap_format.LINKTYPE_LINUX_SLL
+        self.engine = CaptureEngine(interface, "tcp port " + str(pcap_format.BGP_PORT), command)
+
+    def start(self):
+        '''
+        Starts recording
+        '''
+
+        self.engine.add_sink(self)
+
+    def stop(self):
+        '''
+        Stops recording and drops the ring
+        '''
+
+        self.engine.remove_sink(self)
+
+    def matches(self, info):
+        return info.sport == pcap_format.BGP_PORT or info.dport == pcap_format.BGP_PORT
+
+    def receive(self, ts, info, header, data):
+        '''
+        Adds a packet to the ring, evicting the oldest packets past the time or size cap.
+        '''
+
+        with self.lock:
+            if self.engine.linktype is not None:
+                self.linktype = self.engine.linktype
+
+            self.ring.append((ts, info.src, info.dst, header, data))
+            self.bytes += len(header) + len(data)
+
+            oldest = ts - self.window
+
+            while self.ring and (self.bytes > self.max_bytes or self.ring[0][0] < oldest):
+                evicted = self.ring.popleft()
+                self.bytes -= len(evicted[3]) + len(evicted[4])
+
+    def close(self):
+        with self.lock:
+            self.ring.clear()
+            self.bytes = 0
+
+    def freeze(self, path, ip=None, seconds=None):
+        '''
+        Writes the recorded packets to a pcap file.
+
+        Keyword Args:
+        path - pcap file to write
+        ip - only write packets to or from this peer. Defaults to every peer
+        seconds - only write the last seconds of the ring. Defaults to the whole window
+
+        Returns number of packets written
+        '''
+
+        # Only references are copied under the lock, the file is written without it
+        with self.lock:
+            snapshot = list(self.ring)
+            linktype = self.linktype
+
+        if seconds is not None and snapshot:
+            oldest = snapshot[-1][0] - seconds
+            snapshot = [record for record in snapshot if record[0] >= oldest]
+
+        if ip is not None:
+            snapshot = [record for record in snapshot if record[1] == ip or record[2] == ip]
+
+        writer = pcap_format.PcapWriter(path, linktype)
+
+        for record in snapshot:
+            writer.write_raw(record[3], record[4])
+
+        writer.close()
+
+        if debug:
+            print "Flight recorder wrote " + str(len(snapshot)) + " packets to " + path
+
+        return len(snapshot)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import unittest
+import command_trace
+import diag_collector
+import tempfile
+import shutil
+import json
+import os
+
+
+class TestCommandTrace(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.trace_file = os.path.join(self.tmp_dir, "trace.json")
+        self.orig_tracer = command_trace.tracer
+        command_trace.tracer = command_trace.CommandTracer(self.trace_file)
+
+    def tearDown(self):
+        command_trace.tracer = self.orig_tracer
+        shutil.rmtree(self.tmp_dir)
+
+    def test_template(self):
+        self.assertEqual(command_trace.template("vtysh -c 'show ip bgp neighbor 10.1.1.1'"),
+                         "vtysh -c 'show ip bgp neighbor <ip>'")
+        self.assertEqual(command_trace.template("ping -c 5 2001:db8::1"), "ping -c 5 <ip>")
+        self.assertEqual(command_trace.template("ps -eo pcpu,pid,user,args | sort -k 1 -r | head -10"),
+                         "ps -eo pcpu,pid,user,args | sort -k 1 -r | head -10")
+
+    def test_run_aggregates_per_template(self):
+        self.assertEqual(command_trace.run("echo 10.1.1.1"), "10.1.1.1\n")
+        command_trace.run("echo 10.1.1.2")
+        command_trace.run("exit 3")
+
+        stats = command_trace.tracer.stats["echo <ip>"]
+        self.assertEqual(stats.count, 2)
+        self.assertEqual(stats.failures, 0)
+        self.assertEqual(stats.bytes_total, 18)
+        self.assertTrue(stats.wall_total >= stats.spawn_total)
+        self.assertEqual(command_trace.tracer.stats["exit 3"].failures, 1)
+
+        report = command_trace.tracer.report()
+        self.assertTrue("echo <ip>" in report)
+
+    def test_trace_file(self):
+        command_trace.run("echo 10.1.1.1")
+
+        records = [json.loads(line) for line in open(self.trace_file)]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["command"], "echo 10.1.1.1")
+        self.assertEqual(records[0]["bytes"], 9)
+        self.assertEqual(records[0]["exit"], 0)
+
+    def test_diag_collector_recorded(self):
+        collector = diag_collector.DiagnosticCollector()
+        collector.collect(os.path.join(self.tmp_dir, "log"), ["echo hello"]).wait(5)
+
+        stats = command_trace.tracer.stats["echo hello"]
+        self.assertEqual(stats.count, 1)
+        self.assertEqual(stats.bytes_total, 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+from subprocess import Popen, PIPE
+import json
+import re
+import signal
+import sys
+import threading
+import time
+import deadline_scheduler
+
+debug = False
+
+'''
+command_trace accounts for every external command the tools run.
+
+Each command is recorded with its spawn time (how long Popen took to fork/exec),
+wall time, output size and exit status, and aggregated per command template:
+the command with IP addresses replaced by <ip>, so the 500 copies of
+"show ip bgp neighbor x.x.x.x" are one line in the report.
+
+The report is printed to stderr on SIGUSR1 (see install_signal), and every
+command can also be appended to a trace file as one JSON object per line.
+
+    kill -USR1 $(pgrep -f bgp_neighbor_capture)
+
+    template                                   count  fail  spawn avg  wall avg  wall max  wall total   bytes avg
+    vtysh -c 'show ip bgp neighbor <ip>'         512     0     2.1ms   41.0ms   180.2ms     20.99s       2301
+'''
+
+address_pattern = re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}\b|[0-9a-fA-F]*:[0-9a-fA-F]*:[0-9a-fA-F:.]*")
+
+
+class CommandStats(object):
+
+    '''
+    Totals for one command template
+    '''
+
+    def __init__(self, template):
+        self.template = template
+        self.count = 0
+        self.failures = 0
+        self.spawn_total = 0.0
+        self.spawn_max = 0.0
+        self.wall_total = 0.0
+        self.wall_max = 0.0
+        self.bytes_total = 0
+
+    def add(self, spawn, wall, output_bytes, returncode):
+        self.count += 1
+        self.spawn_total += spawn
+        self.spawn_max = max(self.spawn_max, spawn)
+        self.wall_total += wall
+        self.wall_max = max(self.wall_max, wall)
+        self.bytes_total += output_bytes
+
+        if returncode != 0:
+            self.failures += 1
+
+
+class CommandTracer(object):
+
+    '''
+    Aggregates command records per template, optionally appending each to a trace file.
+    '''
+
+    def __init__(self, trace_file=None):
+        '''
+        trace_file = path to append JSON lines to, None to only aggregate
+        stats = template -> CommandStats
+        '''
+
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.trace = None
+
+        if trace_file is not None:
+            self.open(trace_file)
+
+    def open(self, trace_file):
+        '''
+        Starts appending every record to trace_file
+        '''
+
+        with self.lock:
+            self.trace = open(trace_file, "a")
+
+    def record(self, command, spawn, wall, output_bytes, returncode):
+        '''
+        Records a finished command.
+
+        Keyword Args:
+        command - the shell command
+        spawn - seconds Popen took to return
+        wall - seconds from spawn until the command exited
+        output_bytes - bytes read from the command
+        returncode - exit status, negative if killed by a signal
+        '''
+
+        key = template(command)
+
+        with self.lock:
+            stats = self.stats.get(key)
+
+            if stats is None:
+                stats = CommandStats(key)
+                self.stats[key] = stats
+
+            stats.add(spawn, wall, output_bytes, returncode)
+
+            if self.trace is not None:
+                self.trace.write(json.dumps({"time": time.time(), "command": command, "spawn": round(spawn, 6),
+                                             "wall": round(wall, 6), "bytes": output_bytes,
+                                             "exit": returncode}) + "\n")
+                self.trace.flush()
+
+        if debug:
+            print "%s: exit %s, %.3fs, %d bytes" % (command, returncode, wall, output_bytes)
+
+    def report(self):
+        '''
+        Returns a text table of every template, most total wall time first
+        '''
+
+        with self.lock:
+            stats = sorted(self.stats.values(), key=lambda s: s.wall_total, reverse=True)
+
+        width = max([len(s.template) for s in stats] + [8])
+        lines = [("%-" + str(width) + "s %6s %5s %10s %9s %9s %11s %11s") %
+                 ("template", "count", "fail", "spawn avg", "wall avg", "wall max", "wall total", "bytes avg")]
+
+        for s in stats:
+            lines.append(("%-" + str(width) + "s %6d %5d %8.1fms %7.1fms %7.1fms %10.2fs %11d") %
+                         (s.template, s.count, s.failures, s.spawn_total / s.count * 1000,
+                          s.wall_total / s.count * 1000, s.wall_max * 1000, s.wall_total,
+                          s.bytes_total // s.count))
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self, stream=None):
+        '''
+        Writes the report to stream (stderr by default)
+        '''
+
+        stream = stream or sys.stderr
+        stream.write(self.report())
+        stream.flush()
+
+
+tracer = CommandTracer()  # Shared by every module in the process
+
+
+def template(command):
+    '''
+    Returns the command with IP addresses replaced by <ip>.
+    ex. "ping -c 5 10.1.1.1" -> "ping -c 5 <ip>"
+    '''
+
+    return address_pattern.sub("<ip>", command)
+
+
+def record(command, spawn, wall, output_bytes, returncode):
+    '''
+    Records a command on the shared tracer. See CommandTracer.record()
+    '''
+
+    tracer.record(command, spawn, wall, output_bytes, returncode)
+
+
+def run(command):
+    '''
+    Runs a shell command to completion and records it on the shared tracer.
+
+    Keyword Args:
+    command - shell command string. ex. "cl-acltool -i"
+
+    Returns string stdout of the command
+    '''
+
+    start = deadline_scheduler.monotonic()
+    p = Popen(command, shell=True, stdout=PIPE, stderr=PIPE)
+    spawned = deadline_scheduler.monotonic()
+    output = p.communicate()[0]
+
+    record(command, spawned - start, deadline_scheduler.monotonic() - start, len(output), p.returncode)
+
+    return output
+
+
+def install_signal(signum=signal.SIGUSR1):
+    '''
+    Dumps the shared tracer's report to stderr whenever the process receives signum
+    '''
+
+    signal.signal(signum, lambda received, frame: tracer.dump())
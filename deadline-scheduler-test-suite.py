@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+import unittest
+import deadline_scheduler
+
+
+class TestMonotonic(unittest.TestCase):
+
+    def test_never_goes_backwards(self):
+        readings = [deadline_scheduler.monotonic() for i in range(1000)]
+        self.assertEqual(readings, sorted(readings))
+
+
+class TestDeadlineScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = deadline_scheduler.VirtualClock()
+        self.scheduler = deadline_scheduler.DeadlineScheduler(self.clock)
+
+    def test_due_in_deadline_order(self):
+        self.scheduler.schedule_in("10.1.1.1", 60)
+        self.scheduler.schedule_in("10.2.2.2", 1)
+        self.scheduler.schedule_in("10.3.3.3", 30)
+
+        self.assertEqual(self.scheduler.time_until_next(), 1)
+        self.clock.advance(30)
+        self.assertEqual(self.scheduler.pop_due(), ["10.2.2.2", "10.3.3.3"])
+        self.assertEqual(self.scheduler.time_until_next(), 30)
+        self.assertEqual(len(self.scheduler), 1)
+
+    def test_reschedule(self):
+        self.scheduler.schedule_in("10.1.1.1", 5)
+        self.scheduler.schedule_in("10.1.1.1", 50)
+
+        self.clock.advance(10)
+        self.assertEqual(self.scheduler.pop_due(), [])
+        self.assertEqual(self.scheduler.next_deadline(), 50)
+
+    def test_cancel(self):
+        self.scheduler.schedule_in("10.1.1.1", 5)
+        self.scheduler.cancel("10.1.1.1")
+
+        self.clock.advance(10)
+        self.assertEqual(self.scheduler.pop_due(), [])
+        self.assertEqual(self.scheduler.next_deadline(), None)
+        self.assertFalse("10.1.1.1" in self.scheduler)
+
+    def test_heap_stays_bounded(self):
+        for i in range(10000):
+            self.scheduler.schedule_in("10.1.1.1", i)
+
+        self.assertTrue(len(self.scheduler.heap) < 100)
+        self.assertEqual(self.scheduler.deadline("10.1.1.1"), 9999)
+
+    def test_virtual_sleep(self):
+        self.clock.sleep(3600)
+        self.assertEqual(self.clock(), 3600)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+import ctypes
+import ctypes.util
+import heapq
+import itertools
+import os
+import time
+
+'''
+deadline_scheduler keeps track of when each of many keys (BGP peers) is next due.
+
+Deadlines are seconds on a monotonic clock, so they are unaffected by midnight,
+NTP steps or manual clock changes. Deadlines live in a min-heap: scheduling and
+rescheduling are O(log n) and finding the next due key is O(1).
+
+Rescheduling a key doesn't search the heap. The old entry is left in place and
+skipped when it reaches the top (lazy deletion). The heap is rebuilt when stale
+entries outnumber live ones.
+
+The clock is injectable. VirtualClock lets tests and simulations run
+hours of monitoring in milliseconds.
+'''
+
+CLOCK_MONOTONIC = 1  # from <linux/time.h>
+
+
+class timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+def _load_clock_gettime():
+    '''
+    Finds clock_gettime(). It lives in librt on older glibc (Debian wheezy) and in libc after 2.17.
+    '''
+
+    for name in ("c", "rt"):
+        path = ctypes.util.find_library(name)
+
+        if path is None:
+            continue
+
+        library = ctypes.CDLL(path, use_errno=True)
+
+        if hasattr(library, "clock_gettime"):
+            library.clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+            return library.clock_gettime
+
+    return None
+
+
+if hasattr(time, "monotonic"):
+    monotonic = time.monotonic
+
+else:
+    _clock_gettime = _load_clock_gettime()
+
+    def monotonic():
+        '''
+        Returns float seconds from CLOCK_MONOTONIC. Only differences between calls are meaningful.
+        '''
+
+        t = timespec()
+
+        if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        return t.tv_sec + t.tv_nsec * 1e-9
+
+
+class VirtualClock(object):
+
+    '''
+    A clock that only moves when told to. Callable like monotonic().
+    '''
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        '''
+        Moves the clock forward
+        '''
+
+        self.now += seconds
+
+    def sleep(self, seconds):
+        '''
+        Drop in replacement for time.sleep() that advances the clock instead of waiting
+        '''
+
+        self.advance(max(seconds, 0))
+
+
+class DeadlineScheduler(object):
+
+    '''
+    Min-heap of (deadline, key) with O(log n) rescheduling.
+    '''
+
+    def __init__(self, clock=monotonic):
+        '''
+        clock = function returning the current time in seconds
+        heap = list of [deadline, sequence, key]
+        entries = key -> the live heap entry for that key
+        '''
+
+        self.clock = clock
+        self.heap = []
+        self.entries = {}
+        self.sequence = itertools.count()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def schedule(self, key, deadline):
+        '''
+        Sets (or moves) the deadline of key
+
+        Keyword Args:
+        key - any hashable, ex. a neighbor IP
+        deadline - absolute time on self.clock
+        '''
+
+        entry = [deadline, next(self.sequence), key]
+        self.entries[key] = entry
+        heapq.heappush(self.heap, entry)
+
+        # Rebuild once stale entries dominate, keeping memory bounded under heavy rescheduling
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = list(self.entries.values())
+            heapq.heapify(self.heap)
+
+    def schedule_in(self, key, delay):
+        '''
+        Sets the deadline of key to delay seconds from now
+        '''
+
+        self.schedule(key, self.clock() + delay)
+
+    def deadline(self, key):
+        '''
+        Returns the deadline of key, or None if it isn't scheduled
+        '''
+
+        entry = self.entries.get(key)
+
+        return None if entry is None else entry[0]
+
+    def cancel(self, key):
+        '''
+        Removes key from the scheduler. The heap entry is dropped lazily.
+        '''
+
+        self.entries.pop(key, None)
+
+    def next_deadline(self):
+        '''
+        Returns the earliest deadline, or None if nothing is scheduled
+        '''
+
+        self._drop_stale()
+
+        if not self.heap:
+            return None
+
+        return self.heap[0][0]
+
+    def time_until_next(self):
+        '''
+        Returns seconds until the next deadline (never negative), or None if nothing is scheduled
+        '''
+
+        deadline = self.next_deadline()
+
+        if deadline is None:
+            return None
+
+        return max(deadline - self.clock(), 0)
+
+    def pop_due(self, now=None):
+        '''
+        Removes and returns every key whose deadline has passed, earliest first.
+        '''
+
+        if now is None:
+            now = self.clock()
+
+        due = []
+
+        while True:
+            self._drop_stale()
+
+            if not self.heap or self.heap[0][0] > now:
+                break
+
+            entry = heapq.heappop(self.heap)
+            del self.entries[entry[2]]
+            due.append(entry[2])
+
+        return due
+
+    def _drop_stale(self):
+        '''
+        Pops rescheduled or cancelled entries off the top of the heap
+        '''
+
+        while self.heap and self.entries.get(self.heap[0][2]) is not self.heap[0]:
+            heapq.heappop(self.heap)
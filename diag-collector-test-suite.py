@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+import unittest
+import diag_collector
+import tempfile
+import shutil
+import time
+import os
+
+
+class TestDiagnosticCollector(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.tmp_dir, "bgp_log_test.log")
+        self.collector = diag_collector.DiagnosticCollector(workers=4, timeout=5)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read_log(self):
+        return open(self.log_file).read().split("\n")
+
+    def test_commands_run_concurrently(self):
+        start = time.time()
+        collection = self.collector.collect(self.log_file, ["sleep 0.5", "sleep 0.5", "echo hello | cat"])
+        self.assertTrue(time.time() - start < 0.2)
+
+        self.assertTrue(collection.wait(3))
+        self.assertTrue(time.time() - start < 1.0)
+
+        log = self.read_log()
+        self.assertTrue("[echo] hello" in log)
+        self.assertEqual(len([line for line in log if line.startswith("[sleep] exit 0")]), 2)
+
+    def test_timeout(self):
+        collection = self.collector.collect(self.log_file, ["echo before; sleep 10"], timeout=0.5)
+        self.assertTrue(collection.wait(3))
+
+        log = self.read_log()
+        self.assertTrue("[echo] before" in log)
+        self.assertTrue(log[-2].startswith("[echo] killed after"))
+
+    def test_output_streams_before_exit(self):
+        collection = self.collector.collect(self.log_file, ["echo early; sleep 1"])
+        time.sleep(0.5)
+        self.assertTrue("[echo] early" in self.read_log())
+        collection.wait(3)
+
+    def test_function_command(self):
+        def socket_snapshot():
+            return ["ESTABLISHED 0 0 10.1.1.2:179 10.1.1.1:40000"]
+
+        def broken():
+            raise ValueError("no netlink")
+
+        collection = self.collector.collect(self.log_file, [socket_snapshot, broken, "echo hello"])
+        self.assertTrue(collection.wait(3))
+
+        log = self.read_log()
+        self.assertTrue("[socket_snapshot] ESTABLISHED 0 0 10.1.1.2:179 10.1.1.1:40000" in log)
+        self.assertTrue("[broken] failed: ValueError('no netlink',)" in log)
+        self.assertTrue("[echo] hello" in log)
+
+    def test_cancel(self):
+        collection = self.collector.collect(self.log_file, ["sleep 10"])
+        time.sleep(0.2)
+        collection.cancel()
+        self.assertTrue(collection.wait(3))
+
+
+if __name__ == '__main__':
+    unittest.main()
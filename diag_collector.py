@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+from subprocess import Popen, PIPE, STDOUT
+from multiprocessing.pool import ThreadPool
+import os
+import signal
+import threading
+import time
+import command_trace
+
+debug = False
+
+'''
+diag_collector runs diagnostic shell commands in the background.
+
+Each incident's commands run concurrently on a bounded pool of worker threads.
+Every command has its own timeout, and output is written to the incident log
+line by line as it arrives, so nothing is held in memory and a slow command
+(ex. ping to a dead peer) doesn't hold up the others or the caller.
+
+A command can also be a function returning a list of lines, for data read
+in-process (ex. sock_diag instead of "ss"). It runs on a worker like any other command.
+
+Lines in the log are tagged with the first word of the command (or the function name) that produced them:
+
+    [vmstat] $ vmstat
+    [vmstat] procs -----------memory---------- ---swap-- -----io---- -system-- ----cpu----
+    [ping] $ ping -c 5 10.12.12.2
+    [vmstat]  r  b   swpd   free   buff  cache   si   so    bi    bo   in   cs us sy id wa
+    [vmstat] exit 0 after 0.01s
+'''
+
+
+class Collection(object):
+
+    '''
+    The set of diagnostic commands for one incident, streaming into one log file.
+    '''
+
+    def __init__(self, log_file, command_list, timeout, callback=None):
+        '''
+        log_file = path of the incident log. Appended to.
+        command_list = list of shell command strings, or functions returning a list of lines
+        timeout = seconds before a command is killed
+        callback = called with log_file once every command has finished and the log is closed
+        processes = Popen objects still running
+        done = Event set when every command has finished
+        '''
+
+        self.log_file = log_file
+        self.command_list = command_list
+        self.timeout = timeout
+        self.callback = callback
+        self.log = open(log_file, 'a')
+        self.lock = threading.Lock()
+        self.remaining = len(command_list)
+        self.processes = set()
+        self.cancelled = False
+        self.done = threading.Event()
+
+        if self.remaining == 0:
+            self._finish()
+
+    def write(self, tag, text):
+        '''
+        Writes a single tagged line to the log
+        '''
+
+        with self.lock:
+            if not self.log.closed:
+                self.log.write("[" + tag + "] " + text.rstrip("\n") + "\n")
+                self.log.flush()
+
+    def run(self, command):
+        '''
+        Runs a single command, streaming its output into the log. Called on a worker thread.
+        '''
+
+        if callable(command):
+            self.run_function(command)
+            return
+
+        tag = command.split(" ")[0]
+
+        with self.lock:
+            if self.cancelled:
+                self._command_done()
+                return
+
+        start = time.time()
+        self.write(tag, "$ " + command)
+
+        try:
+            # Own process group so pipelines ("ps | sort | head") are killed as a whole
+            p = Popen(command, shell=True, stdout=PIPE, stderr=STDOUT, preexec_fn=os.setsid)
+            spawn = time.time() - start
+        except OSError as e:
+            self.write(tag, "failed to start: " + str(e))
+            with self.lock:
+                self._command_done()
+            return
+
+        with self.lock:
+            self.processes.add(p)
+            cancelled = self.cancelled
+
+        # cancel() may have run between the check above and Popen
+        if cancelled:
+            kill_process(p)
+
+        timer = threading.Timer(self.timeout, kill_process, (p,))
+        timer.start()
+
+        output_bytes = 0
+
+        try:
+            for line in iter(p.stdout.readline, ""):
+                output_bytes += len(line)
+                self.write(tag, line)
+
+            p.wait()
+        finally:
+            timer.cancel()
+
+        wall = time.time() - start
+        command_trace.record(command, spawn, wall, output_bytes, p.returncode)
+        elapsed = "%.2fs" % wall
+
+        if p.returncode == -signal.SIGKILL:
+            self.write(tag, "killed after " + elapsed)
+        else:
+            self.write(tag, "exit " + str(p.returncode) + " after " + elapsed)
+
+        with self.lock:
+            self.processes.discard(p)
+            self._command_done()
+
+    def run_function(self, function):
+        '''
+        Runs an in-process collector function and writes the lines it returns
+        '''
+
+        tag = function.__name__
+
+        try:
+            with self.lock:
+                if self.cancelled:
+                    return
+
+            start = time.time()
+            self.write(tag, "$ " + tag)
+
+            try:
+                lines = function()
+            except Exception as e:
+                self.write(tag, "failed: " + repr(e))
+                return
+
+            for line in lines:
+                self.write(tag, line)
+
+            self.write(tag, "done after %.2fs" % (time.time() - start))
+
+        finally:
+            with self.lock:
+                self._command_done()
+
+    def cancel(self):
+        '''
+        Kills running commands and skips any that haven't started
+        '''
+
+        with self.lock:
+            self.cancelled = True
+            running = list(self.processes)
+
+        for p in running:
+            kill_process(p)
+
+    def wait(self, timeout=None):
+        '''
+        Blocks until every command has finished. Returns True if they have.
+        '''
+
+        return self.done.wait(timeout)
+
+    def _command_done(self):
+        '''
+        Marks a command finished. Caller holds self.lock.
+        '''
+
+        self.remaining -= 1
+
+        if self.remaining <= 0:
+            self._finish()
+
+    def _finish(self):
+        self.log.close()
+        self.done.set()
+
+        if self.callback is not None:
+            self.callback(self.log_file)
+
+        if debug:
+            print "Collection complete: " + self.log_file
+
+
+class DiagnosticCollector(object):
+
+    '''
+    Runs Collections on a shared, bounded pool of worker threads.
+    '''
+
+    def __init__(self, workers=4, timeout=15):
+        '''
+        workers = maximum number of commands running at once across all incidents
+        timeout = default seconds before a command is killed
+        '''
+
+        self.workers = workers
+        self.timeout = timeout
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def collect(self, log_file, command_list, timeout=None, callback=None):
+        '''
+        Starts running command_list in the background and returns immediately.
+
+        Keyword Args:
+        log_file - path of the incident log
+        command_list - list of shell command strings, or functions returning a list of lines
+        timeout - seconds before a command is killed. Defaults to the collector timeout
+        callback - called with log_file when the collection is complete
+
+        Returns Collection
+        '''
+
+        if timeout is None:
+            timeout = self.timeout
+
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPool(self.workers)
+
+        collection = Collection(log_file, command_list, timeout, callback)
+
+        for command in command_list:
+            self.pool.apply_async(collection.run, (command,))
+
+        return collection
+
+
+def kill_process(p):
+    '''
+    Kills the process group of a Popen started with os.setsid
+    '''
+
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
@@ -4,10 +4,12 @@ import sys
 import getopt
 import time
 import re
-from subprocess import Popen, PIPE
+import vtysh_session
+import command_trace
 
 debug = False
 offline = False
+vtysh_pool = None  # vtysh_session.VtyshPool when using a persistent vtysh session
 
 # location of CoPP file
 copp_file = "/etc/cumulus/acl/policy.d/00control_plane.rules"
@@ -47,9 +49,18 @@ def get_neighbor_ips(testing=False):
         quagga_lines = read_file(config_file)
 
     else:
-        p = Popen("vtysh -c 'show run'", shell=True, stdout=PIPE, stderr=PIPE)
+        config_chars = None
+
+        if vtysh_pool is not None:
+            try:
+                config_chars = vtysh_pool.send("show run")
+            except vtysh_session.VtyshError as e:
+                if debug:
+                    print "vtysh session failed, spawning vtysh: " + str(e)
+
+        if config_chars is None:
+            config_chars = command_trace.run("vtysh -c 'show run'")
 
-        config_chars = p.communicate()[0]
         quagga_lines = config_chars.split("\n")
 
     slice_len = len(" neighbor ") - 1
@@ -270,21 +281,27 @@ def write_copp_config(copp_config):
 
     file_handler.close()
 
-    p = Popen("cl-acltool -i", shell=True, stdout=PIPE, stderr=PIPE)
-
-    return p.communicate()[0]
+    return command_trace.run("cl-acltool -i")
 
 
 def main(argv):
-    global debug, offline
+    global debug, offline, vtysh_pool
 
-    options, remainder = getopt.getopt(sys.argv[1:], "", ["debug", "offline"])
+    options, remainder = getopt.getopt(sys.argv[1:], "", ["debug", "offline", "persistent", "trace-file="])
 
     for opt, arg in options:
         if opt in "--debug":
             debug = True
         if opt in "--offline":
             offline = True
+        if opt in "--persistent":
+            vtysh_pool = vtysh_session.VtyshPool(1)
+        if opt in "--trace-file":
+            # Append every external command to a JSON lines file
+            command_trace.tracer.open(arg)
+
+    # kill -USR1 prints per command timing to stderr
+    command_trace.install_signal()
 
     # Get a list of all Established neighbor IPs. convert to set for easer operations later
     old_neighbor_list = get_neighbor_ips(testing=offline)
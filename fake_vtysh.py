@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+import sys
+import json
+import time
+
+'''
+fake_vtysh behaves like an interactive vtysh session for offline testing.
+
+It prints a prompt, reads one command per line from stdin and replays the
+recorded output for that command. Recordings are a JSON file mapping
+command -> output string, or command -> {"output": string, "sleep": seconds}
+to simulate a slow vtysh.
+
+Unknown commands print the same error vtysh does.
+
+Usage: fake_vtysh.py <recording.json> [hostname]
+'''
+
+
+def main(argv):
+    recording = json.load(open(argv[0]))
+    hostname = argv[1] if len(argv) > 1 else "fake"
+    prompt = hostname + "# "
+
+    sys.stdout.write(prompt)
+    sys.stdout.flush()
+
+    while True:
+        line = sys.stdin.readline()
+
+        if not line:
+            break
+
+        command = line.strip()
+
+        if command in ("exit", "quit"):
+            break
+
+        sys.stdout.write(command + "\n")
+
+        if command == "terminal length 0":
+            output = ""
+
+        elif command in recording:
+            output = recording[command]
+
+            if isinstance(output, dict):
+                time.sleep(output.get("sleep", 0))
+                output = output.get("output", "")
+
+        elif command == "":
+            output = ""
+
+        else:
+            output = "% Unknown command.\n"
+
+        sys.stdout.write(output)
+        sys.stdout.write(prompt)
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+import unittest
+import incident_groups
+import deadline_scheduler
+import route_lookup
+
+
+class FakeNeighbor(object):
+
+    def __init__(self, ip, interface=None, next_hop=None, remote_as=None, multipath=False):
+        self.ip = ip
+        self.route = route_lookup.Route(ip, interface, next_hop, None, multipath) if interface is not None else None
+        self.remote_as = remote_as
+
+
+class TestIncidentGroups(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = deadline_scheduler.VirtualClock(0)
+        self.groups = incident_groups.IncidentGroups(window=30, clock=self.clock)
+        self.incidents = []
+
+    def new_incident(self):
+        self.incidents.append("incident %d" % len(self.incidents))
+        return self.incidents[-1]
+
+    def test_keys(self):
+        self.assertEqual(incident_groups.correlation_keys(FakeNeighbor("10.1.1.1", "swp1", "10.1.1.254", 65001)),
+                         set([("interface", "swp1"), ("next_hop", "10.1.1.254"), ("remote_as", 65001)]))
+        self.assertEqual(incident_groups.correlation_keys(FakeNeighbor("10.1.1.1")), set())
+        # behind ECMP only the AS is known
+        self.assertEqual(incident_groups.correlation_keys(FakeNeighbor("10.1.1.1", "swp1", "10.1.1.254", 65001,
+                                                                        multipath=True)),
+                         set([("remote_as", 65001)]))
+
+    def test_shared_interface(self):
+        leader, opened = self.groups.join(FakeNeighbor("10.1.1.1", "swp1"), self.new_incident)
+        self.assertTrue(opened)
+        self.assertEqual(leader.incident, "incident 0")
+
+        self.clock.advance(10)
+        group, opened = self.groups.join(FakeNeighbor("10.1.1.5", "swp1"), self.new_incident)
+        self.assertFalse(opened)
+        self.assertTrue(group is leader)
+        self.assertEqual(group.members, set(["10.1.1.1", "10.1.1.5"]))
+        self.assertEqual(self.incidents, ["incident 0"])
+
+    def test_chain_of_keys(self):
+        group = self.groups.join(FakeNeighbor("10.1.1.1", "swp1", remote_as=65001))[0]
+        # shares the AS, brings swp2 into the group
+        self.groups.join(FakeNeighbor("10.2.2.1", "swp2", remote_as=65001))
+        self.assertTrue(self.groups.join(FakeNeighbor("10.2.2.5", "swp2", remote_as=65009))[0] is group)
+
+    def test_unrelated_and_window(self):
+        self.groups.join(FakeNeighbor("10.1.1.1", "swp1"))
+        self.assertTrue(self.groups.join(FakeNeighbor("10.2.2.1", "swp2"))[1])
+
+        # the window slides with each member joining
+        self.clock.advance(25)
+        self.assertFalse(self.groups.join(FakeNeighbor("10.1.1.5", "swp1"))[1])
+        self.clock.advance(25)
+        self.assertFalse(self.groups.join(FakeNeighbor("10.1.1.6", "swp1"))[1])
+        self.clock.advance(31)
+        self.assertTrue(self.groups.join(FakeNeighbor("10.1.1.7", "swp1"))[1])
+
+    def test_unknown_peers_not_grouped(self):
+        self.groups.join(FakeNeighbor("10.1.1.1"))
+        self.assertTrue(self.groups.join(FakeNeighbor("10.1.1.2"))[1])
+
+    def test_leave(self):
+        group = self.groups.join(FakeNeighbor("10.1.1.1", "swp1"))[0]
+        self.groups.join(FakeNeighbor("10.1.1.5", "swp1"))
+
+        self.assertFalse(self.groups.leave(group, "10.1.1.1"))
+        self.assertTrue(self.groups.leave(group, "10.1.1.5"))
+        self.assertEqual(self.groups.groups, [])
+
+        # a closed group takes no new members
+        self.assertTrue(self.groups.join(FakeNeighbor("10.1.1.1", "swp1"))[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+import unittest
+import incident_history
+import tempfile
+import shutil
+import os
+
+
+class FakeClock(object):
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestIncidentHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, incident_history.db_name)
+        self.clock = FakeClock(1800000000)
+        self.history = incident_history.IncidentHistory(self.path, clock=self.clock)
+
+    def tearDown(self):
+        self.history.close_database()
+        shutil.rmtree(self.tmp_dir)
+
+    def query(self):
+        self.history.wait()
+        return incident_history.connect(self.path)
+
+    def test_session(self):
+        session = self.history.open("10.1.1.1", "10.1.1.1_01152027_080000", "swp3", 65001, "no message for 76.0s")
+        self.history.add_artifact(session, "bgp_log_10.1.1.1.log")
+        self.history.add_stats(session, {"cpu_peak_percent": 97.5, "capture_bytes": 1000})
+        session.observe(76.0)
+        session.observe(91.5)
+        session.observe(80.0)
+
+        self.clock.now += 240
+        self.history.close(session, extensions=2)
+        self.history.finalize_artifact("bgp_log_10.1.1.1.log", "bgp_log_10.1.1.1.log.gz", 300)
+        # a capture finishing after the session ended still counts
+        self.history.add_stats(session, {"capture_bytes": 500})
+
+        connection = self.query()
+        self.assertEqual(incident_history.for_peer(connection, "10.1.1.1"),
+                         [(session.id, 1800000000, 1800000240, "no message for 76.0s", 91.5)])
+        self.assertEqual(incident_history.session_details(connection, session.id),
+                         ([("bgp_log_10.1.1.1.log.gz", 300)], {"cpu_peak_percent": 97.5, "capture_bytes": 1500}))
+
+    def test_queries(self):
+        for day, peer, interface in [(1, "10.1.1.1", "swp3"), (2, "10.1.1.1", "swp3"), (3, "10.2.2.2", "swp4"),
+                                     (20, "10.1.1.1", "swp3"), (25, "10.2.2.2", "swp4"), (26, "10.2.2.2", "swp4"),
+                                     (27, "10.3.3.3", "swp3")]:
+            self.clock.now = 1800000000 + day * 86400
+            self.history.close(self.history.open(peer, interface=interface), 0)
+
+        connection = self.query()
+        self.assertEqual([row[:2] for row in incident_history.top_peers(connection, 0)],
+                         [("10.1.1.1", 3), ("10.2.2.2", 3), ("10.3.3.3", 1)])
+
+        last_week = 1800000000 + 21 * 86400
+        self.assertEqual([row[:2] for row in incident_history.top_peers(connection, last_week)],
+                         [("10.2.2.2", 2), ("10.3.3.3", 1)])
+        self.assertEqual([row[1] for row in incident_history.on_interface(connection, "swp3", last_week)],
+                         ["10.3.3.3"])
+
+    def test_queries_use_indexes(self):
+        connection = self.query()
+
+        for statement, values in [
+                ("SELECT peer, COUNT(*) FROM incidents WHERE started >= ? GROUP BY peer", (0,)),
+                ("SELECT id FROM incidents WHERE interface = ? AND started >= ? AND started < ?", ("swp3", 0, 1)),
+                ("SELECT id FROM incidents WHERE peer = ? AND started >= ?", ("10.1.1.1", 0))]:
+            plan = " ".join(str(row[-1]) for row in connection.execute("EXPLAIN QUERY PLAN " + statement, values))
+            self.assertTrue("USING" in plan and "INDEX" in plan, plan)
+
+    def test_prune(self):
+        self.history.close(self.history.open("10.1.1.1"), 0)
+        self.history.close_database()
+
+        self.clock.now += 401 * 86400
+        self.history = incident_history.IncidentHistory(self.path, keep_days=400, clock=self.clock)
+        self.assertEqual(incident_history.for_peer(self.query(), "10.1.1.1"), [])
+
+    def test_prune_while_running(self):
+        self.history.close(self.history.open("10.1.1.1"), 0)
+
+        self.clock.now += 401 * 86400
+        self.history.close(self.history.open("10.2.2.2"), 0)
+
+        connection = self.query()
+        self.assertEqual(incident_history.for_peer(connection, "10.1.1.1"), [])
+        self.assertEqual(len(incident_history.for_peer(connection, "10.2.2.2")), 1)
+
+    def test_evicted_artifact(self):
+        session = self.history.open("10.1.1.1")
+        self.history.add_artifact(session, "capture.pcap")
+        self.history.finalize_artifact("capture.pcap", "capture.pcap.gz", 300)
+        self.history.remove_artifact("capture.pcap.gz")
+
+        self.assertEqual(incident_history.session_details(self.query(), session.id), ([], {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
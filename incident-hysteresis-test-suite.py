@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+import unittest
+import incident_hysteresis
+import deadline_scheduler
+
+START = incident_hysteresis.START
+STOP = incident_hysteresis.STOP
+
+
+class TestHysteresis(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = deadline_scheduler.VirtualClock(0)
+        self.hysteresis = incident_hysteresis.Hysteresis(enter_after=2, exit_after=2, min_duration=60, cooldown=120,
+                                                         clock=self.clock)
+        self.peer = incident_hysteresis.PeerIncident()
+
+    def checks(self, results, interval=15):
+        '''
+        Runs one check per result, interval seconds apart. Returns the actions.
+        '''
+
+        actions = []
+
+        for received in results:
+            self.clock.advance(interval)
+            actions.append(self.hysteresis.update(self.peer, received))
+
+        return actions
+
+    def test_enter_threshold(self):
+        self.assertEqual(self.checks([False, True, False, False]), [None, None, None, START])
+        self.assertEqual(self.peer.state, incident_hysteresis.ACTIVE)
+
+    def test_min_duration_and_cooldown(self):
+        self.checks([False, False])
+
+        # healthy right away, but the session has to run 60s and then cool for 120s
+        actions = self.checks([True] * 12)
+
+        self.assertEqual(actions.index(STOP), 11)
+        self.assertEqual(self.peer.state, incident_hysteresis.IDLE)
+
+    def test_exit_threshold(self):
+        self.checks([False, False])
+        self.assertEqual(self.checks([True, False, True, False], interval=60), [None, None, None, None])
+        self.assertEqual(self.peer.state, incident_hysteresis.ACTIVE)
+
+    def test_relapse_extends(self):
+        self.checks([False, False])
+        self.checks([True] * 6)
+        self.assertEqual(self.peer.state, incident_hysteresis.COOLING)
+
+        # fails again while cooling: same session, no restart
+        self.assertEqual(self.checks([False]), [None])
+        self.assertEqual((self.peer.state, self.peer.extensions), (incident_hysteresis.ACTIVE, 1))
+        self.assertEqual(self.checks([True] * 10).count(STOP), 1)
+
+    def test_churn_bound(self):
+        # a marginal peer failing every other check for an hour
+        actions = self.checks([False, False, True] * 80)
+
+        self.assertEqual(self.hysteresis.max_sessions_per_hour(), 20)
+        self.assertTrue(actions.count(START) <= 20, actions.count(START))
+        self.assertEqual(actions.count(START), 1)
+
+    def test_no_hysteresis(self):
+        hysteresis = incident_hysteresis.Hysteresis(1, 1, 0, 0, self.clock)
+        self.assertEqual([hysteresis.update(self.peer, received) for received in [False, True, False, True]],
+                         [START, STOP, START, STOP])
+        self.assertEqual(hysteresis.max_sessions_per_hour(), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
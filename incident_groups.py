@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+import threading
+import deadline_scheduler
+import route_lookup
+
+debug = False
+
+'''
+incident_groups correlates peers that fail together into one incident.
+
+When a spine uplink degrades, every peer behind it goes quiet within seconds of
+the others. Troubleshooting each one separately means a capture, a system snapshot
+and a ping per peer, all landing on a control plane that is already struggling.
+
+A peer that starts failing within window seconds of the last peer to join an open
+group, and shares its interface, next hop or remote AS with any member, joins that group.
+The group's keys grow with every member, so a chain of related peers ends up
+together. The first peer (the leader) collects the system snapshot and starts the
+capture, and the others are added to the same incident and capture. The group's
+data collection stops once its last member recovers.
+'''
+
+
+class IncidentGroup(object):
+
+    '''
+    Peers being troubleshot as one incident.
+    '''
+
+    def __init__(self, leader, keys, now):
+        '''
+        leader = Neighbor that opened the group. Its capture and system snapshot are shared
+        members = IPs of the peers currently failing
+        keys = set of (kind, value) correlation keys of every member so far
+        last_joined = clock() time the latest member joined
+        incident = artifact_store incident id shared by every member
+        collection = the leader's diag_collector.Collection, cancelled with the group
+        captures = interface -> capture subscription that members on it are added to
+        subscriptions = every capture subscription the group started, stopped with the group
+        '''
+
+        self.leader = leader
+        self.members = set([leader.ip])
+        self.keys = set(keys)
+        self.last_joined = now
+        self.incident = None
+        self.collection = None
+        self.lock = threading.Lock()
+        self.captures = {}
+        self.subscriptions = []
+
+    def share_capture(self, interface, subscription):
+        '''
+        Records a capture subscription the group started on interface
+        '''
+
+        with self.lock:
+            self.subscriptions.append(subscription)
+            self.captures.setdefault(interface, subscription)
+
+    def capture_on(self, interface):
+        '''
+        Returns the group's capture subscription on interface, or None
+        '''
+
+        with self.lock:
+            return self.captures.get(interface)
+
+
+def correlation_keys(Neighbor):
+    '''
+    Returns set of (kind, value) a Neighbor can be correlated on: its interface,
+    next hop and remote AS, where known. The path of a peer behind ECMP isn't known.
+    '''
+
+    keys = set()
+
+    if Neighbor.route is not None and route_lookup.path_known(Neighbor.route):
+        if Neighbor.route.interface is not None:
+            keys.add(("interface", Neighbor.route.interface))
+
+        if Neighbor.route.next_hop is not None:
+            keys.add(("next_hop", Neighbor.route.next_hop))
+
+    if Neighbor.remote_as is not None:
+        keys.add(("remote_as", Neighbor.remote_as))
+
+    return keys
+
+
+class IncidentGroups(object):
+
+    '''
+    The open IncidentGroups.
+    '''
+
+    def __init__(self, window=30, clock=deadline_scheduler.monotonic):
+        '''
+        window = seconds after the latest member joined that a group still accepts related peers
+        clock = time source
+        groups = list of IncidentGroup with at least one member
+        '''
+
+        self.window = window
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.groups = []
+
+    def join(self, Neighbor, new_incident=None):
+        '''
+        Adds a failing Neighbor to the group it correlates with, or opens a new group led by it.
+
+        Keyword Args:
+        Neighbor - the Neighbor starting troubleshooting
+        new_incident - called to get the incident id when a new group is opened
+
+        Returns (IncidentGroup, True if the Neighbor opened it)
+        '''
+
+        now = self.clock()
+        keys = correlation_keys(Neighbor)
+
+        with self.lock:
+            for group in self.groups:
+                if now - group.last_joined <= self.window and group.keys & keys:
+                    group.members.add(Neighbor.ip)
+                    group.keys |= keys
+                    group.last_joined = now
+
+                    if debug:
+                        print Neighbor.ip + " joined the incident of " + group.leader.ip
+
+                    return group, False
+
+            group = IncidentGroup(Neighbor, keys, now)
+
+            if new_incident is not None:
+                group.incident = new_incident()
+
+            self.groups.append(group)
+
+        return group, True
+
+    def leave(self, group, ip):
+        '''
+        Removes a recovered peer from its group
+
+        Returns True if it was the last member and the group's data collection should stop
+        '''
+
+        with self.lock:
+            group.members.discard(ip)
+
+            if group.members:
+                return False
+
+            if group in self.groups:
+                self.groups.remove(group)
+
+        return True
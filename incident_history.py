@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+import getopt
+import sqlite3
+import sys
+import threading
+import time
+import Queue
+
+debug = False
+
+'''
+incident_history records every troubleshooting session in a SQLite database,
+so questions about months of incidents are an indexed query instead of a walk
+through a directory of files named after peer IPs.
+
+One row per peer per session in the incidents table: peer, interface, remote AS,
+start and end (unix time), what triggered it, the longest silence seen while it ran,
+how often hysteresis extended it and the artifact_store incident id (shared by
+peers troubleshot as one incident group). Artifacts and summary statistics of the
+data collection (peak CPU, lowest available memory, drops, capture bytes ...)
+hang off the session in their own tables.
+
+Sessions older than keep_days are deleted at startup and then once a day, and
+artifacts artifact_store evicts are removed, so a daemon's history stays bounded.
+
+Writes go through a background thread, like artifact_store, so the monitor never
+waits on flash. Queries open their own connection. The database is in WAL mode,
+so they can run while the monitor is writing.
+
+    incident_history.py --db=bgp_incidents.db --top-peers --days=30
+    incident_history.py --db=bgp_incidents.db --interface=swp3 --days=7
+'''
+
+db_name = "bgp_incidents.db"
+prune_interval = 86400  # seconds between deletions of sessions older than keep_days
+
+schema = [
+    """CREATE TABLE IF NOT EXISTS incidents (
+        id INTEGER PRIMARY KEY,
+        incident TEXT,
+        peer TEXT NOT NULL,
+        interface TEXT,
+        remote_as INTEGER,
+        started REAL NOT NULL,
+        ended REAL,
+        reason TEXT,
+        peak_last_read REAL,
+        extensions INTEGER NOT NULL DEFAULT 0)""",
+    "CREATE INDEX IF NOT EXISTS incidents_peer ON incidents (peer, started)",
+    "CREATE INDEX IF NOT EXISTS incidents_started ON incidents (started, peer, ended, peak_last_read)",
+    "CREATE INDEX IF NOT EXISTS incidents_interface ON incidents (interface, started)",
+    """CREATE TABLE IF NOT EXISTS artifacts (
+        session INTEGER NOT NULL REFERENCES incidents (id) ON DELETE CASCADE,
+        path TEXT NOT NULL,
+        bytes INTEGER)""",
+    "CREATE INDEX IF NOT EXISTS artifacts_session ON artifacts (session)",
+    "CREATE INDEX IF NOT EXISTS artifacts_path ON artifacts (path)",
+    """CREATE TABLE IF NOT EXISTS stats (
+        session INTEGER NOT NULL REFERENCES incidents (id) ON DELETE CASCADE,
+        name TEXT NOT NULL,
+        value REAL,
+        PRIMARY KEY (session, name))""",
+]
+
+
+class Session(object):
+
+    '''
+    One peer's troubleshooting session while it is open.
+    '''
+
+    __slots__ = ["id", "peer", "peak_last_read"]
+
+    def __init__(self, peer):
+        '''
+        id = incidents row id, set by the writer thread once the row is inserted
+        peer = peer IP
+        peak_last_read = longest silence in seconds seen during the session
+        '''
+
+        self.id = None
+        self.peer = peer
+        self.peak_last_read = 0.0
+
+    def observe(self, last_read):
+        '''
+        Records the seconds since the peer's last message at one check
+        '''
+
+        if last_read > self.peak_last_read:
+            self.peak_last_read = last_read
+
+
+def connect(path):
+    '''
+    Returns a sqlite3 connection to the history database at path, creating the tables if needed
+    '''
+
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("PRAGMA foreign_keys=ON")
+
+    with connection:
+        for statement in schema:
+            connection.execute(statement)
+
+    return connection
+
+
+class IncidentHistory(object):
+
+    '''
+    Writes troubleshooting sessions to the history database in the background.
+    '''
+
+    def __init__(self, path=db_name, keep_days=400, clock=time.time):
+        '''
+        path = SQLite database file
+        keep_days = sessions older than this are deleted, when the history is opened and then daily
+        clock = wall clock time source, sessions are stored in unix time
+        pruned = clock() time old sessions were last deleted
+        '''
+
+        self.path = path
+        self.keep_days = keep_days
+        self.clock = clock
+        self.pruned = None
+        self.jobs = Queue.Queue()
+        self.connection = connect(path)
+        self.worker = threading.Thread(target=self._run, name="incident-history")
+        self.worker.daemon = True
+        self.worker.start()
+
+        self.prune()
+
+    def open(self, peer, incident=None, interface=None, remote_as=None, reason=None):
+        '''
+        Starts a session
+
+        Keyword Args:
+        peer - peer IP
+        incident - artifact_store incident id
+        interface - interface the peer is reached through, if known
+        remote_as - the peer's AS, if known
+        reason - what triggered troubleshooting, ex. "no message for 76.0s"
+
+        Returns Session
+        '''
+
+        # A daemon runs for months, keep trimming the history while sessions are added
+        if self.clock() - self.pruned >= prune_interval:
+            self.prune()
+
+        session = Session(peer)
+        self._submit(self._insert, session, (incident, peer, interface, remote_as, self.clock(), reason))
+
+        return session
+
+    def close(self, session, extensions=0):
+        '''
+        Ends a session, recording its peak silence and how often it was extended
+        '''
+
+        self._submit(self._execute, session, "UPDATE incidents SET ended = ?, peak_last_read = ?, extensions = ? "
+                                             "WHERE id = ?", (self.clock(), session.peak_last_read, extensions))
+
+    def add_artifact(self, session, path):
+        '''
+        Records a log or capture written for a session
+        '''
+
+        self._submit(self._execute, session, "INSERT INTO artifacts (path, session) VALUES (?, ?)", (path,))
+
+    def finalize_artifact(self, path, final_path, size):
+        '''
+        Records where an artifact ended up (ex. compressed) and its size
+        '''
+
+        self._submit(self._execute, None, "UPDATE artifacts SET path = ?, bytes = ? WHERE path = ?",
+                     (final_path, size, path))
+
+    def remove_artifact(self, path):
+        '''
+        Forgets an artifact that was deleted, ex. evicted by artifact_store
+        '''
+
+        self._submit(self._execute, None, "DELETE FROM artifacts WHERE path = ?", (path,))
+
+    def prune(self):
+        '''
+        Deletes the sessions older than keep_days, with their artifacts and stats
+        '''
+
+        self.pruned = self.clock()
+        self._submit(self._prune, self.pruned - self.keep_days * 86400)
+
+    def add_stats(self, session, stats):
+        '''
+        Records summary statistics of a session's data collection
+
+        Keyword Args:
+        session - Session
+        stats - dict of name -> number. A name recorded twice adds up, ex. bytes of several captures
+        '''
+
+        for name, value in sorted(stats.items()):
+            self._submit(self._add_stat, session, name, value)
+
+    def wait(self):
+        '''
+        Blocks until every write so far is in the database. Used at shutdown and in testing.
+        '''
+
+        self.jobs.join()
+
+    def close_database(self):
+        self.wait()
+        self.connection.close()
+
+    def _submit(self, *job):
+        self.jobs.put(job)
+
+    def _run(self):
+        '''
+        Background thread. Runs writes in order, so a session's row exists before anything refers to it.
+        '''
+
+        while True:
+            job = self.jobs.get()
+
+            try:
+                with self.connection:
+                    job[0](*job[1:])
+            except sqlite3.Error as e:
+                if debug:
+                    print "Incident history error: " + str(e)
+            finally:
+                self.jobs.task_done()
+
+    def _insert(self, session, values):
+        session.id = self.connection.execute("INSERT INTO incidents (incident, peer, interface, remote_as, started, "
+                                             "reason) VALUES (?, ?, ?, ?, ?, ?)", values).lastrowid
+
+    def _execute(self, session, statement, values):
+        # The session's id goes last. It is only known once its insert has run.
+        if session is not None:
+            if session.id is None:
+                return
+
+            values = values + (session.id,)
+
+        self.connection.execute(statement, values)
+
+    def _add_stat(self, session, name, value):
+        # no UPSERT before SQLite 3.24
+        if session.id is None:
+            return
+
+        self.connection.execute("INSERT OR IGNORE INTO stats (session, name, value) VALUES (?, ?, 0)",
+                                (session.id, name))
+        self.connection.execute("UPDATE stats SET value = value + ? WHERE session = ? AND name = ?",
+                                (value, session.id, name))
+
+    def _prune(self, before):
+        self.connection.execute("DELETE FROM incidents WHERE started < ?", (before,))
+
+
+def top_peers(connection, since, limit=10):
+    '''
+    Returns list of (peer, sessions, total seconds troubleshot, longest silence) for the peers with the
+    most sessions started since a unix time
+    '''
+
+    return connection.execute("SELECT peer, COUNT(*), SUM(COALESCE(ended, started) - started), MAX(peak_last_read) "
+                              "FROM incidents WHERE started >= ? GROUP BY peer ORDER BY COUNT(*) DESC, peer "
+                              "LIMIT ?", (since, limit)).fetchall()
+
+
+def on_interface(connection, interface, since, until=None):
+    '''
+    Returns list of (id, peer, started, ended, reason, peak_last_read) of the sessions on an interface
+    started between two unix times, newest first
+    '''
+
+    return connection.execute("SELECT id, peer, started, ended, reason, peak_last_read FROM incidents "
+                              "WHERE interface = ? AND started >= ? AND started < ? ORDER BY started DESC",
+                              (interface, since, until if until is not None else float("inf"))).fetchall()
+
+
+def for_peer(connection, peer, since=0):
+    '''
+    Returns list of (id, started, ended, reason, peak_last_read) of a peer's sessions, newest first
+    '''
+
+    return connection.execute("SELECT id, started, ended, reason, peak_last_read FROM incidents "
+                              "WHERE peer = ? AND started >= ? ORDER BY started DESC", (peer, since)).fetchall()
+
+
+def session_details(connection, session):
+    '''
+    Returns (list of (path, bytes) artifacts, dict of stats) of a session
+    '''
+
+    artifacts = connection.execute("SELECT path, bytes FROM artifacts WHERE session = ? ORDER BY rowid",
+                                   (session,)).fetchall()
+    stats = dict(connection.execute("SELECT name, value FROM stats WHERE session = ?", (session,)).fetchall())
+
+    return artifacts, stats
+
+
+def format_time(seconds):
+    if seconds is None:
+        return "-"
+
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(seconds))
+
+
+def main(argv):
+    global debug
+
+    options, remainder = getopt.getopt(argv, "", ["debug", "db=", "days=", "top-peers", "interface=", "peer="])
+    path = db_name
+    days = 30
+    report = "top-peers"
+    argument = None
+
+    for opt, arg in options:
+        if opt in "--debug":
+            debug = True
+        if opt in "--db":
+            path = arg
+        if opt in "--days":
+            days = float(arg)
+        if opt in "--top-peers":
+            report = "top-peers"
+        if opt in "--interface":
+            report, argument = "interface", arg
+        if opt in "--peer":
+            report, argument = "peer", arg
+
+    connection = connect(path)
+    since = time.time() - days * 86400
+
+    if report == "top-peers":
+        print "%-40s %8s %10s %10s" % ("peer", "sessions", "seconds", "peak_read")
+
+        for peer, sessions, seconds, peak in top_peers(connection, since):
+            print "%-40s %8d %10.0f %10.1f" % (peer, sessions, seconds or 0, peak or 0)
+    else:
+        if report == "interface":
+            rows = on_interface(connection, argument, since)
+        else:
+            rows = [(row[0], argument) + tuple(row[1:]) for row in for_peer(connection, argument, since)]
+
+        for session, peer, started, ended, reason, peak in rows:
+            print "%s - %s  %-20s %6.1fs  %s" % (format_time(started), format_time(ended), peer, peak or 0, reason)
+
+            if debug:
+                artifacts, stats = session_details(connection, session)
+
+                for artifact_path, size in artifacts:
+                    print "    %s (%s bytes)" % (artifact_path, size)
+
+                for name, value in sorted(stats.items()):
+                    print "    %s = %s" % (name, value)
+
+    connection.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
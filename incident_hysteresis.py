@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+import deadline_scheduler
+
+debug = False
+
+'''
+incident_hysteresis decides when troubleshooting of a peer starts and stops, so a
+marginal peer that passes one check and fails the next doesn't restart tcpdump,
+flip "debug bgp" and rerun the diagnostics on every check.
+
+Each peer has a PeerIncident that moves through:
+
+    idle       - healthy. enter_after missed checks in a row start troubleshooting
+    active     - troubleshooting. exit_after healthy checks in a row, once the session
+                 is at least min_duration old, move it to cooling
+    cooling    - recovered, but the capture and debugs keep running for cooldown seconds.
+                 A missed check goes back to active and extends the same session
+                 (same incident, same capture) instead of starting a new one.
+                 A healthy check after cooldown seconds stops troubleshooting.
+
+Every session therefore lasts at least min_duration + cooldown seconds, which bounds
+how often tcpdump, debugs and diagnostics are started for one peer:
+
+    sessions per hour <= 3600 / (min_duration + cooldown)    (20 with the defaults)
+'''
+
+IDLE = "idle"
+ACTIVE = "active"
+COOLING = "cooling"
+
+# What the caller should do after a check
+START = "start"
+STOP = "stop"
+
+
+class PeerIncident(object):
+
+    '''
+    Where one peer is in the troubleshooting state machine.
+    '''
+
+    __slots__ = ["state", "misses", "healthy", "started", "recovered", "extensions"]
+
+    def __init__(self):
+        '''
+        state = IDLE, ACTIVE or COOLING
+        misses = missed checks in a row while idle
+        healthy = healthy checks in a row while active
+        started = clock() time troubleshooting started, None while idle
+        recovered = clock() time cooling started, None unless cooling
+        extensions = times the current session was extended by a relapse while cooling
+        '''
+
+        self.reset()
+
+    def reset(self):
+        '''
+        Back to idle, ex. when troubleshooting was stopped because the peer went down
+        '''
+
+        self.state = IDLE
+        self.misses = 0
+        self.healthy = 0
+        self.started = None
+        self.recovered = None
+        self.extensions = 0
+
+
+class Hysteresis(object):
+
+    '''
+    Moves PeerIncidents on the result of each liveliness check.
+    '''
+
+    def __init__(self, enter_after=1, exit_after=2, min_duration=60, cooldown=120,
+                 clock=deadline_scheduler.monotonic):
+        '''
+        enter_after = missed checks in a row that start troubleshooting
+        exit_after = healthy checks in a row before an active peer counts as recovered
+        min_duration = seconds troubleshooting runs for before it can start cooling
+        cooldown = seconds a recovered peer keeps its capture and debugs running
+        clock = time source
+        '''
+
+        self.enter_after = enter_after
+        self.exit_after = exit_after
+        self.min_duration = min_duration
+        self.cooldown = cooldown
+        self.clock = clock
+
+    def max_sessions_per_hour(self):
+        '''
+        Returns the most troubleshooting sessions one peer can start in an hour, None if unbounded
+        '''
+
+        if self.min_duration + self.cooldown <= 0:
+            return None
+
+        return 3600.0 / (self.min_duration + self.cooldown)
+
+    def update(self, peer, received):
+        '''
+        Records one liveliness check
+
+        Keyword Args:
+        peer - the peer's PeerIncident
+        received - True if the check heard from the peer in time, see neighbor_received_message()
+
+        Returns START or STOP if troubleshooting should start or stop, None to leave it as it is
+        '''
+
+        now = self.clock()
+
+        if peer.state == IDLE:
+            if received:
+                peer.misses = 0
+                return None
+
+            peer.misses += 1
+
+            if peer.misses < self.enter_after:
+                return None
+
+            peer.state = ACTIVE
+            peer.misses = 0
+            peer.healthy = 0
+            peer.started = now
+            return START
+
+        if not received:
+            if peer.state == COOLING:
+                # relapsed before the session ended, keep the capture going
+                peer.extensions += 1
+
+                if debug:
+                    print "Extending troubleshooting session, relapse %d" % peer.extensions
+
+            peer.state = ACTIVE
+            peer.healthy = 0
+            peer.recovered = None
+            return None
+
+        if peer.state == ACTIVE:
+            peer.healthy += 1
+
+            if peer.healthy < self.exit_after or now - peer.started < self.min_duration:
+                return None
+
+            peer.state = COOLING
+            peer.recovered = now
+
+        if now - peer.recovered < self.cooldown:
+            return None
+
+        peer.reset()
+        return STOP
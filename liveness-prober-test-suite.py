@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+import unittest
+import liveness_prober
+import deadline_scheduler
+import errno
+import socket
+import struct
+import time
+
+
+class TestEcho(unittest.TestCase):
+
+    def test_checksum(self):
+        packet = liveness_prober.build_echo(socket.AF_INET, 0x1234, 7, "abc")
+        self.assertEqual(liveness_prober.checksum(packet), 0)
+
+    def test_parse_reply(self):
+        ip_header = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 28, 0, 0, 64, 1, 0, "\x0a\x01\x01\x01", "\x0a\x01\x01\x02")
+        reply = liveness_prober.echo_header.pack(liveness_prober.ICMP_ECHO_REPLY, 0, 0, 0x1234, 7)
+        self.assertEqual(liveness_prober.parse_echo_reply(socket.AF_INET, ip_header + reply), (0x1234, 7))
+
+        # our own request looped back, and a truncated packet
+        request = liveness_prober.build_echo(socket.AF_INET, 0x1234, 7)
+        self.assertEqual(liveness_prober.parse_echo_reply(socket.AF_INET, ip_header + request), None)
+        self.assertEqual(liveness_prober.parse_echo_reply(socket.AF_INET, ip_header[:20]), None)
+
+        reply6 = liveness_prober.echo_header.pack(liveness_prober.ICMP6_ECHO_REPLY, 0, 0, 0x1234, 8)
+        self.assertEqual(liveness_prober.parse_echo_reply(socket.AF_INET6, reply6), (0x1234, 8))
+
+
+class TestProber(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = deadline_scheduler.VirtualClock(0)
+        self.alarms = []
+        self.sent = []
+        self.targets = ["10.1.1.1", "2001:db8::1"]
+        self.prober = liveness_prober.Prober(interval=0.2, timeout=0.5, targets=lambda: self.targets,
+                                             on_alarm=self.alarms.append, clock=self.clock)
+        self.prober.send = lambda family, ip, packet: self.sent.append((family, ip, packet))
+
+    def reply(self, ip, sequence):
+        family = liveness_prober.address_family(ip)
+        data = liveness_prober.echo_header.pack(liveness_prober.ICMP6_ECHO_REPLY, 0, 0, self.prober.identifier, sequence)
+
+        if family == socket.AF_INET:
+            data = "\x45" + "\0" * 19 + liveness_prober.echo_header.pack(liveness_prober.ICMP_ECHO_REPLY, 0, 0,
+                                                                         self.prober.identifier, sequence)
+
+        return self.prober.handle_reply(family, ip, data, self.clock())
+
+    def rounds(self, count, rtt=None, answering=None):
+        '''
+        Runs count rounds. Peers in answering reply after rtt seconds.
+        '''
+
+        for _ in range(count):
+            self.prober.send_round(self.clock())
+            self.clock.advance(rtt or 0)
+
+            for ip in answering or []:
+                self.reply(ip, self.prober.sequence)
+
+            self.clock.advance(0.2 - (rtt or 0))
+            self.prober.expire(self.clock())
+
+    def test_batched_round(self):
+        self.prober.send_round(self.clock())
+        self.assertEqual(sorted((family, ip) for family, ip, packet in self.sent),
+                         [(socket.AF_INET, "10.1.1.1"), (socket.AF_INET6, "2001:db8::1")])
+
+        self.clock.advance(0.002)
+        self.assertAlmostEqual(self.reply("10.1.1.1", self.prober.sequence), 0.002)
+        # duplicate, another sequence, or a reply from someone else
+        self.assertEqual(self.reply("10.1.1.1", self.prober.sequence), None)
+        self.assertEqual(self.reply("2001:db8::1", self.prober.sequence + 1), None)
+        self.assertEqual(self.reply("10.9.9.9", self.prober.sequence), None)
+
+    def test_loss_burst(self):
+        self.rounds(10, 0.001, self.targets)
+        self.assertEqual(self.prober.warning("10.1.1.1"), None)
+
+        # 10.1.1.1 stops answering. Probes time out after 0.5s.
+        self.rounds(5, 0.001, ["2001:db8::1"])
+        self.assertEqual(self.alarms, ["10.1.1.1"])
+        self.assertEqual(self.prober.warning("10.1.1.1"), "lost 3 of the last 10 probes")
+        self.assertEqual(self.prober.warning("2001:db8::1"), None)
+
+        # the alarm clears once the losses age out of the window
+        self.rounds(15, 0.001, self.targets)
+        self.assertEqual(self.prober.warning("10.1.1.1"), None)
+
+    def test_latency_burst(self):
+        self.rounds(10, 0.001, self.targets)
+        self.rounds(2, 0.02, self.targets)
+        self.assertEqual(self.alarms, [])
+
+        self.rounds(1, 0.02, self.targets)
+        self.assertEqual(sorted(self.alarms), sorted(self.targets))
+        self.assertTrue(self.prober.warning("10.1.1.1").startswith("3 probes over 11.0ms"))
+
+    def test_unreachable_counts_as_lost(self):
+        self.rounds(1, 0.001, self.targets)
+        self.prober.send = lambda family, ip, packet: errno.EHOSTUNREACH if ip == "10.1.1.1" else None
+        self.rounds(3)
+        self.assertEqual(self.alarms, ["10.1.1.1"])
+
+    def test_never_answered(self):
+        # ICMP filtered, or the replies policed by CoPP
+        self.rounds(20, 0.001, ["2001:db8::1"])
+        self.assertEqual(self.alarms, [])
+        self.assertEqual(self.prober.warning("10.1.1.1"), None)
+        # the last two rounds haven't timed out yet
+        self.assertEqual(self.prober.peers["10.1.1.1"].lost, 18)
+
+    def test_targets_change(self):
+        self.rounds(1, 0.001, self.targets)
+        self.targets = ["10.1.1.1"]
+        self.rounds(1, 0.001, self.targets)
+        self.assertEqual(sorted(self.prober.peers), ["10.1.1.1"])
+
+
+class TestLoopback(unittest.TestCase):
+
+    def test_probe_localhost(self):
+        prober = liveness_prober.Prober(interval=0.05, targets=lambda: ["127.0.0.1"])
+
+        try:
+            prober.start()
+        except socket.error as e:
+            self.skipTest("raw ICMP sockets unavailable: " + str(e))
+
+        try:
+            time.sleep(0.5)
+        finally:
+            prober.stop()
+
+        peer = prober.peers["127.0.0.1"]
+        self.assertTrue(peer.sent >= 5)
+        self.assertTrue(len([rtt for rtt in peer.results if rtt is not None]) >= 5)
+        self.assertEqual(prober.warning("127.0.0.1"), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,413 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+from collections import deque
+import errno
+import os
+import select
+import socket
+import struct
+import threading
+import deadline_scheduler
+
+debug = False
+
+'''
+liveness_prober pings every BGP peer several times a second, independent of the
+BGP timers. A silence only shows up in "Last read" after 1.25 keepalives (75s on
+default timers), but a path that starts dropping or queueing packets shows up in
+a few hundred milliseconds of probes.
+
+One thread sends an ICMP echo request to every peer each interval, back to back
+on one raw socket per address family, and waits for all the replies with select().
+Probing 1000 peers costs one wakeup per reply, not a thread or process per peer.
+
+Each peer keeps its last window results. Once loss_burst of them are lost, or
+latency_burst of them take latency_factor times the peer's usual round trip time,
+the peer is in alarm: on_alarm(ip) is called and warning(ip) describes it until
+the burst ages out of the window. Only peers that have answered at least once can
+alarm, a peer that filters ICMP is never reported.
+
+ICMP echo is answered by the peer's kernel, and Linux doesn't rate limit echo
+replies the way it does port unreachables, so it works at sub-second intervals
+where a UDP probe to a closed port would not.
+'''
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMP6_ECHO_REQUEST = 128
+ICMP6_ECHO_REPLY = 129
+
+# type, code, checksum, identifier, sequence
+echo_header = struct.Struct("!BBHHH")
+
+# send errors that mean the peer can't be reached, counted as a lost probe
+unreachable_errors = (errno.EHOSTUNREACH, errno.ENETUNREACH, errno.EHOSTDOWN)
+
+
+def checksum(data):
+    '''
+    Returns the internet checksum (RFC 1071) of data
+    '''
+
+    if len(data) % 2:
+        data += "\0"
+
+    total = sum(struct.unpack("!%dH" % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+
+    return ~total & 0xffff
+
+
+def address_family(ip):
+    return socket.AF_INET6 if ":" in ip else socket.AF_INET
+
+
+def build_echo(family, identifier, sequence, payload=""):
+    '''
+    Returns an ICMP (or ICMPv6) echo request. The kernel fills in the ICMPv6 checksum.
+    '''
+
+    if family == socket.AF_INET6:
+        return echo_header.pack(ICMP6_ECHO_REQUEST, 0, 0, identifier, sequence) + payload
+
+    header = echo_header.pack(ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+
+    return echo_header.pack(ICMP_ECHO_REQUEST, 0, checksum(header + payload), identifier, sequence) + payload
+
+
+def parse_echo_reply(family, data):
+    '''
+    Parses a packet read from a raw ICMP socket. IPv4 raw sockets include the IP header, IPv6 ones don't.
+
+    Returns (identifier, sequence) of an echo reply, or None for anything else
+    '''
+
+    if family == socket.AF_INET:
+        if not data:
+            return None
+
+        data = data[(ord(data[0]) & 0x0f) * 4:]
+        reply = ICMP_ECHO_REPLY
+    else:
+        reply = ICMP6_ECHO_REPLY
+
+    if len(data) < echo_header.size:
+        return None
+
+    kind, code, _, identifier, sequence = echo_header.unpack_from(data)
+
+    if kind != reply:
+        return None
+
+    return identifier, sequence
+
+
+class PeerProbes(object):
+
+    '''
+    Recent probe results of one peer.
+    '''
+
+    __slots__ = ["ip", "results", "baseline", "sent", "lost", "alarm"]
+
+    def __init__(self, ip, window):
+        '''
+        ip = peer IP
+        results = deque of the last window round trip times in seconds, None for a lost probe
+        baseline = usual round trip time, a moving average of the probes outside of alarms
+        sent = probes sent
+        lost = probes lost
+        alarm = description of the current loss or latency burst, None when healthy
+        '''
+
+        self.ip = ip
+        self.results = deque(maxlen=window)
+        self.baseline = None
+        self.sent = 0
+        self.lost = 0
+        self.alarm = None
+
+
+class Prober(object):
+
+    '''
+    Probes a changing set of peers from one background thread.
+    '''
+
+    def __init__(self, interval=0.2, timeout=0.5, window=10, loss_burst=3, latency_burst=3,
+                 latency_factor=5.0, min_latency=0.01, targets=None, on_alarm=None,
+                 clock=deadline_scheduler.monotonic):
+        '''
+        interval = seconds between probes of each peer
+        timeout = seconds before an unanswered probe counts as lost
+        window = results kept per peer
+        loss_burst = lost probes in the window that raise an alarm
+        latency_burst = slow probes in the window that raise an alarm
+        latency_factor = a probe is slow if it takes this many times the peer's baseline round trip time...
+        min_latency = ...and at least this many seconds more than the baseline, so a 0.1ms LAN doesn't alarm at 0.5ms
+        targets = function returning the IPs to probe, called every round
+        on_alarm = called with the IP of a peer going into alarm, from the prober thread
+        clock = time source for round trip times
+        peers = IP -> PeerProbes
+        pending = (IP, sequence) -> clock() time the probe was sent
+        rounds = deque of (clock() time, sequence, IPs) of each round still within timeout
+        '''
+
+        self.interval = interval
+        self.timeout = timeout
+        self.window = window
+        self.loss_burst = loss_burst
+        self.latency_burst = latency_burst
+        self.latency_factor = latency_factor
+        self.min_latency = min_latency
+        self.targets = targets
+        self.on_alarm = on_alarm
+        self.clock = clock
+        self.identifier = os.getpid() & 0xffff
+        self.sequence = 0
+        self.lock = threading.Lock()
+        self.peers = {}
+        self.pending = {}
+        self.rounds = deque()
+        self.sockets = {}
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        '''
+        Opens the raw ICMP sockets and starts the prober thread
+
+        Raises socket.error if neither IPv4 nor IPv6 probes can be sent, ex. without CAP_NET_RAW
+        '''
+
+        error = None
+
+        for family, protocol in [(socket.AF_INET, socket.IPPROTO_ICMP), (socket.AF_INET6, socket.IPPROTO_ICMPV6)]:
+            try:
+                sock = socket.socket(family, socket.SOCK_RAW, protocol)
+            except socket.error as e:
+                error = e
+                continue
+
+            sock.setblocking(0)
+            self.sockets[family] = sock
+
+        if not self.sockets:
+            raise error
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="liveness-prober")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        for sock in self.sockets.values():
+            sock.close()
+
+        self.sockets = {}
+
+    def run(self):
+        next_round = self.clock()
+        families = dict((sock, family) for family, sock in self.sockets.items())
+
+        while self.running:
+            now = self.clock()
+
+            if now >= next_round:
+                self.send_round(now)
+                # skip rounds we were too late for instead of bursting to catch up
+                next_round = max(next_round + self.interval, now)
+
+            wait_until = next_round
+
+            if self.rounds:
+                wait_until = min(wait_until, self.rounds[0][0] + self.timeout)
+
+            try:
+                readable = select.select(families.keys(), [], [], max(wait_until - self.clock(), 0))[0]
+            except select.error:
+                continue
+
+            for sock in readable:
+                self.receive(sock, families[sock])
+
+            self.expire(self.clock())
+
+    def receive(self, sock, family):
+        '''
+        Reads every packet waiting on a raw socket
+        '''
+
+        while True:
+            try:
+                data, address = sock.recvfrom(2048)
+            except socket.error:
+                return
+
+            self.handle_reply(family, address[0], data, self.clock())
+
+    def send_round(self, now):
+        '''
+        Sends one probe to every target
+        '''
+
+        ips = set(self.targets()) if self.targets is not None else set()
+        self.sequence = (self.sequence + 1) & 0xffff
+        unreachable = []
+        sent = []
+
+        with self.lock:
+            for ip in set(self.peers) - ips:
+                del self.peers[ip]
+
+            for ip in ips:
+                if ip not in self.peers:
+                    self.peers[ip] = PeerProbes(ip, self.window)
+
+        for ip in ips:
+            family = address_family(ip)
+            error = self.send(family, ip, build_echo(family, self.identifier, self.sequence))
+
+            if error is None:
+                sent.append(ip)
+
+                with self.lock:
+                    self.pending[(ip, self.sequence)] = now
+                    self.peers[ip].sent += 1
+            elif error in unreachable_errors:
+                unreachable.append(ip)
+            elif debug:
+                print "Probe of " + ip + " failed: " + os.strerror(error)
+
+        self.rounds.append((now, self.sequence, sent))
+
+        for ip in unreachable:
+            self.record(ip, None)
+
+    def send(self, family, ip, packet):
+        '''
+        Sends a probe. Returns None, or the errno it failed with
+        '''
+
+        sock = self.sockets.get(family)
+
+        if sock is None:
+            return errno.EAFNOSUPPORT
+
+        try:
+            sock.sendto(packet, (ip, 0))
+        except socket.error as e:
+            return e.errno
+
+        return None
+
+    def handle_reply(self, family, src, data, now):
+        '''
+        Matches a packet read from a raw socket to an outstanding probe
+
+        Returns the round trip time in seconds, or None if it wasn't a reply to us
+        '''
+
+        reply = parse_echo_reply(family, data)
+
+        if reply is None or reply[0] != self.identifier:
+            return None
+
+        # strip any %scope of link local replies
+        src = src.split("%")[0]
+
+        with self.lock:
+            sent = self.pending.pop((src, reply[1]), None)
+
+        if sent is None:
+            return None
+
+        self.record(src, now - sent)
+
+        return now - sent
+
+    def expire(self, now):
+        '''
+        Counts probes outstanding for longer than timeout as lost
+        '''
+
+        lost = []
+
+        # rounds are sent in order, only the oldest can have timed out
+        while self.rounds and now - self.rounds[0][0] >= self.timeout:
+            sent, sequence, ips = self.rounds.popleft()
+
+            with self.lock:
+                lost.extend(ip for ip in ips if self.pending.pop((ip, sequence), None) is not None)
+
+        for ip in lost:
+            self.record(ip, None)
+
+    def record(self, ip, rtt):
+        '''
+        Adds one probe result to a peer and checks for a burst
+
+        Keyword Args:
+        ip - peer IP
+        rtt - round trip time in seconds, None if the probe was lost
+        '''
+
+        with self.lock:
+            peer = self.peers.get(ip)
+
+            if peer is None:
+                return
+
+            peer.results.append(rtt)
+            lost = len([result for result in peer.results if result is None])
+
+            if rtt is None:
+                peer.lost += 1
+
+            alarm = None
+            limit = None
+
+            # A peer that never answered filters ICMP, or our own CoPP polices the replies. Its losses mean nothing.
+            if peer.baseline is not None:
+                limit = max(peer.baseline * self.latency_factor, peer.baseline + self.min_latency)
+                slow = len([result for result in peer.results if result is not None and result > limit])
+
+                if lost >= self.loss_burst:
+                    alarm = "lost %d of the last %d probes" % (lost, len(peer.results))
+                elif slow >= self.latency_burst:
+                    alarm = "%d probes over %.1fms, usual %.1fms" % (slow, limit * 1000, peer.baseline * 1000)
+
+            # only learn the usual round trip time from healthy probes
+            if rtt is not None and alarm is None and (limit is None or rtt <= limit):
+                peer.baseline = rtt if peer.baseline is None else peer.baseline * 0.9 + rtt * 0.1
+
+            raised = alarm is not None and peer.alarm is None
+            peer.alarm = alarm
+
+        if raised:
+            if debug:
+                print "Probe alarm for " + ip + ": " + alarm
+
+            if self.on_alarm is not None:
+                self.on_alarm(ip)
+
+    def warning(self, ip):
+        '''
+        Returns a description of the peer's current loss or latency burst, or None if it looks healthy
+        '''
+
+        with self.lock:
+            peer = self.peers.get(ip)
+
+            return peer.alarm if peer is not None else None
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+import unittest
+import urllib2
+import monitor_metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = monitor_metrics.Metrics()
+        self.metrics.describe("peer_gauge", "gauge", "A per peer gauge")
+        self.metrics.describe("events_total", "counter", "Events")
+        self.metrics.describe("latency_seconds", "histogram", "Latency", (0.1, 1))
+
+    def test_gauge_and_counter(self):
+        self.metrics.set("peer_gauge", 1.5, peer="10.1.1.1")
+        self.metrics.inc("events_total")
+        self.metrics.inc("events_total", 2)
+
+        text = self.metrics.render()
+
+        self.assertTrue("# TYPE peer_gauge gauge\n" in text)
+        self.assertTrue("peer_gauge{peer=\"10.1.1.1\"} 1.5\n" in text)
+        self.assertTrue("events_total 3\n" in text)
+
+    def test_histogram_cumulative(self):
+        for value in [0.05, 0.5, 0.5, 5]:
+            self.metrics.observe("latency_seconds", value, command="show ip bgp summary")
+
+        lines = self.metrics.render().split("\n")
+
+        self.assertTrue("latency_seconds_bucket{command=\"show ip bgp summary\",le=\"0.1\"} 1" in lines)
+        self.assertTrue("latency_seconds_bucket{command=\"show ip bgp summary\",le=\"1\"} 3" in lines)
+        self.assertTrue("latency_seconds_bucket{command=\"show ip bgp summary\",le=\"+Inf\"} 4" in lines)
+        self.assertTrue("latency_seconds_sum{command=\"show ip bgp summary\"} 6.05" in lines)
+        self.assertTrue("latency_seconds_count{command=\"show ip bgp summary\"} 4" in lines)
+
+    def test_remove_peer(self):
+        self.metrics.set("peer_gauge", 1, peer="10.1.1.1")
+        self.metrics.set("peer_gauge", 2, peer="10.1.1.2")
+        self.metrics.remove(peer="10.1.1.1")
+
+        self.assertEqual(self.metrics.get("peer_gauge", peer="10.1.1.1"), None)
+        self.assertEqual(self.metrics.get("peer_gauge", peer="10.1.1.2"), 2)
+
+    def test_serve(self):
+        self.metrics.inc("events_total")
+        server = monitor_metrics.serve(self.metrics, 0)
+
+        try:
+            url = "http://127.0.0.1:" + str(server.server_address[1])
+            self.assertTrue("events_total 1\n" in urllib2.urlopen(url + "/metrics").read())
+            self.assertRaises(urllib2.HTTPError, urllib2.urlopen, url + "/other")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import bisect
+import threading
+
+'''
+monitor_metrics keeps counters, gauges and histograms for the neighbor monitor
+and serves them in the Prometheus text format on a local HTTP port.
+
+Updates are a dict lookup and an add under a lock, so they can be made on
+every tick. The text is only built when the endpoint is scraped.
+
+    curl -s http://127.0.0.1:9179/metrics
+'''
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metrics(object):
+
+    '''
+    A set of metric series. A series is a metric name plus a set of labels.
+    '''
+
+    def __init__(self):
+        '''
+        kinds = name -> "gauge", "counter" or "histogram"
+        help = name -> description
+        buckets = histogram name -> sorted upper bounds
+        series = (name, labels) -> value, or [bucket counts..., +Inf count, sum, count] for histograms
+        '''
+
+        self.lock = threading.Lock()
+        self.kinds = {}
+        self.help = {}
+        self.buckets = {}
+        self.series = {}
+
+    def describe(self, name, kind, help_text, buckets=None):
+        '''
+        Declares a metric. Histograms use default_buckets unless buckets are given.
+        '''
+
+        self.kinds[name] = kind
+        self.help[name] = help_text
+
+        if kind == "histogram":
+            self.buckets[name] = tuple(sorted(buckets or default_buckets))
+
+    def set(self, name, value, **labels):
+        '''
+        Sets a gauge
+        '''
+
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            self.series[key] = value
+
+    def inc(self, name, amount=1, **labels):
+        '''
+        Increments a counter (or gauge)
+        '''
+
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        '''
+        Records a histogram observation
+        '''
+
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self.buckets[name]
+
+        with self.lock:
+            counts = self.series.get(key)
+
+            if counts is None:
+                # one slot per bucket, one for +Inf, then sum and count
+                counts = [0] * (len(buckets) + 3)
+                self.series[key] = counts
+
+            # counts are per bucket here, they are made cumulative when rendered
+            counts[bisect.bisect_left(buckets, value)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def remove(self, **labels):
+        '''
+        Drops every series carrying all of the given labels. ex. remove(peer="10.1.1.1")
+        '''
+
+        match = set(labels.items())
+
+        with self.lock:
+            for key in [key for key in self.series if match.issubset(key[1])]:
+                del self.series[key]
+
+    def get(self, name, **labels):
+        '''
+        Returns the value of a series, or None
+        '''
+
+        with self.lock:
+            return self.series.get((name, tuple(sorted(labels.items()))))
+
+    def render(self):
+        '''
+        Returns every series in the Prometheus text exposition format
+        '''
+
+        with self.lock:
+            series = sorted((key, value if not isinstance(value, list) else list(value))
+                            for key, value in self.series.items())
+
+        lines = []
+        last_name = None
+
+        for (name, labels), value in series:
+            kind = self.kinds.get(name, "untyped")
+
+            if name != last_name:
+                if name in self.help:
+                    lines.append("# HELP " + name + " " + self.help[name])
+                lines.append("# TYPE " + name + " " + kind)
+                last_name = name
+
+            if kind != "histogram":
+                lines.append(name + format_labels(labels) + " " + format_value(value))
+                continue
+
+            cumulative = 0
+
+            for bound, count in zip(self.buckets[name], value):
+                cumulative += count
+                lines.append(name + "_bucket" + format_labels(labels + (("le", format_value(bound)),)) +
+                             " " + str(cumulative))
+
+            lines.append(name + "_bucket" + format_labels(labels + (("le", "+Inf"),)) + " " + str(value[-1]))
+            lines.append(name + "_sum" + format_labels(labels) + " " + format_value(value[-2]))
+            lines.append(name + "_count" + format_labels(labels) + " " + str(value[-1]))
+
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+
+    return "{" + ",".join(key + "=\"" + str(value).replace("\"", "\\\"") + "\"" for key, value in labels) + "}"
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+
+    return str(value)
+
+
+def serve(metrics, port, address="127.0.0.1"):
+    '''
+    Serves metrics.render() at http://address:port/metrics on a background thread.
+
+    Returns the HTTPServer
+    '''
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+
+            body = metrics.render()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer((address, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server
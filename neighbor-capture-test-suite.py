@@ -1,6 +1,16 @@
 import unittest
 import bgp_neighbor_capture as bgp
 import datetime
+import time
+import deadline_scheduler
+import sock_diag
+import bgp_parser
+import route_lookup
+import incident_groups
+import incident_history
+import tempfile
+import shutil
+import os
 
 three_valid_peers = """BGP router identifier 10.2.2.2, local AS number 65222
 RIB entries 7, using 784 bytes of memory
@@ -316,5 +326,740 @@ class TestGetHoldTime(unittest.TestCase):
 
         self.assertEqual(result, expected_result)
 
+class TestGetLastRead(unittest.TestCase):
+
+    def test_clock_format(self):
+        result = bgp.get_last_read("192.168.1.1", neighbor_up_read_3_min)
+        self.assertEqual(result, datetime.timedelta(minutes=3, seconds=55))
+
+    def test_week_format(self):
+        output = bgp_neighbor_output.replace("Last read 00:00:55", "Last read 01w4d15h")
+        result = bgp.get_last_read("192.168.1.1", output)
+        self.assertEqual(result, datetime.timedelta(weeks=1, days=4, hours=15))
+
+    def test_unparsable(self):
+        result = bgp.get_last_read("192.168.1.1", "")
+        self.assertEqual(result, datetime.timedelta(hours=99))
+
+
+class TestNeighborReceivedMessage(unittest.TestCase):
+
+    def setUp(self):
+        self.orig_send_command = bgp.send_command
+        self.orig_clock = bgp.clock
+        self.output = bgp_neighbor_output
+        bgp.send_command = lambda command: self.output
+        bgp.clock = deadline_scheduler.VirtualClock(86399)
+
+        self.neighbor = bgp.Neighbor("192.168.1.1")
+        self.neighbor.set_timers((180, 60))
+
+    def tearDown(self):
+        bgp.send_command = self.orig_send_command
+        bgp.clock = self.orig_clock
+
+    def test_waits_one_keepalive(self):
+        self.output = neighbor_up_read_3_min
+        bgp.clock.advance(59.5)
+        self.assertEqual(bgp.neighbor_received_message(self.neighbor), None)
+
+    def test_across_midnight(self):
+        # 86399 + 60 crosses midnight on a wall clock
+        bgp.clock.advance(60)
+        self.assertTrue(bgp.neighbor_received_message(self.neighbor))
+
+        self.output = neighbor_up_read_3_min
+        bgp.clock.advance(60)
+        self.assertFalse(bgp.neighbor_received_message(self.neighbor))
+
+    def test_metrics(self):
+        count = bgp.metrics.get("bgp_monitor_detection_latency_seconds")
+        count = count[-1] if count else 0
+
+        self.output = neighbor_up_read_3_min
+        bgp.clock.advance(60)
+        self.assertFalse(bgp.neighbor_received_message(self.neighbor))
+
+        self.assertEqual(bgp.metrics.get("bgp_monitor_last_read_seconds", peer="192.168.1.1"), 235)
+        self.assertEqual(bgp.metrics.get("bgp_monitor_keepalive_seconds", peer="192.168.1.1"), 60)
+        self.assertEqual(bgp.metrics.get("bgp_monitor_detection_latency_seconds")[-1], count + 1)
+
+    def test_command_template(self):
+        self.assertEqual(bgp.command_template("show ip bgp neighbor 10.1.1.1 json"), "show ip bgp neighbor <ip> json")
+        self.assertEqual(bgp.command_template("debug bgp updates in 2001:db8::1"), "debug bgp updates in <ip>")
+        self.assertEqual(bgp.command_template("show ip bgp summary"), "show ip bgp summary")
+
+
+class TestCheckNeighbor(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = dict((name, getattr(bgp, name)) for name in
+                          ["clock", "bgp_neighbor_up", "neighbor_received_message", "start_troubleshooting",
+                           "stop_troubleshooting", "hysteresis", "last_heard", "tcp_table", "prober"])
+        self.received = True
+        self.calls = []
+        bgp.clock = deadline_scheduler.VirtualClock(0)
+        bgp.bgp_neighbor_up = lambda ip: True
+        bgp.neighbor_received_message = lambda neighbor: self.received
+        bgp.start_troubleshooting = lambda neighbor: self.calls.append("start")
+        bgp.stop_troubleshooting = lambda neighbor: self.calls.append("stop")
+
+        self.neighbor = bgp.Neighbor("192.168.1.1", bgp_parser.NeighborState("192.168.1.1", "Established",
+                                                                             None, 180, 60))
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(bgp, name, value)
+
+    def check(self, results):
+        for received in results:
+            self.received = received
+            bgp.clock.advance(15)
+            bgp.check_neighbor(self.neighbor)
+
+    def test_every_check(self):
+        bgp.hysteresis = None
+        self.check([False, True, False])
+        self.assertEqual(self.calls, ["start", "stop", "start"])
+
+    def test_hysteresis(self):
+        bgp.hysteresis = bgp.incident_hysteresis.Hysteresis(1, 2, 30, 30, bgp.clock)
+        extended = bgp.metrics.get("bgp_monitor_troubleshooting_extended_total") or 0
+
+        self.check([False, True, False, True, True, True, False, True, True, True, True])
+
+        self.assertEqual(self.calls, ["start", "stop"])
+        self.assertEqual(bgp.metrics.get("bgp_monitor_troubleshooting_extended_total"), extended + 1)
+
+    def test_early_check_is_not_healthy(self):
+        bgp.neighbor_received_message = self.saved["neighbor_received_message"]
+        bgp.last_heard = lambda neighbor: (datetime.timedelta(seconds=self.silence), False)
+        bgp.tcp_table = bgp.prober = None
+        bgp.hysteresis = bgp.incident_hysteresis.Hysteresis(1, 2, 0, 0, bgp.clock)
+        state = self.neighbor.incident_state
+
+        self.silence = 100
+        bgp.clock.advance(60)
+        bgp.check_neighbor(self.neighbor)
+        self.silence = 10
+        bgp.clock.advance(60)
+        bgp.check_neighbor(self.neighbor)
+        self.assertEqual((state.state, state.healthy), (bgp.incident_hysteresis.ACTIVE, 1))
+
+        # ex. check_now() or a retry before the poll interval is up
+        for _ in range(3):
+            bgp.clock.advance(5)
+            bgp.check_neighbor(self.neighbor)
+
+        self.assertEqual((state.state, state.healthy), (bgp.incident_hysteresis.ACTIVE, 1))
+        self.assertEqual(self.calls, ["start"])
+
+        bgp.clock.advance(45)
+        bgp.check_neighbor(self.neighbor)
+        self.assertEqual(self.calls, ["start", "stop"])
+
+
+class TestAdaptivePolling(unittest.TestCase):
+
+    def setUp(self):
+        self.orig_send_command = bgp.send_command
+        self.orig_clock = bgp.clock
+        self.orig_poll_policy = bgp.poll_policy
+        self.output = bgp_neighbor_output
+        bgp.send_command = lambda command: self.output
+        bgp.clock = deadline_scheduler.VirtualClock(0)
+        bgp.poll_policy = bgp.AdaptivePolling()
+
+        self.neighbor = bgp.Neighbor("192.168.1.1")
+        self.neighbor.set_timers((180, 60))
+
+    def tearDown(self):
+        bgp.send_command = self.orig_send_command
+        bgp.clock = self.orig_clock
+        bgp.poll_policy = self.orig_poll_policy
+
+    def poll(self):
+        bgp.clock.advance(self.neighbor.poll_interval)
+        return bgp.neighbor_received_message(self.neighbor)
+
+    def test_steady_peer_backs_off_within_hold(self):
+        intervals = []
+
+        for check in range(6):
+            self.assertTrue(self.poll())
+            intervals.append(self.neighbor.poll_interval)
+
+        self.assertEqual(intervals[:2], [90, 102])
+        self.assertEqual(max(intervals), 0.9 * 180 - 60)
+
+    def test_growing_age_polls_fast(self):
+        self.poll()
+        self.poll()
+
+        # Last read 00:01:05, past a keepalive but not yet 1.25 keepalives
+        self.output = bgp_neighbor_output.replace("Last read 00:00:55", "Last read 00:01:05")
+        self.assertTrue(self.poll())
+        self.assertEqual(self.neighbor.poll_interval, 15)
+
+        self.output = neighbor_up_read_3_min
+        self.assertFalse(self.poll())
+
+    def test_fast_timers(self):
+        self.neighbor.set_timers((3, 1))
+        policy = bgp.poll_policy
+
+        self.assertEqual(policy.max_interval(self.neighbor), 0.9 * 3 - 1)
+        self.assertEqual(policy.fast_interval(self.neighbor), 0.5)
+
+
+class TestTcpWarning(unittest.TestCase):
+
+    def setUp(self):
+        self.orig_tcp_table = bgp.tcp_table
+        self.orig_send_command = bgp.send_command
+        self.orig_clock = bgp.clock
+        self.orig_check_neighbor = bgp.check_neighbor
+        self.sessions = {}
+        self.polls = []
+
+        class FakeTable(object):
+            max_age = 1
+
+            def get(table, ip):
+                return self.sessions.get(ip)
+
+        def fake_send_command(command):
+            self.polls.append(command)
+            return bgp_neighbor_output
+
+        bgp.tcp_table = FakeTable()
+        bgp.send_command = fake_send_command
+        bgp.clock = deadline_scheduler.VirtualClock(0)
+        self.neighbor = bgp.Neighbor("192.168.1.1")
+        self.neighbor.set_timers((180, 60))
+
+    def tearDown(self):
+        bgp.tcp_table = self.orig_tcp_table
+        bgp.send_command = self.orig_send_command
+        bgp.clock = self.orig_clock
+        bgp.check_neighbor = self.orig_check_neighbor
+
+    def session(self, **fields):
+        values = dict(local="192.168.1.2", local_port=179, peer="192.168.1.1", peer_port=55771, state="ESTABLISHED",
+                      last_data_recv=1.0, last_data_sent=1.0, retransmits=0, total_retrans=0, rtt=1.0, rttvar=0.5,
+                      recv_queue=0, send_queue=0, probes=0, backoff=0)
+        values.update(fields)
+        return sock_diag.TcpSession(**values)
+
+    def test_healthy_waits_for_interval(self):
+        self.sessions["192.168.1.1"] = self.session()
+        self.assertEqual(bgp.tcp_warning(self.neighbor), None)
+
+        bgp.clock.advance(10)
+        del self.polls[:]
+        self.assertEqual(bgp.neighbor_received_message(self.neighbor), None)
+        self.assertEqual(self.polls, [])
+
+    def test_warning_checks_early(self):
+        self.sessions["192.168.1.1"] = self.session(retransmits=3)
+        self.assertEqual(bgp.tcp_warning(self.neighbor), "retransmitting (3)")
+
+        bgp.clock.advance(10)
+        del self.polls[:]
+        bgp.neighbor_received_message(self.neighbor)
+        self.assertEqual(self.polls, ["show ip bgp neighbor 192.168.1.1"])
+
+    def test_warnings(self):
+        self.assertEqual(bgp.tcp_warning(self.neighbor), "no established TCP session")
+
+        self.sessions["192.168.1.1"] = self.session(last_data_recv=61.5)
+        self.assertEqual(bgp.tcp_warning(self.neighbor), "no data received for 61.500s")
+
+        self.sessions["192.168.1.1"] = self.session(probes=2)
+        self.assertEqual(bgp.tcp_warning(self.neighbor), "2 unanswered zero window probes")
+
+    def test_monitor_checks_on_new_warning(self):
+        checks = []
+        bgp.check_neighbor = lambda neighbor: checks.append(bgp.clock()) or True
+        self.sessions["192.168.1.1"] = self.session()
+        monitor = bgp.NeighborMonitor([self.neighbor], 1)
+
+        bgp.clock.advance(1)
+        self.assertEqual(monitor.run_pending(), 1)
+        self.assertEqual(checks, [])
+
+        # the check moves from 60s to the next TCP state check
+        self.sessions["192.168.1.1"] = self.session(retransmits=3)
+        bgp.clock.advance(1)
+        monitor.run_pending()
+        monitor.run_pending()
+        self.assertEqual(checks, [2])
+
+        # still retransmitting, not a new warning
+        bgp.clock.advance(1)
+        monitor.run_pending()
+        monitor.run_pending()
+        self.assertEqual(checks, [2])
+        monitor.pool.terminate()
+
+
+class TestProbeWarning(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = dict((name, getattr(bgp, name)) for name in ["prober", "send_command", "clock", "check_neighbor",
+                                                             "tcp_warning"])
+        self.warnings = {}
+
+        class FakeProber(object):
+            def warning(prober, ip):
+                return self.warnings.get(ip)
+
+        bgp.prober = FakeProber()
+        bgp.send_command = lambda command: bgp_neighbor_output
+        bgp.clock = deadline_scheduler.VirtualClock(0)
+        self.neighbor = bgp.Neighbor("192.168.1.1")
+        self.neighbor.set_timers((180, 60))
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(bgp, name, value)
+
+    def test_healthy_probes(self):
+        bgp.clock.advance(60)
+        self.assertTrue(bgp.neighbor_received_message(self.neighbor))
+        self.assertEqual(self.neighbor.warning, None)
+
+    def test_burst_alone_is_not_a_miss(self):
+        bgp.clock.advance(5)
+        self.warnings["192.168.1.1"] = "lost 3 of the last 10 probes"
+
+        # checked before its poll interval, but the last read is fresh and TCP looks fine
+        self.assertTrue(bgp.neighbor_received_message(self.neighbor))
+        self.assertEqual(self.neighbor.last_run, 5)
+        self.assertEqual(self.neighbor.warning, "probe lost 3 of the last 10 probes")
+
+    def test_burst_triggers_before_keepalives_are_missed(self):
+        bgp.clock.advance(5)
+        self.warnings["192.168.1.1"] = "lost 3 of the last 10 probes"
+        bgp.tcp_warning = lambda neighbor: "3 retransmits"
+
+        # troubleshot with a fresh last read once TCP agrees
+        self.assertFalse(bgp.neighbor_received_message(self.neighbor))
+        self.assertEqual(self.neighbor.warning, "TCP 3 retransmits, probe lost 3 of the last 10 probes")
+        self.assertEqual(bgp.trigger_reason(self.neighbor), "no message for %.1fs, TCP 3 retransmits, probe lost 3 "
+                         "of the last 10 probes" % self.neighbor.silence)
+
+    def test_check_now(self):
+        checks = []
+        bgp.check_neighbor = lambda neighbor: checks.append(bgp.clock()) or True
+        monitor = bgp.NeighborMonitor([self.neighbor], 1)
+
+        bgp.clock.advance(5)
+        self.assertEqual(monitor.run_pending(), 0)
+        monitor.check_now("192.168.1.1")
+        monitor.check_now("10.9.9.9")
+        self.assertEqual(monitor.run_pending(), 1)
+        self.assertEqual(checks, [5])
+        self.assertEqual(monitor.ips(), set(["192.168.1.1"]))
+        monitor.pool.terminate()
+
+
+class TestSniffer(unittest.TestCase):
+
+    def setUp(self):
+        self.orig_sniffer = bgp.sniffer
+        self.orig_send_command = bgp.send_command
+        self.orig_clock = bgp.clock
+        self.ages = {}
+        self.polls = []
+
+        class FakeSniffer(object):
+            def age(sniffer, ip):
+                return self.ages.get(ip)
+
+        def fake_send_command(command):
+            self.polls.append(command)
+            return self.output
+
+        self.output = bgp_neighbor_output
+        bgp.sniffer = FakeSniffer()
+        bgp.send_command = fake_send_command
+        bgp.clock = deadline_scheduler.VirtualClock(0)
+        self.neighbor = bgp.Neighbor("192.168.1.1")
+        self.neighbor.set_timers((3, 1))
+        del self.polls[:]
+
+    def tearDown(self):
+        bgp.sniffer = self.orig_sniffer
+        bgp.send_command = self.orig_send_command
+        bgp.clock = self.orig_clock
+
+    def test_checks_when_overdue(self):
+        self.ages["192.168.1.1"] = 0.3
+        bgp.clock.advance(1)
+        self.assertTrue(bgp.neighbor_received_message(self.neighbor))
+        self.assertEqual(self.polls, [])
+        self.assertAlmostEqual(self.neighbor.poll_interval, 1.25 - 0.3 + bgp.sniff_margin)
+
+        # overdue, and vtysh agrees (Last read 00:00:55)
+        self.ages["192.168.1.1"] = 1.25 + bgp.sniff_margin
+        bgp.clock.advance(self.neighbor.poll_interval)
+        self.assertFalse(bgp.neighbor_received_message(self.neighbor))
+        self.assertEqual(self.polls, ["show ip bgp neighbor 192.168.1.1"])
+        self.assertEqual(self.neighbor.poll_interval, 1)
+
+    def test_stale_sniffer(self):
+        # the sniffer lost the peer 10 minutes ago, vtysh heard it a second ago
+        self.output = bgp_neighbor_output.replace("Last read 00:00:55", "Last read 00:00:01")
+        self.ages["192.168.1.1"] = 600.0
+        bgp.clock.advance(1)
+        self.assertTrue(bgp.neighbor_received_message(self.neighbor))
+        self.assertEqual(self.neighbor.silence, 1.0)
+        self.assertEqual(self.polls, ["show ip bgp neighbor 192.168.1.1"])
+
+    def test_unheard_peer_uses_vtysh(self):
+        # Last read 00:00:55
+        self.neighbor.set_timers((180, 60))
+        bgp.clock.advance(60)
+        self.assertTrue(bgp.neighbor_received_message(self.neighbor))
+        self.assertEqual(self.polls, ["show ip bgp neighbor 192.168.1.1"])
+        self.assertEqual(self.neighbor.poll_interval, 60)
+
+
+class TestInterfaceScope(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = dict((name, getattr(bgp, name)) for name in
+                          ["send_command", "captures", "collector", "flight_recorder", "artifacts", "routes",
+                           "incidents", "history"])
+        self.subscriptions = []
+        self.collections = []
+        self.clock = deadline_scheduler.VirtualClock(0)
+        test = self
+
+        class FakeSubscription(object):
+            def __init__(subscription, ip, interface):
+                subscription.ips = [ip]
+                subscription.interface = interface
+                subscription.terminated = False
+
+            def add_peer(subscription, ip):
+                subscription.ips.append(ip)
+
+            def terminate(subscription):
+                subscription.terminated = True
+
+        class FakeCaptures(object):
+            def subscribe(captures, ip, path, **kwargs):
+                test.subscriptions.append(FakeSubscription(ip, kwargs["interface"]))
+                return test.subscriptions[-1]
+
+        class FakeCollection(object):
+            def __init__(collection, command_list):
+                collection.command_list = command_list
+                collection.cancelled = False
+
+            def cancel(collection):
+                collection.cancelled = True
+
+        class FakeCollector(object):
+            def collect(collector, log_file, command_list, **kwargs):
+                test.collections.append(FakeCollection(command_list))
+                return test.collections[-1]
+
+        class FakeRoutes(object):
+            def get(routes, ip):
+                return {"10.1.1.1": route_lookup.Route("10.1.1.1", "swp3", None, "10.1.1.2"),
+                        "10.1.1.5": route_lookup.Route("10.1.1.5", "swp3", None, "10.1.1.2"),
+                        "10.2.2.2": route_lookup.Route("10.2.2.2", "swp4", None, "10.2.2.1"),
+                        "10.8.8.8": route_lookup.Route("10.8.8.8", "swp5", "10.2.2.1", "10.2.2.2", True)}.get(ip)
+
+        bgp.send_command = lambda command: ""
+        bgp.captures = FakeCaptures()
+        bgp.collector = FakeCollector()
+        bgp.flight_recorder = None
+        bgp.artifacts = None
+        bgp.routes = FakeRoutes()
+        bgp.incidents = incident_groups.IncidentGroups(30, self.clock)
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(bgp, name, value)
+
+    def neighbor(self, ip, remote_as=None):
+        return bgp.Neighbor(ip, bgp_parser.NeighborState(ip, "Established", None, 180, 60, remote_as))
+
+    def troubleshoot(self, ip):
+        neighbor = self.neighbor(ip)
+        bgp.start_troubleshooting(neighbor)
+        bgp.stop_troubleshooting(neighbor)
+        return neighbor
+
+    def test_known_route(self):
+        self.assertEqual(self.troubleshoot("10.1.1.1").route.interface, "swp3")
+        self.assertEqual([subscription.interface for subscription in self.subscriptions], ["swp3"])
+        self.assertEqual(self.collections[0].command_list[0].__name__, "system_snapshot")
+        self.assertEqual(self.collections[0].command_list[2], "ping -c 5 -I swp3 10.1.1.1")
+        self.assertTrue(self.subscriptions[0].terminated)
+
+    def test_unknown_route(self):
+        self.assertEqual(self.troubleshoot("10.9.9.9").route, None)
+        self.assertEqual([subscription.interface for subscription in self.subscriptions], ["any"])
+        self.assertEqual(self.collections[0].command_list[2], "ping -c 5 10.9.9.9")
+
+    def test_ecmp_route(self):
+        # the kernel's path for our query may not be the session's
+        self.assertTrue(self.troubleshoot("10.8.8.8").route.multipath)
+        self.assertEqual([subscription.interface for subscription in self.subscriptions], ["any"])
+        self.assertEqual(self.collections[0].command_list[2], "ping -c 5 10.8.8.8")
+
+    def test_correlated_peers_share_incident(self):
+        leader, same_link, same_as = self.neighbor("10.1.1.1", 65001), self.neighbor("10.1.1.5"), \
+            self.neighbor("10.2.2.2", 65001)
+
+        for neighbor in [leader, same_link, same_as]:
+            bgp.start_troubleshooting(neighbor)
+            self.clock.advance(5)
+
+        # one system snapshot, one capture per interface
+        self.assertEqual(len(self.collections), 1)
+        self.assertEqual([(s.interface, s.ips) for s in self.subscriptions],
+                         [("swp3", ["10.1.1.1", "10.1.1.5"]), ("swp4", ["10.2.2.2"])])
+        self.assertTrue(same_as.group is leader.group)
+
+        # collection continues until the last member recovers
+        bgp.stop_troubleshooting(leader)
+        bgp.stop_troubleshooting(same_link)
+        self.assertFalse(self.collections[0].cancelled)
+        self.assertFalse(self.subscriptions[0].terminated)
+        # members that left hold nothing of the group's collection
+        self.assertEqual([(n.collection, n.get_proc()) for n in [leader, same_link]], [(None, None)] * 2)
+
+        bgp.stop_troubleshooting(same_as)
+        self.assertTrue(self.collections[0].cancelled)
+        self.assertTrue(all(subscription.terminated for subscription in self.subscriptions))
+
+    def test_unrelated_or_late_peers_start_their_own(self):
+        bgp.start_troubleshooting(self.neighbor("10.1.1.1", 65001))
+        bgp.start_troubleshooting(self.neighbor("10.2.2.2", 65002))
+        self.clock.advance(31)
+        bgp.start_troubleshooting(self.neighbor("10.1.1.5", 65001))
+
+        self.assertEqual(len(self.collections), 3)
+
+    def test_history(self):
+        tmp_dir = tempfile.mkdtemp()
+        bgp.history = incident_history.IncidentHistory(os.path.join(tmp_dir, "history.db"))
+
+        try:
+            leader, follower = self.neighbor("10.1.1.1", 65001), self.neighbor("10.1.1.5", 65001)
+            leader.silence = follower.silence = 76.0
+            follower.warning = "TCP retransmitting (3)"
+
+            bgp.start_troubleshooting(leader)
+            bgp.start_troubleshooting(follower)
+            session = leader.session
+            session.observe(120.0)
+            bgp.stop_troubleshooting(leader)
+            bgp.stop_troubleshooting(follower)
+            bgp.history.wait()
+
+            connection = incident_history.connect(bgp.history.path)
+            sessions = dict((peer, incident_history.for_peer(connection, peer)) for peer in ["10.1.1.1", "10.1.1.5"])
+
+            self.assertEqual([row[3:] for row in sessions["10.1.1.1"]], [("no message for 76.0s", 120.0)])
+            self.assertEqual([row[3:] for row in sessions["10.1.1.5"]],
+                             [("no message for 76.0s, TCP retransmitting (3), failing with 10.1.1.1", 76.0)])
+            self.assertTrue(all(row[2] is not None for row in sessions["10.1.1.1"] + sessions["10.1.1.5"]))
+
+            # the leader's capture and log
+            artifacts, stats = incident_history.session_details(connection, session.id)
+            self.assertEqual(len(artifacts), 2)
+        finally:
+            bgp.history.close_database()
+            shutil.rmtree(tmp_dir)
+
+    def test_grouping_off(self):
+        bgp.incidents = None
+        bgp.start_troubleshooting(self.neighbor("10.1.1.1", 65001))
+        bgp.start_troubleshooting(self.neighbor("10.1.1.5", 65001))
+
+        self.assertEqual(len(self.collections), 2)
+
+
+class TestNeighborStateTable(unittest.TestCase):
+
+    def test_state_table_single_poll(self):
+        calls = []
+        orig_send_command = bgp.send_command
+
+        def fake_send_command(command):
+            calls.append(command)
+            return bgp_neighbor_output + bgp_neighbor_hello2_output.replace("192.168.1.1", "192.168.2.2")
+
+        bgp.send_command = fake_send_command
+        bgp.neighbor_table = bgp.NeighborStateTable(max_age=60)
+
+        try:
+            self.assertTrue(bgp.bgp_neighbor_up("192.168.1.1"))
+            self.assertEqual(bgp.get_hold_time("192.168.2.2"), (6, 2))
+            self.assertEqual(bgp.get_last_read("192.168.2.2"), datetime.timedelta(seconds=55))
+            self.assertFalse(bgp.bgp_neighbor_up("10.1.1.1"))
+        finally:
+            bgp.send_command = orig_send_command
+            bgp.neighbor_table = None
+
+        self.assertEqual(calls, ["show ip bgp neighbor"])
+
+    def test_age_follows_shortest_interval(self):
+        calls = []
+        orig_send_command, orig_clock = bgp.send_command, bgp.clock
+        intervals = [60.0, 6.0]
+
+        def fake_send_command(command):
+            calls.append(clock())
+            return bgp_neighbor_output
+
+        clock = bgp.clock = deadline_scheduler.VirtualClock(0)
+        bgp.send_command = fake_send_command
+        table = bgp.NeighborStateTable(intervals=lambda: intervals)
+
+        try:
+            for i in range(10):
+                table.get("192.168.1.1")
+                clock.advance(1)
+
+            # fast timers are held to min_age
+            intervals[1] = 0.5
+            clock.advance(2)
+            table.get("192.168.1.1")
+            clock.advance(1)
+            table.get("192.168.1.1")
+        finally:
+            bgp.send_command, bgp.clock = orig_send_command, orig_clock
+
+        self.assertEqual(calls, [0, 3, 6, 9, 12, 13])
+
+
+class TestNeighborRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.orig_send_command = bgp.send_command
+        bgp.send_command = lambda command: self.calls.append(command) or ""
+
+    def tearDown(self):
+        bgp.send_command = self.orig_send_command
+
+    def test_bulk_load(self):
+        active = bgp_neighbor_hello2_output.replace("192.168.1.1", "192.168.3.3").replace(
+            "BGP state = Established, up for 01w4d15h", "BGP state = Active")
+        output = bgp_neighbor_output + neighbor_up_read_3_min.replace("192.168.1.1", "192.168.2.2") + active
+
+        registry = bgp.NeighborRegistry()
+        self.assertEqual(registry.bulk_load(output), 2)
+
+        self.assertEqual(self.calls, [])
+        self.assertEqual(registry.ips(), set(["192.168.1.1", "192.168.2.2"]))
+        self.assertEqual(registry.get("192.168.2.2").last_read, datetime.timedelta(minutes=3, seconds=55))
+        self.assertEqual(registry.get("192.168.2.2").keepalive, datetime.timedelta(seconds=60))
+        self.assertTrue(registry.get("192.168.1.1").hold_time is registry.get("192.168.2.2").hold_time)
+
+    def test_add_remove(self):
+        registry = bgp.NeighborRegistry()
+        neighbor = registry.add("192.168.1.1")
+
+        self.assertTrue(registry.add("192.168.1.1") is neighbor)
+        self.assertTrue(registry.remove("192.168.1.1") is neighbor)
+        self.assertFalse("192.168.1.1" in registry)
+        self.assertEqual(registry.remove("192.168.1.1"), None)
+
+    def test_slots(self):
+        neighbor = bgp.Neighbor("192.168.1.1")
+        self.assertFalse(hasattr(neighbor, "__dict__"))
+
+
+class TestNeighborMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.orig_send_command = bgp.send_command
+        self.orig_check_neighbor = bgp.check_neighbor
+        bgp.send_command = lambda command: ""
+
+    def tearDown(self):
+        bgp.send_command = self.orig_send_command
+        bgp.check_neighbor = self.orig_check_neighbor
+
+    def build_neighbor(self, ip, keepalive):
+        neighbor = bgp.Neighbor(ip)
+        neighbor.set_timers((keepalive * 3, keepalive))
+        return neighbor
+
+    def test_slow_peer_does_not_block_others(self):
+        checks = []
+
+        def fake_check(neighbor):
+            checks.append(neighbor.ip)
+            if neighbor.ip == "192.168.1.1":
+                time.sleep(0.5)
+                checks.append("slow done")
+                return False
+            # fast peer goes down after its third check
+            return checks.count(neighbor.ip) < 3
+
+        bgp.check_neighbor = fake_check
+        slow = self.build_neighbor("192.168.1.1", 0)
+        fast = self.build_neighbor("192.168.2.2", 0)
+
+        bgp.NeighborMonitor([slow, fast], 2).run()
+
+        self.assertEqual(checks.count("192.168.1.1"), 1)
+        self.assertEqual(checks.count("192.168.2.2"), 3)
+        self.assertEqual(checks[-1], "slow done")
+
+class TestReconcile(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.orig_send_command = bgp.send_command
+        self.orig_stop_troubleshooting = bgp.stop_troubleshooting
+        self.stopped = []
+
+        def fake_send_command(command):
+            self.calls.append(command)
+            return bgp_neighbor_output.replace("192.168.1.1", command.split(" ")[-1])
+
+        bgp.send_command = fake_send_command
+        bgp.stop_troubleshooting = lambda neighbor: self.stopped.append(neighbor.ip)
+
+        registry = bgp.NeighborRegistry()
+        registry.bulk_load(bgp_neighbor_output + bgp_neighbor_output.replace("192.168.1.1", "192.168.2.2"))
+        self.monitor = bgp.NeighborMonitor(registry, 1, reconcile_interval=30)
+        self.unchanged = self.monitor.registry.get("192.168.1.1")
+
+    def tearDown(self):
+        self.monitor.pool.terminate()
+        bgp.send_command = self.orig_send_command
+        bgp.stop_troubleshooting = self.orig_stop_troubleshooting
+
+    def test_add_and_remove(self):
+        deadline = self.monitor.scheduler.deadline("192.168.1.1")
+
+        result = self.monitor.reconcile(["192.168.1.1", "192.168.3.3"])
+
+        self.assertEqual(result, (["192.168.3.3"], ["192.168.2.2"]))
+        self.assertEqual(self.monitor.registry.ips(), set(["192.168.1.1", "192.168.3.3"]))
+        self.assertEqual(self.calls, ["show ip bgp neighbor 192.168.3.3"])
+        self.assertEqual(self.stopped, ["192.168.2.2"])
+        self.assertTrue(self.monitor.registry.get("192.168.1.1") is self.unchanged)
+        self.assertEqual(self.monitor.scheduler.deadline("192.168.1.1"), deadline)
+        self.assertFalse("192.168.2.2" in self.monitor.scheduler)
+        self.assertTrue("192.168.3.3" in self.monitor.scheduler)
+
+    def test_unchanged(self):
+        self.assertEqual(self.monitor.reconcile(["192.168.2.2", "192.168.1.1"]), ([], []))
+        self.assertEqual(self.calls, [])
+
+
 if __name__ == '__main__':
     unittest.main()
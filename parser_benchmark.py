@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+import getopt
+import gc
+import json
+import os
+import sys
+import timeit
+import bgp_neighbor_capture as bgp
+import bgp_parser
+import synthetic_bgp
+
+debug = False
+
+'''
+parser_benchmark times the BGP output parsers against synthetic tables of
+10, 1k and 10k peers (see synthetic_bgp) and compares the results to a saved baseline.
+
+Each benchmark is run timeit style: the number of calls per run is raised
+until a run takes at least min_run_time, then the best of repeat runs is kept,
+so results are repeatable from run to run on an idle machine.
+
+Baselines are per machine. Save one on the hardware you compare against:
+
+    parser_benchmark.py --save
+    parser_benchmark.py                 # exits 1 if anything is tolerance x slower
+    parser_benchmark.py --sizes=10,1000 # skip the 10k tables
+'''
+
+baseline_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parser-benchmark-baseline.json")
+sizes = [10, 1000, 10000]
+repeat = 5
+min_run_time = 0.2  # seconds
+tolerance = 1.5  # slower than baseline by this factor is a regression
+
+
+def build_benchmarks(count):
+    '''
+    Returns list of (name, function) timing each parser against a table of count peers
+    '''
+
+    peers = synthetic_bgp.make_peers(count)
+    summary = synthetic_bgp.summary_text(peers)
+    neighbors = synthetic_bgp.neighbors_text(peers)
+    summary_json = synthetic_bgp.summary_json(peers)
+    neighbors_json = synthetic_bgp.neighbors_json(peers)
+    summary_lines = bgp.parse_bgp_summary(summary)
+
+    # the last peer is the worst case for a per peer lookup
+    ip = peers[-1].ip
+
+    return [("parse_bgp_summary", lambda: bgp.parse_bgp_summary(summary)),
+            ("extract_established_neighbors", lambda: bgp.extract_established_neighbors(summary_lines)),
+            ("get_hold_time", lambda: bgp.get_hold_time(ip, neighbors)),
+            ("get_last_read", lambda: bgp.get_last_read(ip, neighbors)),
+            ("parse_summary_text", lambda: bgp_parser.parse_summary(summary)),
+            ("parse_summary_json", lambda: bgp_parser.parse_summary(summary_json)),
+            ("parse_neighbors_text", lambda: bgp_parser.parse_neighbors(neighbors)),
+            ("parse_neighbors_json", lambda: bgp_parser.parse_neighbors(neighbors_json)),
+            ]
+
+
+def measure(function):
+    '''
+    Returns the best seconds per call of function over repeat runs
+    '''
+
+    timer = timeit.Timer(function)
+    number = 1
+
+    while True:
+        elapsed = timer.timeit(number)
+
+        if elapsed >= min_run_time or number >= 1000000:
+            break
+
+        number *= 10 if elapsed < min_run_time / 10 else 2
+
+    best = elapsed
+
+    # timeit disables gc while timing, collect between runs so garbage doesn't pile up
+    for run in range(repeat - 1):
+        gc.collect()
+        best = min(best, timer.timeit(number))
+
+    return best / number
+
+
+def run(sizes_to_run):
+    '''
+    Runs every benchmark at every size
+
+    Returns dict of "name/size" -> seconds per call
+    '''
+
+    results = {}
+
+    for count in sizes_to_run:
+        for name, function in build_benchmarks(count):
+            key = name + "/" + str(count)
+            results[key] = measure(function)
+
+            if debug:
+                print key + " %.6fs" % results[key]
+
+    return results
+
+
+def compare(results, baseline):
+    '''
+    Returns list of (key, seconds, baseline seconds or None, regressed) sorted by key
+    '''
+
+    rows = []
+
+    for key in sorted(results, key=lambda k: (k.split("/")[0], int(k.split("/")[1]))):
+        base = baseline.get(key)
+        regressed = base is not None and results[key] > base * tolerance
+        rows.append((key, results[key], base, regressed))
+
+    return rows
+
+
+def format_report(rows):
+    lines = ["%-36s %12s %12s %8s" % ("benchmark", "per call", "baseline", "ratio")]
+
+    for key, seconds, base, regressed in rows:
+        if base is None:
+            lines.append("%-36s %10.1fus %12s %8s" % (key, seconds * 1e6, "-", "-"))
+        else:
+            lines.append("%-36s %10.1fus %10.1fus %7.2fx%s" % (key, seconds * 1e6, base * 1e6, seconds / base,
+                                                              "  REGRESSION" if regressed else ""))
+
+    return "\n".join(lines)
+
+
+def main(argv):
+    global debug, baseline_file, tolerance
+
+    options, remainder = getopt.getopt(argv, "", ["debug", "save", "sizes=", "baseline=", "tolerance="])
+    save = False
+    sizes_to_run = sizes
+
+    for opt, arg in options:
+        if opt in "--debug":
+            debug = True
+        if opt in "--save":
+            save = True
+        if opt in "--sizes":
+            sizes_to_run = [int(size) for size in arg.split(",")]
+        if opt in "--baseline":
+            baseline_file = arg
+        if opt in "--tolerance":
+            tolerance = float(arg)
+
+    results = run(sizes_to_run)
+    baseline = {}
+
+    if os.path.exists(baseline_file):
+        baseline = json.load(open(baseline_file))
+
+    rows = compare(results, baseline)
+    print format_report(rows)
+
+    if save:
+        baseline.update(results)
+        output = open(baseline_file, "w")
+        json.dump(baseline, output, indent=1, sort_keys=True)
+        output.close()
+        print "Baseline saved to " + baseline_file
+        return True
+
+    return not any(row[3] for row in rows)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main(sys.argv[1:]) else 1)
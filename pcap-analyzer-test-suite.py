@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+import unittest
+import pcap_analyzer
+import pcap_format
+import tempfile
+import shutil
+import struct
+import os
+
+PEER = "10.12.12.2"
+LOCAL = "10.12.12.1"
+
+
+def bgp_message(message_type, body=""):
+    return "\xff" * 16 + struct.pack("!HB", 19 + len(body), message_type) + body
+
+
+class SyntheticCapture(object):
+
+    '''
+    Writes a capture of PEER sending BGP messages to LOCAL
+    '''
+
+    def __init__(self, path):
+        self.writer = pcap_format.PcapWriter(path, pcap_format.LINKTYPE_ETHERNET)
+        self.seq = 1000
+
+    def send(self, ts, payload, flags=pcap_format.TCP_ACK | pcap_format.TCP_PSH, window=65535, seq=None, dst=LOCAL):
+        if seq is None:
+            seq = self.seq
+            self.seq += len(payload)
+
+        self.writer.write(ts, pcap_format.build_ipv4_tcp(PEER, dst, 179, 40000, payload, flags, seq, 1, window))
+
+    def close(self):
+        self.writer.close()
+
+
+class TestPcapAnalyzer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def capture(self, name):
+        return SyntheticCapture(os.path.join(self.tmp_dir, name))
+
+    def test_keepalive_gap(self):
+        capture = self.capture("gap.pcap")
+        for ts in [0, 1, 2, 3, 7, 8]:
+            capture.send(1000 + ts, bgp_message(4))
+        capture.close()
+
+        timeline = pcap_analyzer.analyze([capture.writer.file.name])[(PEER, LOCAL)]
+
+        self.assertEqual(timeline.messages["KEEPALIVE"], 6)
+        self.assertEqual(max(timeline.keepalive_gaps()), 4)
+        self.assertEqual([(e.ts, e.kind) for e in timeline.events], [(1007, "keepalive gap")])
+
+    def test_split_message_and_retransmission(self):
+        capture = self.capture("split.pcap")
+        update = bgp_message(2, "x" * 100)
+        capture.send(1000, update[:30])
+        capture.send(1000.1, update[:30], seq=1000)
+        capture.send(1000.2, update[30:])
+        capture.close()
+
+        timeline = pcap_analyzer.analyze([capture.writer.file.name])[(PEER, LOCAL)]
+
+        self.assertEqual(timeline.messages["UPDATE"], 1)
+        self.assertEqual(timeline.retransmissions, 1)
+
+    def test_out_of_order(self):
+        capture = self.capture("reorder.pcap")
+        first = bgp_message(4)
+        second = bgp_message(3, "\x04\x00")
+        capture.send(1000, "", flags=pcap_format.TCP_SYN, seq=999)
+        capture.send(1000.1, second, seq=1000 + len(first))
+        capture.send(1000.2, first, seq=1000)
+        capture.close()
+
+        timeline = pcap_analyzer.analyze([capture.writer.file.name])[(PEER, LOCAL)]
+
+        self.assertEqual(timeline.messages["KEEPALIVE"], 1)
+        self.assertEqual([e.kind for e in timeline.events], ["NOTIFICATION"])
+
+    def test_lost_segment(self):
+        capture = self.capture("lost.pcap")
+        update = bgp_message(2, "x" * 100)
+
+        for i in range(5):
+            capture.send(1000 + i, bgp_message(4))
+
+        # tcpdump dropped the first half of an UPDATE
+        capture.seq += 30
+        capture.send(1005, update[30:])
+
+        for i in range(6, 40):
+            capture.send(1000 + i, bgp_message(4))
+
+        capture.close()
+
+        timeline = pcap_analyzer.analyze([capture.writer.file.name])[(PEER, LOCAL)]
+
+        # decoding picks up at the next marker once max_pending_segments are waiting behind the hole
+        self.assertEqual(timeline.messages["KEEPALIVE"], 39)
+        self.assertEqual(timeline.messages["UPDATE"], 0)
+        self.assertEqual(max(timeline.keepalive_times), 1039)
+
+    def test_timeline_per_peer(self):
+        capture = self.capture("two_peers.pcap")
+        keepalive = bgp_message(4)
+
+        # one source IP, a 1s session to LOCAL and a 3s session to another peer
+        for i in range(10):
+            capture.send(1000 + i, keepalive)
+
+            if i % 3 == 0:
+                capture.send(1000 + i, keepalive, seq=5000 + i // 3 * len(keepalive), dst="10.12.13.1")
+
+        capture.close()
+
+        timelines = pcap_analyzer.analyze([capture.writer.file.name])
+
+        self.assertEqual(sorted(timelines), [(PEER, LOCAL), (PEER, "10.12.13.1")])
+        self.assertEqual(timelines[(PEER, LOCAL)].keepalive_gaps(), [1] * 9)
+        self.assertEqual(timelines[(PEER, "10.12.13.1")].keepalive_gaps(), [3] * 3)
+        self.assertEqual(timelines[(PEER, LOCAL)].events, [])
+
+    def test_burst_zero_window_reset(self):
+        capture = self.capture("burst.pcap")
+        for i in range(12):
+            capture.send(1000 + i / 100.0, bgp_message(2, "y"))
+        capture.send(1001, "", flags=pcap_format.TCP_ACK, window=0)
+        capture.send(1002, "", flags=pcap_format.TCP_RST)
+        capture.close()
+
+        timeline = pcap_analyzer.analyze([capture.writer.file.name])[(PEER, LOCAL)]
+
+        self.assertEqual([e.kind for e in timeline.events], ["update burst", "zero window", "TCP reset"])
+        self.assertEqual(timeline.zero_windows, 1)
+        self.assertEqual(timeline.resets, 1)
+
+    def test_many_files(self):
+        paths = []
+        for i in range(4):
+            capture = self.capture("part" + str(i) + ".pcap")
+            capture.send(1000 + i, bgp_message(4))
+            capture.close()
+            paths.append(capture.writer.file.name)
+
+        timeline = pcap_analyzer.analyze(paths, jobs=2)[(PEER, LOCAL)]
+
+        self.assertEqual(timeline.messages["KEEPALIVE"], 4)
+        self.assertEqual(timeline.keepalive_gaps(), [1, 1, 1])
+        self.assertTrue("BGP speaker " + PEER + " to " + LOCAL in
+                        pcap_analyzer.format_report({(PEER, LOCAL): timeline}))
+
+
+if __name__ == '__main__':
+    unittest.main()
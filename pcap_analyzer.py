@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+from collections import namedtuple
+from multiprocessing import Pool
+import datetime
+import getopt
+import mmap
+import os
+import struct
+import sys
+import pcap_format
+
+debug = False
+
+'''
+pcap_analyzer turns the captures written by bgp_neighbor_capture into a per-peer BGP timeline.
+
+Each file is mmap'd and streamed record by record, never read into memory whole.
+TCP port 179 segments are reassembled per direction, BGP messages are decoded
+from the byte stream, and the following are tracked for every BGP speaker, separately
+for each peer it talks to (a box keeps one series per session, even from one source IP):
+
+    keepalive inter-arrival gaps (gaps over 1.25x the usual gap are flagged)
+    UPDATE bursts (burst_size or more UPDATEs within burst_window seconds)
+    TCP retransmissions, zero window advertisements and resets
+    OPEN and NOTIFICATION messages
+
+Many captures are analyzed in parallel, one process per file.
+
+Usage: pcap_analyzer.py [--jobs=N] bgp_auto_capture_*.pcap bgp_flight_*.pcap
+'''
+
+BGP_MARKER = "\xff" * 16
+BGP_HEADER_LEN = 19
+
+BGP_TYPES = {1: "OPEN", 2: "UPDATE", 3: "NOTIFICATION", 4: "KEEPALIVE", 5: "ROUTE-REFRESH"}
+
+burst_window = 1.0
+burst_size = 10
+gap_jitter = 1.25  # same padding bgp_neighbor_capture uses before it worries
+max_pending_segments = 16  # out of order segments parked behind a hole before it is skipped
+
+# A notable moment for a speaker. detail is a short human readable string.
+Event = namedtuple("Event", ["ts", "speaker", "peer", "kind", "detail"])
+
+
+class PeerTimeline(object):
+
+    '''
+    Everything seen from one BGP speaker (the IP sending the messages/segments) towards one peer.
+    '''
+
+    def __init__(self, speaker, peer):
+        self.speaker = speaker
+        self.peer = peer
+        self.events = []
+        self.messages = dict((name, 0) for name in BGP_TYPES.values())
+        self.keepalive_times = []
+        self.update_times = []
+        self.retransmissions = 0
+        self.zero_windows = 0
+        self.resets = 0
+
+    def add_event(self, ts, peer, kind, detail=""):
+        self.events.append(Event(ts, self.speaker, peer, kind, detail))
+
+    def merge(self, other):
+        '''
+        Adds the results of another timeline for the same speaker and peer (ex. from another file)
+        '''
+
+        self.events.extend(other.events)
+        self.keepalive_times.extend(other.keepalive_times)
+        self.update_times.extend(other.update_times)
+        self.retransmissions += other.retransmissions
+        self.zero_windows += other.zero_windows
+        self.resets += other.resets
+
+        for name, count in other.messages.items():
+            self.messages[name] += count
+
+    def keepalive_gaps(self):
+        '''
+        Returns list of seconds between consecutive keepalives
+        '''
+
+        times = sorted(self.keepalive_times)
+
+        return [b - a for a, b in zip(times, times[1:])]
+
+    def finish(self):
+        '''
+        Sorts events and adds the derived keepalive gap and update burst events.
+        Call once after every file has been merged.
+        '''
+
+        times = sorted(self.keepalive_times)
+        gaps = self.keepalive_gaps()
+
+        if gaps:
+            usual = sorted(gaps)[len(gaps) // 2]
+
+            for ts, gap in zip(times[1:], gaps):
+                if gap > usual * gap_jitter:
+                    self.add_event(ts, None, "keepalive gap", "%.3fs (usual %.3fs)" % (gap, usual))
+
+        updates = sorted(self.update_times)
+        start = 0
+        burst_start = None
+
+        for end in range(len(updates)):
+            while updates[end] - updates[start] > burst_window:
+                start += 1
+
+            count = end - start + 1
+
+            if count >= burst_size and (burst_start is None or updates[start] > burst_start + burst_window):
+                burst_start = updates[start]
+                self.add_event(burst_start, None, "update burst", "%d+ UPDATEs within %.1fs" % (count, burst_window))
+
+        self.events.sort()
+
+
+class TcpStream(object):
+
+    '''
+    Reassembles one direction of a TCP connection and decodes BGP messages from it.
+    '''
+
+    def __init__(self):
+        self.next_seq = None
+        self.pending = {}
+        self.buffer = ""
+
+    def add_segment(self, seq, flags, payload):
+        '''
+        Adds a segment.
+
+        Returns (retransmitted, list of BGP message types completed by this segment)
+        '''
+
+        if flags & pcap_format.TCP_SYN:
+            self.next_seq = (seq + 1) & 0xffffffff
+            self.pending = {}
+            self.buffer = ""
+            return False, []
+
+        if not payload:
+            return False, []
+
+        if self.next_seq is None:
+            self.next_seq = seq
+
+        offset = (seq - self.next_seq) & 0xffffffff
+
+        if offset >= 0x80000000:
+            # Starts before what we already have. Keep any new bytes past next_seq.
+            already_seen = 0x100000000 - offset
+
+            if already_seen >= len(payload):
+                return True, []
+
+            payload = payload[already_seen:]
+            seq = self.next_seq
+            offset = 0
+
+        if offset > 0:
+            if seq in self.pending:
+                return True, []
+
+            self.pending[seq] = payload
+
+            if len(self.pending) < max_pending_segments:
+                return False, []
+
+            # The missing segment was never captured (ex. dropped by tcpdump, or a truncated payload).
+            # Skip the hole and let _read_messages() find the next marker.
+            self.next_seq = min(self.pending, key=lambda pending_seq: (pending_seq - self.next_seq) & 0xffffffff)
+            self.buffer = ""
+        else:
+            self._append(payload)
+
+        # Drain anything that was waiting for this segment
+        while self.next_seq in self.pending:
+            self._append(self.pending.pop(self.next_seq))
+
+        return False, self._read_messages()
+
+    def _append(self, payload):
+        self.buffer += payload
+        self.next_seq = (self.next_seq + len(payload)) & 0xffffffff
+
+    def _read_messages(self):
+        '''
+        Pulls complete BGP messages off the buffer, resynchronizing on the marker if needed.
+        '''
+
+        messages = []
+        offset = 0
+        buf = self.buffer
+
+        while len(buf) - offset >= BGP_HEADER_LEN:
+            if buf[offset:offset + 16] != BGP_MARKER:
+                marker = buf.find(BGP_MARKER, offset + 1)
+
+                if marker == -1:
+                    offset = max(len(buf) - 15, offset)
+                    break
+
+                offset = marker
+                continue
+
+            length = struct.unpack_from("!H", buf, offset + 16)[0]
+
+            if length < BGP_HEADER_LEN:
+                offset += 1
+                continue
+
+            if len(buf) - offset < length:
+                break
+
+            messages.append(BGP_TYPES.get(ord(buf[offset + 18]), "TYPE " + str(ord(buf[offset + 18]))))
+            offset += length
+
+        self.buffer = buf[offset:]
+
+        return messages
+
+
+def analyze_file(path):
+    '''
+    Streams a single pcap file through mmap and builds the timelines of every BGP speaker in it.
+
+    Keyword Args:
+    path - pcap file
+
+    Returns dict of (speaker IP, peer IP) -> PeerTimeline (not yet finished)
+    '''
+
+    timelines = {}
+    streams = {}
+
+    if os.path.getsize(path) == 0:
+        return timelines
+
+    capture_file = open(path, "rb")
+    mapped = mmap.mmap(capture_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        reader = pcap_format.PcapReader(mapped)
+
+        for ts, header, data in reader:
+            info = pcap_format.decode_packet(reader.linktype, data)
+
+            if info is None or info.sport is None:
+                continue
+
+            if info.sport != pcap_format.BGP_PORT and info.dport != pcap_format.BGP_PORT:
+                continue
+
+            timeline = timelines.get((info.src, info.dst))
+
+            if timeline is None:
+                timeline = PeerTimeline(info.src, info.dst)
+                timelines[(info.src, info.dst)] = timeline
+
+            if info.flags & pcap_format.TCP_RST:
+                timeline.resets += 1
+                timeline.add_event(ts, info.dst, "TCP reset")
+                continue
+
+            if info.window == 0:
+                timeline.zero_windows += 1
+                timeline.add_event(ts, info.dst, "zero window")
+
+            key = (info.src, info.sport, info.dst, info.dport)
+            stream = streams.get(key)
+
+            if stream is None:
+                stream = TcpStream()
+                streams[key] = stream
+
+            retransmitted, messages = stream.add_segment(info.seq, info.flags, str(info.payload))
+
+            if retransmitted:
+                timeline.retransmissions += 1
+                timeline.add_event(ts, info.dst, "retransmission", "seq " + str(info.seq))
+
+            for message in messages:
+                timeline.messages[message] = timeline.messages.get(message, 0) + 1
+
+                if message == "KEEPALIVE":
+                    timeline.keepalive_times.append(ts)
+                elif message == "UPDATE":
+                    timeline.update_times.append(ts)
+                else:
+                    timeline.add_event(ts, info.dst, message)
+
+    finally:
+        mapped.close()
+        capture_file.close()
+
+    return timelines
+
+
+def analyze(paths, jobs=None):
+    '''
+    Analyzes many pcap files in parallel and merges the timelines per speaker and peer.
+
+    Keyword Args:
+    paths - list of pcap files
+    jobs - number of worker processes. Defaults to the number of CPUs
+
+    Returns dict of (speaker IP, peer IP) -> finished PeerTimeline
+    '''
+
+    if len(paths) > 1 and jobs != 1:
+        pool = Pool(jobs)
+        try:
+            results = pool.map(analyze_file, paths)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [analyze_file(path) for path in paths]
+
+    merged = {}
+
+    for timelines in results:
+        for key, timeline in timelines.items():
+            if key in merged:
+                merged[key].merge(timeline)
+            else:
+                merged[key] = timeline
+
+    for timeline in merged.values():
+        timeline.finish()
+
+    return merged
+
+
+def format_report(timelines):
+    '''
+    Returns a text report of every speaker's statistics and timeline, per peer
+    '''
+
+    lines = []
+
+    for key in sorted(timelines):
+        timeline = timelines[key]
+        gaps = timeline.keepalive_gaps()
+
+        lines.append("BGP speaker " + timeline.speaker + " to " + timeline.peer)
+        lines.append("  messages: " + ", ".join(name + " " + str(timeline.messages[name])
+                                                 for name in sorted(timeline.messages) if timeline.messages[name]))
+
+        if gaps:
+            lines.append("  keepalive gap: avg %.3fs max %.3fs" % (sum(gaps) / len(gaps), max(gaps)))
+
+        lines.append("  retransmissions %d, zero window %d, resets %d" %
+                     (timeline.retransmissions, timeline.zero_windows, timeline.resets))
+
+        for event in timeline.events:
+            when = datetime.datetime.fromtimestamp(event.ts).strftime("%H:%M:%S.%f")[:-3]
+            peer = " -> " + event.peer if event.peer else ""
+            detail = " " + event.detail if event.detail else ""
+            lines.append("    " + when + " " + event.kind + peer + detail)
+
+        lines.append("")
+
+    return "\n".join(lines)
+
+
+def main(argv):
+    global debug
+
+    options, remainder = getopt.getopt(argv, "", ["debug", "jobs="])
+    jobs = None
+
+    for opt, arg in options:
+        if opt in "--debug":
+            debug = True
+        if opt in "--jobs":
+            jobs = int(arg)
+
+    if not remainder:
+        print "Usage: pcap_analyzer.py [--jobs=N] capture.pcap [capture.pcap ...]"
+        return False
+
+    print format_report(analyze(remainder, jobs))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
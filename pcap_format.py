@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+from collections import namedtuple
+import socket
+import struct
+
+'''
+pcap_format reads and writes classic libpcap files and decodes just enough
+of each packet (IP addresses, TCP ports and header fields) to sort BGP traffic by peer.
+
+Records are passed around as the raw bytes read from the file, so they can be
+written back out to another pcap without being rebuilt.
+'''
+
+PCAP_MAGIC = 0xa1b2c3d4
+PCAP_MAGIC_SWAPPED = 0xd4c3b2a1
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113  # tcpdump -i any
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+ETHERTYPE_VLAN = (0x8100, 0x88a8)
+
+IPPROTO_TCP = 6
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_PSH = 0x08
+TCP_ACK = 0x10
+
+BGP_PORT = 179
+
+global_header = struct.Struct("=IHHiIII")
+record_header = struct.Struct("=IIII")
+
+# Decoded IP/TCP fields of a packet. Ports and TCP fields are None for non TCP packets.
+# payload is a buffer() of the TCP payload, so decoding doesn't copy packet data.
+PacketInfo = namedtuple("PacketInfo", ["src", "dst", "protocol", "sport", "dport",
+                                       "seq", "ack", "flags", "window", "payload"])
+
+
+def pack_global_header(linktype, snaplen=65535):
+    '''
+    Returns the 24 byte pcap file header
+    '''
+
+    return global_header.pack(PCAP_MAGIC, 2, 4, 0, 0, snaplen, linktype)
+
+
+def pack_record(ts, data, orig_len=None):
+    '''
+    Returns a pcap record (header + data) for a packet
+
+    Keyword Args:
+    ts - float epoch timestamp
+    data - packet bytes
+    orig_len - length of the packet on the wire. Defaults to len(data)
+    '''
+
+    if orig_len is None:
+        orig_len = len(data)
+
+    sec = int(ts)
+    usec = int(round((ts - sec) * 1000000))
+
+    return record_header.pack(sec, usec, len(data), orig_len) + data
+
+
+class PcapReader(object):
+
+    '''
+    Iterates over the records of a pcap stream (file, pipe or mmap).
+
+    Each item is (timestamp, header, data) where header is the raw 16 byte
+    record header and data the raw captured bytes.
+    '''
+
+    def __init__(self, stream):
+        '''
+        stream = anything with read(n). ex. open(file, "rb"), Popen.stdout or an mmap
+        '''
+
+        self.stream = stream
+        header = read_exactly(stream, global_header.size)
+
+        if header is None:
+            raise ValueError("empty pcap stream")
+
+        magic = struct.unpack("=I", header[:4])[0]
+
+        if magic == PCAP_MAGIC:
+            self.byte_order = "="
+        elif magic == PCAP_MAGIC_SWAPPED:
+            self.byte_order = ">" if struct.pack("=I", 1) == struct.pack("<I", 1) else "<"
+        else:
+            raise ValueError("not a pcap stream, magic " + hex(magic))
+
+        fields = struct.unpack(self.byte_order + "IHHiIII", header)
+        self.snaplen = fields[5]
+        self.linktype = fields[6]
+        self.record = struct.Struct(self.byte_order + "IIII")
+
+    def __iter__(self):
+        while True:
+            header = read_exactly(self.stream, self.record.size)
+
+            if header is None:
+                return
+
+            sec, usec, caplen, orig_len = self.record.unpack(header)
+            data = read_exactly(self.stream, caplen)
+
+            if data is None:
+                return
+
+            yield sec + usec / 1000000.0, header, data
+
+
+class PcapWriter(object):
+
+    '''
+    Writes pcap records to a file, writing the file header first.
+    '''
+
+    def __init__(self, path, linktype, snaplen=65535):
+        self.file = open(path, "wb")
+        self.file.write(pack_global_header(linktype, snaplen))
+        self.packets = 0
+        self.bytes = global_header.size
+
+    def write_raw(self, header, data):
+        '''
+        Writes a record exactly as read by PcapReader
+        '''
+
+        self.file.write(header)
+        self.file.write(data)
+        self.packets += 1
+        self.bytes += len(header) + len(data)
+
+    def write(self, ts, data):
+        '''
+        Writes a packet with the given float timestamp
+        '''
+
+        record = pack_record(ts, data)
+        self.file.write(record)
+        self.packets += 1
+        self.bytes += len(record)
+
+    def close(self):
+        self.file.close()
+
+
+def read_exactly(stream, size):
+    '''
+    Reads size bytes, retrying short reads from pipes.
+
+    Returns the bytes, or None at end of stream.
+    '''
+
+    data = stream.read(size)
+
+    if len(data) == size or len(data) == 0:
+        return data or None
+
+    chunks = [data]
+    remaining = size - len(data)
+
+    while remaining > 0:
+        chunk = stream.read(remaining)
+
+        if not chunk:
+            return None
+
+        chunks.append(chunk)
+        remaining -= len(chunk)
+
+    return "".join(chunks)
+
+
+def decode_packet(linktype, data):
+    '''
+    Decodes the IP and TCP headers of a captured packet
+
+    Keyword Args:
+    linktype - the pcap link type of the capture
+    data - captured packet bytes
+
+    Returns PacketInfo, or None if the packet isn't IP
+    '''
+
+    if linktype == LINKTYPE_LINUX_SLL:
+        if len(data) < 16:
+            return None
+        ethertype = struct.unpack_from("!H", data, 14)[0]
+        offset = 16
+
+    elif linktype == LINKTYPE_ETHERNET:
+        if len(data) < 14:
+            return None
+        ethertype = struct.unpack_from("!H", data, 12)[0]
+        offset = 14
+
+        while ethertype in ETHERTYPE_VLAN and len(data) >= offset + 4:
+            ethertype = struct.unpack_from("!H", data, offset + 2)[0]
+            offset += 4
+
+    elif linktype == LINKTYPE_RAW:
+        if len(data) < 1:
+            return None
+        ethertype = ETHERTYPE_IPV4 if ord(data[0]) >> 4 == 4 else ETHERTYPE_IPV6
+        offset = 0
+
+    else:
+        return None
+
+    if ethertype == ETHERTYPE_IPV4 and len(data) >= offset + 20:
+        header_len = (ord(data[offset]) & 0x0f) * 4
+        total_len = struct.unpack_from("!H", data, offset + 2)[0]
+        protocol = ord(data[offset + 9])
+        src = socket.inet_ntoa(data[offset + 12:offset + 16])
+        dst = socket.inet_ntoa(data[offset + 16:offset + 20])
+        end = min(offset + total_len, len(data))
+        offset += header_len
+
+    elif ethertype == ETHERTYPE_IPV6 and len(data) >= offset + 40:
+        payload_len = struct.unpack_from("!H", data, offset + 4)[0]
+        protocol = ord(data[offset + 6])
+        src = socket.inet_ntop(socket.AF_INET6, data[offset + 8:offset + 24])
+        dst = socket.inet_ntop(socket.AF_INET6, data[offset + 24:offset + 40])
+        offset += 40
+        end = min(offset + payload_len, len(data))
+
+    else:
+        return None
+
+    if protocol != IPPROTO_TCP or len(data) < offset + 20:
+        return PacketInfo(src, dst, protocol, None, None, None, None, None, None, None)
+
+    sport, dport, seq, ack, data_offset, flags, window = struct.unpack_from("!HHIIBBH", data, offset)
+    payload_start = offset + (data_offset >> 4) * 4
+
+    return PacketInfo(src, dst, protocol, sport, dport, seq, ack, flags, window,
+                      buffer(data, payload_start, max(end - payload_start, 0)))
+
+
+def build_ipv4_tcp(src, dst, sport, dport, payload="", flags=TCP_ACK | TCP_PSH, seq=0, ack=0, window=65535):
+    '''
+    Builds an Ethernet/IPv4/TCP frame. Checksums are left at zero.
+    Used to generate synthetic captures for testing.
+
+    Returns packet bytes
+    '''
+
+    tcp = struct.pack("!HHIIBBHHH", sport, dport, seq, ack, 5 << 4, flags, window, 0, 0) + payload
+    ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(tcp), 0, 0, 64, IPPROTO_TCP, 0,
+                     socket.inet_aton(src), socket.inet_aton(dst))
+    ethernet = "\x00\x00\x00\x00\x00\x02" + "\x00\x00\x00\x00\x00\x01" + struct.pack("!H", ETHERTYPE_IPV4)
+
+    return ethernet + ip + tcp
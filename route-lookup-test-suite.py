@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+import unittest
+import route_lookup
+import deadline_scheduler
+import sock_diag
+import socket
+import struct
+
+
+def build_reply(family, gateway=None, source=None, oif=1, multipath=False):
+    '''
+    Builds an RTM_NEWROUTE message like the kernel's answer to RTM_GETROUTE or a route change notification
+    '''
+
+    attributes = [(route_lookup.RTA_OIF, struct.pack("=I", oif))]
+
+    if multipath:
+        # two rtnexthops, without their gateways
+        attributes.append((route_lookup.RTA_MULTIPATH, struct.pack("=HBBi", 8, 0, 0, 1) * 2))
+
+    if gateway is not None:
+        attributes.append((route_lookup.RTA_GATEWAY, socket.inet_pton(family, gateway)))
+
+    if source is not None:
+        attributes.append((route_lookup.RTA_PREFSRC, socket.inet_pton(family, source)))
+
+    body = route_lookup.rtmsg.pack(family, 32, 0, 0, 254, 0, 0, 1, 0)
+
+    for kind, value in attributes:
+        body += sock_diag.rtattr.pack(sock_diag.rtattr.size + len(value), kind) + value
+
+    return sock_diag.nlmsghdr.pack(sock_diag.nlmsghdr.size + len(body), route_lookup.RTM_NEWROUTE, 0, 1, 0) + body
+
+
+class TestParse(unittest.TestCase):
+
+    def test_request(self):
+        request = route_lookup.build_request("10.1.1.1")
+        length, kind = sock_diag.nlmsghdr.unpack_from(request)[:2]
+        self.assertEqual((length, kind), (len(request), route_lookup.RTM_GETROUTE))
+        self.assertTrue(request.endswith(socket.inet_aton("10.1.1.1")))
+
+    def test_gateway(self):
+        route = route_lookup.parse_route("10.9.9.9", build_reply(socket.AF_INET, "10.1.1.254", "10.1.1.2"))
+        self.assertEqual(route, route_lookup.Route("10.9.9.9", "lo", "10.1.1.254", "10.1.1.2"))
+
+    def test_multipath(self):
+        request = route_lookup.build_request("10.9.9.9", flags=route_lookup.RTM_F_FIB_MATCH)
+        self.assertEqual(route_lookup.rtmsg.unpack_from(request, sock_diag.nlmsghdr.size)[8],
+                         route_lookup.RTM_F_FIB_MATCH)
+
+        route = route_lookup.parse_route("10.9.9.9", build_reply(socket.AF_INET, "10.1.1.254", multipath=True))
+        self.assertTrue(route.multipath)
+        self.assertFalse(route_lookup.path_known(route))
+        self.assertTrue(route_lookup.path_known(route._replace(multipath=False)))
+
+    def test_connected_ipv6(self):
+        route = route_lookup.parse_route("2001:db8::1", build_reply(socket.AF_INET6))
+        self.assertEqual((route.interface, route.next_hop), ("lo", None))
+
+    def test_unreachable(self):
+        error = sock_diag.nlmsghdr.pack(sock_diag.nlmsghdr.size + 4, sock_diag.NLMSG_ERROR, 0, 1, 0) + struct.pack("=i", -101)
+        self.assertRaises(OSError, route_lookup.parse_route, "10.9.9.9", error)
+
+
+class TestLookup(unittest.TestCase):
+
+    def test_loopback(self):
+        try:
+            route = route_lookup.lookup("127.0.0.2")
+        except (socket.error, OSError):
+            self.skipTest("netlink route lookup unavailable")
+
+        self.assertEqual((route.interface, route.next_hop), ("lo", None))
+
+
+class TestRouteCache(unittest.TestCase):
+
+    def setUp(self):
+        self.orig_lookup = route_lookup.lookup
+        self.lookups = []
+
+        def fake_lookup(ip):
+            self.lookups.append(ip)
+
+            if ip == "10.9.9.9":
+                raise OSError(101, "Network is unreachable")
+
+            return route_lookup.Route(ip, "swp1", None, "10.1.1.2")
+
+        route_lookup.lookup = fake_lookup
+        self.clock = deadline_scheduler.VirtualClock(0)
+        self.cache = route_lookup.RouteCache(max_age=60, clock=self.clock)
+
+    def tearDown(self):
+        route_lookup.lookup = self.orig_lookup
+
+    def test_cached_until_route_change(self):
+        self.assertEqual(self.cache.get("10.1.1.1").interface, "swp1")
+        self.cache.get("10.1.1.1")
+        self.assertEqual(self.lookups, ["10.1.1.1"])
+
+        # link and address notifications don't matter, route changes do
+        self.assertFalse(self.cache.handle(sock_diag.nlmsghdr.pack(20, 16, 0, 0, 0) + "\0" * 4))
+        self.assertTrue(self.cache.handle(build_reply(socket.AF_INET)))
+        self.cache.get("10.1.1.1")
+        self.assertEqual(self.lookups, ["10.1.1.1", "10.1.1.1"])
+
+    def test_max_age(self):
+        self.cache.get("10.1.1.1")
+        self.clock.advance(60)
+        self.cache.get("10.1.1.1")
+        self.assertEqual(len(self.lookups), 2)
+
+    def test_no_route(self):
+        self.assertEqual(self.cache.get("10.9.9.9"), None)
+        self.cache.get("10.9.9.9")
+        self.assertEqual(len(self.lookups), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+from collections import namedtuple
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+import struct
+import threading
+import deadline_scheduler
+import sock_diag
+
+debug = False
+
+'''
+route_lookup asks the kernel which interface and next hop it would use to reach
+a peer (the netlink equivalent of "ip route get <ip>"), without starting a process.
+
+For a destination behind ECMP the kernel answers with the one path it hashes
+our query onto, which is often not the path the BGP session's packets take.
+A second, RTM_F_FIB_MATCH query (Linux 4.13+) returns the matching route itself,
+so Route.multipath tells the caller the interface and next hop can't be trusted.
+
+RouteCache keeps the answers and listens to the kernel's route change
+notifications (RTNLGRP_IPV4_ROUTE/RTNLGRP_IPV6_ROUTE), dropping every cached
+route as soon as any route is added or removed. If the notification socket
+can't be opened, cached routes expire after max_age instead.
+'''
+
+NETLINK_ROUTE = 0
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+NLM_F_REQUEST = 0x1
+RTM_F_FIB_MATCH = 0x2000
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_ROUTE = 0x400
+
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PREFSRC = 7
+RTA_MULTIPATH = 9
+
+# family, dst_len, src_len, tos, table, protocol, scope, type, flags
+rtmsg = struct.Struct("=BBBBBBBBI")
+
+# The kernel's answer for one destination. next_hop is None for directly connected peers.
+# multipath is True if the route has several next hops, interface and next_hop are then only one of them.
+Route = namedtuple("Route", ["ip", "interface", "next_hop", "source", "multipath"])
+Route.__new__.__defaults__ = (False,)
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+_libc.if_indextoname.restype = ctypes.c_char_p
+
+
+def path_known(route):
+    '''
+    Returns True if the route's interface and next hop are the ones every packet to the peer takes:
+    it is directly connected, or the route has a single next hop
+    '''
+
+    return route.next_hop is None or not route.multipath
+
+
+def interface_name(index):
+    '''
+    Returns the name of interface index, or the index as a string if it has gone away
+    '''
+
+    name = ctypes.create_string_buffer(16)
+
+    return _libc.if_indextoname(index, name) or str(index)
+
+
+def address_family(ip):
+    return socket.AF_INET6 if ":" in ip else socket.AF_INET
+
+
+def build_request(ip, seq=1, flags=0):
+    '''
+    Returns an RTM_GETROUTE request for the route to a single address.
+    flags are rtmsg flags, ex. RTM_F_FIB_MATCH.
+    '''
+
+    family = address_family(ip)
+    address = socket.inet_pton(family, ip)
+    attribute = sock_diag.rtattr.pack(sock_diag.rtattr.size + len(address), RTA_DST) + address
+    request = rtmsg.pack(family, len(address) * 8, 0, 0, 0, 0, 0, 0, flags) + attribute
+
+    return sock_diag.nlmsghdr.pack(sock_diag.nlmsghdr.size + len(request), RTM_GETROUTE,
+                                   NLM_F_REQUEST, seq, 0) + request
+
+
+def parse_route(ip, data):
+    '''
+    Parses the kernel's reply to build_request()
+
+    Returns Route
+
+    Raises OSError if the kernel answered with an error, ex. ENETUNREACH
+    '''
+
+    offset = 0
+
+    while offset + sock_diag.nlmsghdr.size <= len(data):
+        length, kind, flags, seq, pid = sock_diag.nlmsghdr.unpack_from(data, offset)
+
+        if length < sock_diag.nlmsghdr.size:
+            break
+
+        if kind == sock_diag.NLMSG_ERROR:
+            error = -struct.unpack_from("=i", data, offset + sock_diag.nlmsghdr.size)[0]
+            raise OSError(error, "route lookup of " + ip + ": " + os.strerror(error))
+
+        if kind == RTM_NEWROUTE:
+            return parse_attributes(ip, data[offset + sock_diag.nlmsghdr.size:offset + length])
+
+        offset += (length + 3) & ~3
+
+    raise OSError(errno.EIO, "route lookup of " + ip + ": no route in reply")
+
+
+def parse_attributes(ip, payload):
+    family = rtmsg.unpack_from(payload)[0]
+    attributes = {}
+    offset = rtmsg.size
+
+    while offset + sock_diag.rtattr.size <= len(payload):
+        length, kind = sock_diag.rtattr.unpack_from(payload, offset)
+
+        if length < sock_diag.rtattr.size:
+            break
+
+        attributes[kind] = payload[offset + sock_diag.rtattr.size:offset + length]
+        offset += (length + 3) & ~3
+
+    interface = None
+    next_hop = None
+    source = None
+
+    if RTA_OIF in attributes:
+        interface = interface_name(struct.unpack("=I", attributes[RTA_OIF])[0])
+
+    if RTA_GATEWAY in attributes:
+        next_hop = sock_diag.unmap(socket.inet_ntop(family, attributes[RTA_GATEWAY]))
+
+    if RTA_PREFSRC in attributes:
+        source = sock_diag.unmap(socket.inet_ntop(family, attributes[RTA_PREFSRC]))
+
+    return Route(ip, interface, next_hop, source, RTA_MULTIPATH in attributes)
+
+
+def lookup(ip):
+    '''
+    Asks the kernel for the route to ip, and whether the route it matched is multipath
+
+    Returns Route
+
+    Raises socket.error/OSError if there is no route or netlink is unavailable
+    '''
+
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+
+    try:
+        sock.bind((0, 0))
+        sock.send(build_request(ip))
+        route = parse_route(ip, sock.recv(65536))
+
+        sock.send(build_request(ip, 2, RTM_F_FIB_MATCH))
+
+        try:
+            matched = parse_route(ip, sock.recv(65536))
+        except OSError as e:
+            if debug:
+                print "Route match lookup failed: " + str(e)
+            return route
+
+        # Kernels before 4.13 ignore the flag and answer with a single path, never multipath
+        return route._replace(multipath=matched.multipath)
+    finally:
+        sock.close()
+
+
+class RouteCache(object):
+
+    '''
+    Peer IP -> Route, cleared whenever the kernel's routing table changes.
+    '''
+
+    def __init__(self, max_age=60, clock=deadline_scheduler.monotonic):
+        '''
+        max_age = seconds a route is trusted without change notifications
+        clock = time source for max_age
+        routes = IP -> (Route, clock() time looked up)
+        '''
+
+        self.max_age = max_age
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.sock = None
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        '''
+        Subscribes to route changes and starts the thread that listens for them
+
+        Raises socket.error if netlink is unavailable. The cache still works, using max_age.
+        '''
+
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+
+        try:
+            self.sock.bind((0, RTMGRP_IPV4_ROUTE | RTMGRP_IPV6_ROUTE))
+            self.sock.settimeout(1)
+        except socket.error:
+            self.sock.close()
+            self.sock = None
+            raise
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="route-watch")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def run(self):
+        while self.running:
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                continue
+            except socket.error as e:
+                # ENOBUFS: notifications were dropped, assume the worst
+                if debug:
+                    print "Route notifications failed: " + str(e)
+                self.invalidate()
+                continue
+
+            self.handle(data)
+
+    def handle(self, data):
+        '''
+        Invalidates the cache if data holds a route change notification
+
+        Returns True if it did
+        '''
+
+        offset = 0
+
+        while offset + sock_diag.nlmsghdr.size <= len(data):
+            length, kind, flags, seq, pid = sock_diag.nlmsghdr.unpack_from(data, offset)
+
+            if length < sock_diag.nlmsghdr.size:
+                break
+
+            if kind in (RTM_NEWROUTE, RTM_DELROUTE):
+                self.invalidate()
+                return True
+
+            offset += (length + 3) & ~3
+
+        return False
+
+    def invalidate(self):
+        with self.lock:
+            self.routes = {}
+
+    def get(self, ip):
+        '''
+        Returns the Route to ip, or None if there is no route to it
+        '''
+
+        now = self.clock()
+
+        with self.lock:
+            cached = self.routes.get(ip)
+
+            if cached is not None and now - cached[1] < self.max_age:
+                return cached[0]
+
+        try:
+            route = lookup(ip)
+        except (socket.error, OSError) as e:
+            if debug:
+                print "Route lookup failed: " + str(e)
+            return None
+
+        with self.lock:
+            self.routes[ip] = (route, now)
+
+        return route
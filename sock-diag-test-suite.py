@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+import unittest
+import sock_diag
+import deadline_scheduler
+import socket
+import struct
+
+
+def build_message(src, dst, sport, dport, state=1, last_data_recv=1500, retransmits=0, rtt=2500):
+    '''
+    Builds a SOCK_DIAG_BY_FAMILY netlink message for an IPv4 socket, like the kernel sends
+    '''
+
+    info = [0] * 32
+    info[0] = state
+    info[2] = retransmits
+    info[19] = last_data_recv
+    info[23] = rtt
+    info[31] = 7
+    tcp_info = sock_diag.tcp_info.pack(*info)
+    attribute = sock_diag.rtattr.pack(sock_diag.rtattr.size + len(tcp_info), sock_diag.INET_DIAG_INFO) + tcp_info
+
+    body = sock_diag.inet_diag_msg.pack(socket.AF_INET, state, 0, 0, struct.pack("!H", sport), struct.pack("!H", dport),
+                                        socket.inet_aton(src).ljust(16, "\0"), socket.inet_aton(dst).ljust(16, "\0"),
+                                        0, 0, 0, 0, 0, 0) + attribute
+
+    return sock_diag.nlmsghdr.pack(sock_diag.nlmsghdr.size + len(body), sock_diag.SOCK_DIAG_BY_FAMILY, 2, 1, 0) + body
+
+
+def build_done():
+    return sock_diag.nlmsghdr.pack(sock_diag.nlmsghdr.size + 4, sock_diag.NLMSG_DONE, 2, 1, 0) + "\0" * 4
+
+
+class TestParse(unittest.TestCase):
+
+    def test_parse_messages(self):
+        data = build_message("10.1.1.2", "10.1.1.1", 179, 40000, retransmits=2) + build_done()
+        sessions, done = sock_diag.parse_messages(data)
+
+        self.assertTrue(done)
+        self.assertEqual(sessions, [sock_diag.TcpSession("10.1.1.2", 179, "10.1.1.1", 40000, "ESTABLISHED",
+                                                         1.5, 0.0, 2, 7, 2.5, 0.0, 0, 0, 0, 0)])
+
+    def test_partial_dump(self):
+        sessions, done = sock_diag.parse_messages(build_message("10.1.1.2", "10.1.1.1", 179, 40000))
+        self.assertFalse(done)
+        self.assertEqual(len(sessions), 1)
+
+    def test_error(self):
+        error = sock_diag.nlmsghdr.pack(sock_diag.nlmsghdr.size + 4, sock_diag.NLMSG_ERROR, 0, 1, 0) + struct.pack("=i", -1)
+        self.assertRaises(OSError, sock_diag.parse_messages, error)
+
+    def test_unmap(self):
+        self.assertEqual(sock_diag.unmap("::ffff:10.1.1.1"), "10.1.1.1")
+        self.assertEqual(sock_diag.unmap("2001:db8::1"), "2001:db8::1")
+
+
+class TestDump(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self.client = socket.create_connection(("127.0.0.1", self.port))
+        self.server = self.listener.accept()[0]
+
+    def tearDown(self):
+        for sock in [self.client, self.server, self.listener]:
+            sock.close()
+
+    def test_loopback(self):
+        try:
+            sessions = sock_diag.dump(self.port)
+        except (socket.error, OSError):
+            self.skipTest("netlink sock_diag unavailable")
+
+        states = sorted(session.state for session in sessions)
+        self.assertEqual(states, ["ESTABLISHED", "ESTABLISHED", "LISTEN"])
+
+        client = [s for s in sessions if s.local_port == self.client.getsockname()[1]][0]
+        self.assertEqual(client.peer_port, self.port)
+        self.assertTrue(client.last_data_recv is not None)
+        self.assertTrue(sock_diag.format_sessions([client])[0].startswith("ESTABLISHED"))
+
+
+class TestSessionTable(unittest.TestCase):
+
+    def setUp(self):
+        self.orig_dump = sock_diag.dump
+        self.dumps = 0
+
+        def fake_dump(port=None):
+            self.dumps += 1
+            return sock_diag.parse_messages(build_message("10.1.1.2", "10.1.1.1", 179, 40000, state=7) +
+                                            build_message("10.1.1.2", "10.1.1.1", 179, 40001))[0]
+
+        sock_diag.dump = fake_dump
+
+    def tearDown(self):
+        sock_diag.dump = self.orig_dump
+
+    def test_established_wins_and_cached(self):
+        clock = deadline_scheduler.VirtualClock(0)
+        table = sock_diag.SessionTable(clock)
+
+        self.assertEqual(table.get("10.1.1.1").peer_port, 40001)
+        self.assertEqual(table.get("10.1.1.3"), None)
+        self.assertEqual(self.dumps, 1)
+
+        clock.advance(1)
+        table.get("10.1.1.1")
+        self.assertEqual(self.dumps, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+from collections import namedtuple
+import os
+import socket
+import struct
+import threading
+
+debug = False
+
+'''
+sock_diag reads the kernel's TCP socket state over netlink (NETLINK_SOCK_DIAG,
+the interface "ss" uses) without starting a process.
+
+One dump returns every TCP socket with its tcp_info, so all BGP sessions are
+covered by a single request:
+
+    last_data_recv - seconds since the peer last sent data (keepalives count), millisecond resolution
+    retransmits/total_retrans - retransmissions in progress / over the life of the socket
+    rtt/rttvar - smoothed round trip time and variance in milliseconds
+    recv_queue/send_queue - bytes waiting to be read / waiting to be acknowledged
+    probes - unanswered zero window (or keepalive) probes
+
+SessionTable caches one dump of the port 179 sockets for a second at a time,
+so every neighbor checked in the same tick shares it.
+'''
+
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+INET_DIAG_INFO = 2
+
+# from <netinet/tcp.h>
+TCP_STATES = {1: "ESTABLISHED", 2: "SYN-SENT", 3: "SYN-RECV", 4: "FIN-WAIT-1", 5: "FIN-WAIT-2",
+              6: "TIME-WAIT", 7: "CLOSE", 8: "CLOSE-WAIT", 9: "LAST-ACK", 10: "LISTEN", 11: "CLOSING"}
+
+BGP_PORT = 179
+
+nlmsghdr = struct.Struct("=IHHII")
+rtattr = struct.Struct("=HH")
+# family, protocol, ext, pad, states, then an all zero inet_diag_sockid (48 bytes)
+inet_diag_req_v2 = struct.Struct("=BBBxI48x")
+# family, state, timer, retrans, sport, dport, src, dst, if, cookie, expires, rqueue, wqueue, uid, inode
+inet_diag_msg = struct.Struct("=BBBB2s2s16s16sI8xIIIII")
+# the tcp_info fields used, up to tcpi_total_retrans. Older kernels may send less and are zero padded.
+tcp_info = struct.Struct("=BBBBBBBBIIIIIIIIIIIIIIIIIIIIIIII")
+
+# One TCP socket. Times are seconds, rtt/rttvar milliseconds.
+TcpSession = namedtuple("TcpSession", ["local", "local_port", "peer", "peer_port", "state",
+                                       "last_data_recv", "last_data_sent", "retransmits", "total_retrans",
+                                       "rtt", "rttvar", "recv_queue", "send_queue", "probes", "backoff"])
+
+
+def build_request(family, seq=1):
+    '''
+    Returns a SOCK_DIAG_BY_FAMILY dump request for every TCP socket of family, with tcp_info
+    '''
+
+    request = inet_diag_req_v2.pack(family, socket.IPPROTO_TCP, 1 << (INET_DIAG_INFO - 1), 0xffffffff)
+
+    return nlmsghdr.pack(nlmsghdr.size + len(request), SOCK_DIAG_BY_FAMILY,
+                         NLM_F_REQUEST | NLM_F_DUMP, seq, 0) + request
+
+
+def parse_messages(data):
+    '''
+    Parses a buffer of netlink messages
+
+    Returns (list of TcpSession, True if the dump is complete)
+    '''
+
+    sessions = []
+    offset = 0
+
+    while offset + nlmsghdr.size <= len(data):
+        length, kind, flags, seq, pid = nlmsghdr.unpack_from(data, offset)
+
+        if length < nlmsghdr.size:
+            break
+
+        if kind == NLMSG_DONE:
+            return sessions, True
+
+        if kind == NLMSG_ERROR:
+            error = -struct.unpack_from("=i", data, offset + nlmsghdr.size)[0]
+            raise OSError(error, "sock_diag: " + os.strerror(error))
+
+        if kind == SOCK_DIAG_BY_FAMILY:
+            sessions.append(parse_session(data[offset + nlmsghdr.size:offset + length]))
+
+        # messages are 4 byte aligned
+        offset += (length + 3) & ~3
+
+    return sessions, False
+
+
+def parse_session(payload):
+    '''
+    Parses one inet_diag_msg and its INET_DIAG_INFO attribute
+
+    Returns TcpSession
+    '''
+
+    (family, state, timer, retrans, sport, dport, src, dst, interface,
+     expires, rqueue, wqueue, uid, inode) = inet_diag_msg.unpack_from(payload)
+
+    if family == socket.AF_INET:
+        local = socket.inet_ntop(socket.AF_INET, src[:4])
+        peer = socket.inet_ntop(socket.AF_INET, dst[:4])
+    else:
+        local = unmap(socket.inet_ntop(socket.AF_INET6, src))
+        peer = unmap(socket.inet_ntop(socket.AF_INET6, dst))
+
+    info = None
+    offset = inet_diag_msg.size
+
+    while offset + rtattr.size <= len(payload):
+        length, kind = rtattr.unpack_from(payload, offset)
+
+        if length < rtattr.size:
+            break
+
+        if kind == INET_DIAG_INFO:
+            raw = payload[offset + rtattr.size:offset + length]
+            info = tcp_info.unpack(raw[:tcp_info.size].ljust(tcp_info.size, "\0"))
+
+        offset += (length + 3) & ~3
+
+    session = [local, struct.unpack("!H", sport)[0], peer, struct.unpack("!H", dport)[0],
+               TCP_STATES.get(state, str(state))]
+
+    if info is None:
+        return TcpSession(*(session + [None, None, retrans, None, None, None, rqueue, wqueue, None, None]))
+
+    # tcp_info: 8 u8 (state, ca_state, retransmits, probes, backoff, ...) then u32s from tcpi_rto (info[8]).
+    # last_data_sent 17, last_data_recv 19 (msecs), rtt 23, rttvar 24 (usecs), total_retrans 31
+    return TcpSession(*(session + [info[19] / 1000.0, info[17] / 1000.0, info[2], info[31],
+                                   info[23] / 1000.0, info[24] / 1000.0, rqueue, wqueue, info[3], info[4]]))
+
+
+def unmap(address):
+    '''
+    Returns the IPv4 address of an IPv4-mapped IPv6 address, ex. "::ffff:10.1.1.1" -> "10.1.1.1".
+    Quagga listens on [::], so IPv4 peers that connect in show up mapped.
+    '''
+
+    if address.startswith("::ffff:") and "." in address:
+        return address[len("::ffff:"):]
+
+    return address
+
+
+def dump(port=None, families=(socket.AF_INET, socket.AF_INET6)):
+    '''
+    Dumps TCP sockets from the kernel
+
+    Keyword Args:
+    port - only sockets with this local or remote port. Defaults to every socket
+    families - address families to dump
+
+    Returns list of TcpSession
+
+    Raises socket.error/OSError if netlink sock_diag is unavailable
+    '''
+
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_SOCK_DIAG)
+    sessions = []
+
+    try:
+        sock.bind((0, 0))
+
+        for seq, family in enumerate(families, 1):
+            sock.send(build_request(family, seq))
+            done = False
+
+            while not done:
+                received, done = parse_messages(sock.recv(65536))
+                sessions.extend(received)
+
+    finally:
+        sock.close()
+
+    if port is not None:
+        sessions = [s for s in sessions if s.local_port == port or s.peer_port == port]
+
+    return sessions
+
+
+def format_sessions(sessions):
+    '''
+    Returns a list of "ss -ti" style lines, one per socket
+    '''
+
+    lines = []
+
+    for s in sessions:
+        line = "%-12s %6d %6d %s:%d %s:%d" % (s.state, s.recv_queue, s.send_queue,
+                                             s.local, s.local_port, s.peer, s.peer_port)
+
+        if s.rtt is not None:
+            line += " rtt:%.3f/%.3f retrans:%d/%d probes:%d backoff:%d lastrcv:%d lastsnd:%d" % (
+                s.rtt, s.rttvar, s.retransmits, s.total_retrans, s.probes, s.backoff,
+                s.last_data_recv * 1000, s.last_data_sent * 1000)
+
+        lines.append(line)
+
+    return lines
+
+
+class SessionTable(object):
+
+    '''
+    Per peer IP cache of the BGP (port 179) TCP sockets from one dump.
+    '''
+
+    def __init__(self, clock, max_age=1):
+        '''
+        clock = time source. ex. deadline_scheduler.monotonic
+        max_age = seconds a dump is reused
+        table = peer IP -> TcpSession. Established sockets win over others for the same peer.
+        '''
+
+        self.clock = clock
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.table = {}
+        self.updated = None
+
+    def refresh(self):
+        table = {}
+
+        for session in dump(BGP_PORT):
+            if session.state == "LISTEN":
+                continue
+
+            current = table.get(session.peer)
+
+            if current is None or current.state != "ESTABLISHED":
+                table[session.peer] = session
+
+        self.table = table
+        self.updated = self.clock()
+
+    def get(self, ip):
+        '''
+        Returns the TcpSession to peer ip, or None if there is no socket to it.
+        Dumps first if the table is older than max_age.
+        '''
+
+        with self.lock:
+            if self.updated is None or self.clock() - self.updated >= self.max_age:
+                self.refresh()
+
+            return self.table.get(ip)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+import datetime
+import json
+import bgp_parser
+
+'''
+synthetic_bgp generates Quagga "show ip bgp summary" and "show ip bgp neighbor"
+output (text and json) for any number of peers, for benchmarks and simulations
+that need far more peers than a lab switch has.
+
+Peers are described with bgp_parser.NeighborState, so generating output and
+parsing it back should give the same NeighborState.
+
+    peers = make_peers(1000)
+    output = neighbors_text(peers)
+    bgp_parser.parse_neighbors(output)["10.0.0.1"] == peers[0]
+'''
+
+local_as = 65222
+remote_as_base = 65000
+
+
+def peer_ip(index):
+    '''
+    Returns the IP of the index'th synthetic peer. ex. 0 -> "10.0.0.1"
+    '''
+
+    index += 1
+
+    return "10.%d.%d.%d" % ((index >> 16) & 0xff, (index >> 8) & 0xff, index & 0xff)
+
+
+def make_peers(count, down_every=10, hold_time=180, keepalive=60):
+    '''
+    Returns list of count bgp_parser.NeighborState.
+    Every down_every'th peer is Active, the rest Established with a last read under one keepalive.
+    '''
+
+    peers = []
+
+    for index in range(count):
+        if down_every and index % down_every == down_every - 1:
+            peers.append(bgp_parser.NeighborState(peer_ip(index), "Active",
+                                                  datetime.timedelta(days=4, hours=15), hold_time, keepalive,
+                                                  remote_as_base + index % 1000))
+        else:
+            peers.append(bgp_parser.NeighborState(peer_ip(index), "Established",
+                                                  datetime.timedelta(seconds=index % keepalive), hold_time, keepalive,
+                                                  remote_as_base + index % 1000))
+
+    return peers
+
+
+def format_timer(delta):
+    '''
+    Formats a timedelta the way Quagga does. ex. "00:00:55", "4d15h00m", "01w4d15h"
+    '''
+
+    if delta is None:
+        return "never"
+
+    seconds = int(delta.total_seconds())
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+
+    if days == 0:
+        return "%02d:%02d:%02d" % (hours, minutes, seconds)
+
+    if days < 7:
+        return "%dd%02dh%02dm" % (days, hours, minutes)
+
+    return "%02dw%dd%02dh" % (days // 7, days % 7, hours)
+
+
+def summary_text(peers):
+    '''
+    Returns "show ip bgp summary" output for a list of NeighborState
+    '''
+
+    lines = ["BGP router identifier 10.2.2.2, local AS number " + str(local_as),
+             "RIB entries " + str(len(peers) * 2) + ", using 784 bytes of memory",
+             "Peers " + str(len(peers)) + ", using 17 KiB of memory",
+             "",
+             "Neighbor        V    AS MsgRcvd MsgSent   TblVer  InQ OutQ Up/Down  State/PfxRcd"]
+
+    for index, peer in enumerate(peers):
+        state = "2" if peer.state == "Established" else peer.state
+        lines.append("%-15s 4 %5d %7d %7d        0    0    0 %8s %8s" %
+                     (peer.ip, remote_as_base + index % 1000, 17758, 17788, "01w3d19h", state))
+
+    lines.append("")
+    lines.append("Total number of neighbors " + str(len(peers)))
+
+    return "\n".join(lines) + "\n"
+
+
+def neighbors_text(peers):
+    '''
+    Returns "show ip bgp neighbor" output for a list of NeighborState
+    '''
+
+    blocks = []
+
+    for index, peer in enumerate(peers):
+        blocks.append(neighbor_block(peer, remote_as_base + index % 1000))
+
+    return "".join(blocks)
+
+
+def neighbor_block(peer, remote_as=remote_as_base):
+    '''
+    Returns the "show ip bgp neighbor" block of a single NeighborState
+    '''
+
+    up = ", up for 01w4d15h" if peer.state == "Established" else ""
+
+    return ("BGP neighbor is %s, remote AS %d, local AS %d, external link\n"
+            "  BGP version 4, remote router ID 10.1.1.1\n"
+            "  BGP state = %s%s\n"
+            "  Last read %s, Last write 01w4d15h\n"
+            "  Hold time is %d, keepalive interval is %d seconds\n"
+            "  Neighbor capabilities:\n"
+            "    4 Byte AS: advertised and received\n"
+            "    Route refresh: advertised and received(old & new)\n"
+            "    Address family IPv4 Unicast: advertised and received\n"
+            "  Message statistics:\n"
+            "    Inq depth is 0\n"
+            "    Outq depth is 0\n"
+            "                         Sent       Rcvd\n"
+            "    Opens:                  4          4\n"
+            "    Notifications:          1          2\n"
+            "    Updates:               33          8\n"
+            "    Keepalives:         18986      18979\n"
+            "    Total:              19024      18993\n"
+            "  Minimum time between advertisement runs is 30 seconds\n"
+            "\n"
+            " For address family: IPv4 Unicast\n"
+            "  2 accepted prefixes\n"
+            "\n"
+            "  Connections established 4; dropped 3\n"
+            "Local host: 10.2.2.2, Local port: 179\n"
+            "Foreign host: %s, Foreign port: 55771\n"
+            "Nexthop: 10.2.2.2\n"
+            "BGP connection: non shared network\n"
+            "Read thread: on  Write thread: off\n"
+            "\n") % (peer.ip, remote_as, local_as, peer.state, up, format_timer(peer.last_read),
+                     peer.hold_time, peer.keepalive, peer.ip)
+
+
+def summary_json(peers):
+    '''
+    Returns "show ip bgp summary json" output for a list of NeighborState
+    '''
+
+    summary = {"routerId": "10.2.2.2", "as": local_as, "peers": {}}
+
+    for index, peer in enumerate(peers):
+        summary["peers"][peer.ip] = {"remoteAs": remote_as_base + index % 1000, "version": 4,
+                                     "msgRcvd": 17758, "msgSent": 17788, "peerUptime": "01w3d19h",
+                                     "prefixReceivedCount": 2, "state": peer.state}
+
+    return json.dumps(summary)
+
+
+def neighbors_json(peers):
+    '''
+    Returns "show ip bgp neighbor json" output for a list of NeighborState
+    '''
+
+    neighbors = {}
+
+    for index, peer in enumerate(peers):
+        neighbors[peer.ip] = {"remoteAs": remote_as_base + index % 1000, "bgpState": peer.state,
+                              "bgpTimerLastRead": int(peer.last_read.total_seconds() * 1000),
+                              "bgpTimerHoldTimeMsecs": peer.hold_time * 1000,
+                              "bgpTimerKeepAliveIntervalMsecs": peer.keepalive * 1000}
+
+    return json.dumps(neighbors)
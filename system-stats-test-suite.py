@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+import unittest
+import system_stats
+import deadline_scheduler
+import tempfile
+import shutil
+import os
+
+proc_stat = """cpu  %d 0 %d %d 0 0 %d 0 0 0
+cpu0 %d 0 %d %d 0 0 %d 0 0 0
+intr 170084 0 0
+ctxt %d
+btime 1792337461
+processes 7876
+procs_running %d
+procs_blocked 0
+"""
+
+meminfo = """MemTotal:        8000000 kB
+MemFree:         2000000 kB
+MemAvailable:    %d kB
+Buffers:          100000 kB
+Cached:          3000000 kB
+SwapTotal:             0 kB
+SwapFree:              0 kB
+"""
+
+# pid (comm) state ... utime is the 14th field, stime the 15th, rss the 24th
+pid_stat = "%d (%s) S 1 1 1 0 -1 4194304 86 0 0 0 %d %d 0 0 20 0 1 0 209405 2568192 %d 18446744073709551615 0\n"
+
+
+class TestSystemStats(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.orig_proc_root = system_stats.proc_root
+        self.orig_net_root = system_stats.net_root
+        system_stats.proc_root = os.path.join(self.tmp_dir, "proc")
+        system_stats.net_root = os.path.join(self.tmp_dir, "net")
+        os.makedirs(system_stats.proc_root)
+
+        self.write_system(user=1000, system=500, idle=8500, softirq=0, ctxt=1000, running=1, available=4000000)
+        self.write_process(1, "init", 10)
+        self.write_process(200, "bgpd (main)", 100)
+        self.write_interface("swp1", 1000, 1000, 0)
+        self.write_interface("swp2", 50, 50, 0)
+
+    def tearDown(self):
+        system_stats.proc_root = self.orig_proc_root
+        system_stats.net_root = self.orig_net_root
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, path, text):
+        path = os.path.join(self.tmp_dir, path)
+
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        with open(path, "w") as f:
+            f.write(text)
+
+    def write_system(self, user, system, idle, softirq, ctxt, running, available):
+        self.write("proc/stat", proc_stat % (user, system, idle, softirq, user, system, idle, softirq, ctxt, running))
+        self.write("proc/meminfo", meminfo % available)
+
+    def write_process(self, pid, name, ticks):
+        self.write("proc/%d/stat" % pid, pid_stat % (pid, name, ticks, ticks, 500))
+
+    def write_interface(self, name, rx_packets, tx_packets, rx_dropped):
+        for counter, value in [("rx_packets", rx_packets), ("tx_packets", tx_packets), ("rx_dropped", rx_dropped)]:
+            self.write("net/%s/statistics/%s" % (name, counter), "%d\n" % value)
+
+    def test_readers(self):
+        cpu = system_stats.read_cpu()
+        self.assertEqual((cpu.user, cpu.system, cpu.idle, cpu.ctxt, cpu.running), (1000, 500, 8500, 1000, 1))
+        self.assertEqual(system_stats.read_memory()["MemAvailable"], 4000000)
+
+        bgpd = system_stats.read_processes()[200]
+        self.assertEqual((bgpd.name, bgpd.state, bgpd.cpu_ticks, bgpd.rss_kb),
+                         ("bgpd (main)", "S", 200, 500 * system_stats.page_kb))
+
+        self.assertEqual(system_stats.read_interfaces(), {"swp1": (1000, 1000, 0, 0, 0, 0), "swp2": (50, 50, 0, 0, 0, 0)})
+        self.assertEqual(system_stats.read_interfaces(["swp2"]).keys(), ["swp2"])
+
+    def test_sampler(self):
+        clock = deadline_scheduler.VirtualClock(0)
+        counters = dict(user=1000, system=500, idle=8500, ctxt=1000, available=4000000, bgpd=100, rx=1000, drops=0)
+
+        # the box gets busy in the last half second: bgpd spins, swp1 drops packets
+        def sleep(seconds):
+            clock.sleep(seconds)
+            busy = clock() >= 2
+            counters["user"] += 80 if busy else 20
+            counters["system"] += 10
+            counters["idle"] += 10 if busy else 70
+            counters["ctxt"] += 100
+            counters["available"] -= 1000
+            counters["bgpd"] += 50 if busy else 0
+            counters["rx"] += 100
+            counters["drops"] += 5 if busy else 0
+
+            self.write_system(counters["user"], counters["system"], counters["idle"], 0, counters["ctxt"],
+                              4 if busy else 1, counters["available"])
+            self.write_process(200, "bgpd (main)", counters["bgpd"])
+            self.write_interface("swp1", counters["rx"], counters["rx"], counters["drops"])
+
+        sampler = system_stats.Sampler(duration=2, interval=0.5, clock=clock, sleep=sleep)
+        lines = sampler.collect()
+
+        self.assertEqual(len(sampler.samples), 5)
+        self.assertEqual(lines[0].split()[:3], ["sec", "cpu%", "max%"])
+
+        first, second = lines[1].split(), lines[2].split()
+        self.assertEqual(first[:3], ["0", "30.0", "30.0"])
+        self.assertEqual(second[:3], ["1", "60.0", "90.0"])
+        # run queue, lowest MemAvailable, rx packets/s and drops
+        self.assertEqual((second[7], second[9], second[12], second[14]), ("4", "3996000", "200", "5"))
+
+        self.assertTrue("top processes by CPU over 2.0s" in lines)
+        bgpd = [line for line in lines if line.endswith("bgpd (main)")][0]
+        self.assertEqual(float(bgpd.split()[1]), 100.0 / system_stats.clock_ticks / 2 * 100)
+
+        self.assertTrue("interface counters over 2.0s (1 of 2 moved)" in lines)
+        self.assertTrue(lines[-1].startswith("swp1             rx     200.0/s tx     200.0/s"))
+        self.assertTrue(lines[-1].endswith("rx_drop 5 tx_drop 0"))
+
+        summary = sampler.summary()
+        self.assertEqual((summary["cpu_percent"], summary["cpu_peak_percent"]), (45.0, 90.0))
+        self.assertEqual((summary["run_queue_max"], summary["available_kb_min"]), (4, 3996000))
+        self.assertEqual((summary["rx_pps"], summary["drops"], summary["errors"]), (200.0, 5, 0))
+
+    def test_ring_buffer(self):
+        clock = deadline_scheduler.VirtualClock(0)
+        sampler = system_stats.Sampler(duration=10, interval=0.1, capacity=20, clock=clock, sleep=clock.sleep)
+        sampler.run()
+
+        self.assertEqual(len(sampler.samples), 20)
+        self.assertEqual(sampler.samples[-1].time, 10)
+
+
+class TestLiveSystem(unittest.TestCase):
+
+    def test_reads_this_box(self):
+        self.assertTrue(system_stats.read_memory()["MemTotal"] > 0)
+        self.assertTrue(os.getpid() in system_stats.read_processes())
+        self.assertTrue("lo" in system_stats.read_interfaces())
+
+
+if __name__ == '__main__':
+    unittest.main()
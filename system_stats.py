@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+from collections import deque, namedtuple
+import os
+import time
+import deadline_scheduler
+
+debug = False
+
+'''
+system_stats reads CPU, memory, process and interface counters straight from
+/proc and /sys, instead of running ps, vmstat and cl-netstat. Those cost
+several process spawns, exactly when the box may already be CPU starved and
+dropping BGP.
+
+During an incident a Sampler reads /proc/stat and /proc/meminfo every interval
+(0.2s by default) for a few seconds into a fixed size ring buffer. Interface
+counters (/sys/class/net/*/statistics) are read once a second, and
+/proc/<pid>/stat only at the start and the end. The report is a compact
+per-second time series with the peak CPU of each second, so a burst that vmstat's
+averages hide still shows up, followed by the top processes by CPU and the
+interfaces whose counters moved:
+
+     sec  cpu%  max%  usr%  sys% sirq%  iow%  run  blk   avail_kB    swap_kB   ctxt/s     rx_pps     tx_pps err+drop
+       0  12.5  40.0   8.0   3.5   1.0   0.0    2    0    1523000          0     2210       1200       1180        0
+'''
+
+proc_root = "/proc"  # Replaced with a fake tree in tests
+net_root = "/sys/class/net"
+
+clock_ticks = os.sysconf("SC_CLK_TCK")  # /proc jiffies per second
+page_kb = os.sysconf("SC_PAGE_SIZE") // 1024
+
+CPU_FIELDS = ["user", "nice", "system", "idle", "iowait", "irq", "softirq", "steal"]
+MEMORY_FIELDS = ["MemTotal", "MemFree", "MemAvailable", "Cached", "SwapTotal", "SwapFree"]
+INTERFACE_COUNTERS = ["rx_packets", "tx_packets", "rx_errors", "tx_errors", "rx_dropped", "tx_dropped"]
+
+# Aggregate CPU jiffies from the "cpu" line of /proc/stat, context switches and run queue
+CpuStat = namedtuple("CpuStat", CPU_FIELDS + ["ctxt", "running", "blocked"])
+
+# One /proc/<pid>/stat. cpu_ticks is user + system jiffies over the life of the process.
+Process = namedtuple("Process", ["pid", "name", "state", "cpu_ticks", "rss_kb"])
+
+# One reading. memory is field -> kB, interfaces is name -> counters in INTERFACE_COUNTERS
+# order, or None on the samples in between the once a second interface reads.
+Sample = namedtuple("Sample", ["time", "cpu", "memory", "interfaces"])
+
+
+def read_file(path):
+    '''
+    Returns the contents of path, or None if it can't be read (ex. the process exited)
+    '''
+
+    try:
+        with open(path) as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def read_cpu():
+    '''
+    Returns CpuStat from /proc/stat
+    '''
+
+    jiffies = []
+    counters = {}
+
+    for line in read_file(os.path.join(proc_root, "stat")).splitlines():
+        words = line.split()
+
+        if not words:
+            continue
+
+        if words[0] == "cpu":
+            jiffies = [int(word) for word in words[1:len(CPU_FIELDS) + 1]]
+        elif words[0] in ("ctxt", "procs_running", "procs_blocked"):
+            counters[words[0]] = int(words[1])
+
+    # older kernels have fewer columns
+    jiffies += [0] * (len(CPU_FIELDS) - len(jiffies))
+
+    return CpuStat(*(jiffies + [counters.get("ctxt", 0), counters.get("procs_running", 0),
+                                counters.get("procs_blocked", 0)]))
+
+
+def read_memory():
+    '''
+    Returns dict of MEMORY_FIELDS -> kB from /proc/meminfo. MemAvailable is missing before Linux 3.14.
+    '''
+
+    memory = {}
+
+    for line in read_file(os.path.join(proc_root, "meminfo")).splitlines():
+        name, _, value = line.partition(":")
+
+        if name in MEMORY_FIELDS:
+            memory[name] = int(value.split()[0])
+
+    return memory
+
+
+def read_processes():
+    '''
+    Returns dict of pid -> Process for every process in /proc
+    '''
+
+    processes = {}
+
+    for pid in os.listdir(proc_root):
+        if not pid.isdigit():
+            continue
+
+        stat = read_file(os.path.join(proc_root, pid, "stat"))
+
+        if stat is None:
+            continue
+
+        # the name is in parentheses and may contain spaces or parentheses itself
+        name = stat[stat.find("(") + 1:stat.rfind(")")]
+        fields = stat[stat.rfind(")") + 2:].split()
+
+        # fields[0] is the 3rd field of proc(5): state. utime 14, stime 15, rss 24
+        processes[int(pid)] = Process(int(pid), name, fields[0], int(fields[11]) + int(fields[12]),
+                                      int(fields[21]) * page_kb)
+
+    return processes
+
+
+def read_interfaces(names=None):
+    '''
+    Returns dict of interface -> tuple of INTERFACE_COUNTERS
+
+    Keyword Args:
+    names - interfaces to read. Defaults to every interface in /sys/class/net
+    '''
+
+    if names is None:
+        names = sorted(os.listdir(net_root))
+
+    interfaces = {}
+
+    for name in names:
+        counters = []
+
+        for counter in INTERFACE_COUNTERS:
+            value = read_file(os.path.join(net_root, name, "statistics", counter))
+            counters.append(int(value) if value else 0)
+
+        interfaces[name] = tuple(counters)
+
+    return interfaces
+
+
+class Sampler(object):
+
+    '''
+    Samples the system for a few seconds into a ring buffer and reports it.
+    '''
+
+    def __init__(self, duration=10, interval=0.2, capacity=300, interfaces=None,
+                 clock=deadline_scheduler.monotonic, sleep=time.sleep):
+        '''
+        duration = seconds to sample for
+        interval = seconds between CPU and memory samples
+        capacity = samples kept. The oldest are dropped once the ring buffer is full
+        interfaces = interface names to read counters from, None for all of them
+        clock/sleep = time source, replaced with a VirtualClock in tests
+        samples = deque of Sample
+        processes = (Processes at the start, Processes at the end)
+        '''
+
+        self.duration = duration
+        self.interval = interval
+        self.interfaces = interfaces
+        self.clock = clock
+        self.sleep = sleep
+        self.samples = deque(maxlen=capacity)
+        self.processes = None
+
+    def run(self):
+        '''
+        Samples for duration seconds. Blocks.
+        '''
+
+        start = self.clock()
+        first_processes = read_processes()
+        last_second = None
+
+        while True:
+            now = self.clock()
+            second = int(now - start)
+            finished = now - start >= self.duration
+            interfaces = None
+
+            if second != last_second or finished:
+                interfaces = read_interfaces(self.interfaces)
+                last_second = second
+
+            self.samples.append(Sample(now, read_cpu(), read_memory(), interfaces))
+
+            if finished:
+                break
+
+            self.sleep(min(self.interval, start + self.duration - now))
+
+        self.processes = (first_processes, read_processes())
+
+    def collect(self):
+        '''
+        Samples for duration seconds and returns the report as a list of lines
+        '''
+
+        self.run()
+
+        return self.report()
+
+    def summary(self):
+        '''
+        Returns summarize() of the samples taken
+        '''
+
+        return summarize(list(self.samples))
+
+    def report(self):
+        samples = list(self.samples)
+
+        if len(samples) < 2:
+            return ["not enough samples"]
+
+        elapsed = samples[-1].time - samples[0].time
+        lines = time_series(samples)
+        lines.append("")
+        lines.extend(top_processes(self.processes[0], self.processes[1], elapsed))
+        lines.append("")
+        lines.extend(interface_deltas([s for s in samples if s.interfaces is not None]))
+
+        return lines
+
+
+def summarize(samples):
+    '''
+    Returns dict of a few numbers describing a run of samples, for the incident history:
+    CPU percent (average and peak between two samples), the longest run queue, the lowest
+    available memory and the packet rates, errors and drops summed over interfaces
+    '''
+
+    if len(samples) < 2:
+        return {}
+
+    first, last = samples[0], samples[-1]
+    pairs = zip(samples, samples[1:])
+    summary = {"cpu_percent": cpu_percent(first.cpu, last.cpu)["busy"],
+               "cpu_peak_percent": max(cpu_percent(before.cpu, after.cpu)["busy"] for before, after in pairs),
+               "run_queue_max": max(sample.cpu.running for sample in samples),
+               "blocked_max": max(sample.cpu.blocked for sample in samples),
+               "available_kb_min": min(sample.memory.get("MemAvailable", sample.memory.get("MemFree", 0))
+                                       for sample in samples)}
+
+    counters = [sample for sample in samples if sample.interfaces is not None]
+
+    if len(counters) >= 2:
+        elapsed = (counters[-1].time - counters[0].time) or 1.0
+        totals = [0] * len(INTERFACE_COUNTERS)
+
+        for name, values in counters[-1].interfaces.items():
+            previous = counters[0].interfaces.get(name, values)
+            totals = [total + now - then for total, now, then in zip(totals, values, previous)]
+
+        summary["rx_pps"] = totals[0] / elapsed
+        summary["tx_pps"] = totals[1] / elapsed
+        summary["errors"] = totals[2] + totals[3]
+        summary["drops"] = totals[4] + totals[5]
+
+    return summary
+
+
+def cpu_percent(before, after):
+    '''
+    Returns dict of "busy" and each CPU_FIELDS -> percent of the jiffies between two CpuStat
+    '''
+
+    deltas = [getattr(after, field) - getattr(before, field) for field in CPU_FIELDS]
+    total = float(sum(deltas)) or 1.0
+    percent = dict((field, delta * 100 / total) for field, delta in zip(CPU_FIELDS, deltas))
+    percent["busy"] = 100 - percent["idle"] - percent["iowait"]
+
+    return percent
+
+
+def time_series(samples):
+    '''
+    Returns list of lines, one per second of samples, with CPU percent (average and the peak
+    between two samples), run queue, memory, context switches and packet rates summed over interfaces
+    '''
+
+    lines = ["%4s %5s %5s %5s %5s %5s %5s %4s %4s %10s %10s %8s %10s %10s %8s" %
+             ("sec", "cpu%", "max%", "usr%", "sys%", "sirq%", "iow%", "run", "blk",
+              "avail_kB", "swap_kB", "ctxt/s", "rx_pps", "tx_pps", "err+drop")]
+
+    start = samples[0].time
+    previous_counters = samples[0]
+    buckets = []
+
+    # each pair of consecutive samples is counted in the second it starts in
+    for before, after in zip(samples, samples[1:]):
+        second = int(before.time - start)
+
+        if not buckets or buckets[-1][0] != second:
+            buckets.append((second, [], []))
+
+        buckets[-1][1].append((before, after))
+
+        if after.interfaces is not None:
+            buckets[-1][2].append((previous_counters, after))
+            previous_counters = after
+
+    for second, pairs, counter_pairs in buckets:
+        first, last = pairs[0][0], pairs[-1][1]
+        cpu = cpu_percent(first.cpu, last.cpu)
+        peak = max(cpu_percent(before.cpu, after.cpu)["busy"] for before, after in pairs)
+        seconds = (last.time - first.time) or 1.0
+
+        available = min(after.memory.get("MemAvailable", after.memory.get("MemFree", 0)) for _, after in pairs)
+        swap = max(after.memory.get("SwapTotal", 0) - after.memory.get("SwapFree", 0) for _, after in pairs)
+
+        if counter_pairs:
+            counter_seconds = (counter_pairs[-1][1].time - counter_pairs[0][0].time) or 1.0
+            totals = [0] * len(INTERFACE_COUNTERS)
+
+            for before, after in counter_pairs:
+                for name, counters in after.interfaces.items():
+                    previous = before.interfaces.get(name, counters)
+                    totals = [total + now - then for total, now, then in zip(totals, counters, previous)]
+
+            rates = "%10.0f %10.0f %8d" % (totals[0] / counter_seconds, totals[1] / counter_seconds, sum(totals[2:]))
+        else:
+            rates = "%10s %10s %8s" % ("-", "-", "-")
+
+        lines.append("%4d %5.1f %5.1f %5.1f %5.1f %5.1f %5.1f %4d %4d %10d %10d %8.0f %s" %
+                     (second, cpu["busy"], peak, cpu["user"] + cpu["nice"], cpu["system"], cpu["softirq"],
+                      cpu["iowait"], max(after.cpu.running for _, after in pairs),
+                      max(after.cpu.blocked for _, after in pairs), available, swap,
+                      (last.cpu.ctxt - first.cpu.ctxt) / seconds, rates))
+
+    return lines
+
+
+def top_processes(before, after, elapsed, count=10):
+    '''
+    Returns list of lines of the count processes that used the most CPU between two read_processes()
+    '''
+
+    elapsed = elapsed or 1.0
+    usage = []
+
+    for pid, process in after.items():
+        previous = before.get(pid)
+        # started during the window, all of its CPU time is in it
+        ticks = process.cpu_ticks - (previous.cpu_ticks if previous is not None else 0)
+        usage.append((ticks * 100.0 / clock_ticks / elapsed, process))
+
+    usage.sort(key=lambda item: item[0], reverse=True)
+    lines = ["top processes by CPU over %.1fs" % elapsed, "%7s %6s %10s %5s %s" % ("pid", "cpu%", "rss_kB", "state", "name")]
+
+    for percent, process in usage[:count]:
+        lines.append("%7d %6.1f %10d %5s %s" % (process.pid, percent, process.rss_kb, process.state, process.name))
+
+    return lines
+
+
+def interface_deltas(samples):
+    '''
+    Returns list of lines with the packet rates and error/drop counts of every interface whose counters moved
+    '''
+
+    if len(samples) < 2:
+        return ["interface counters: not enough samples"]
+
+    first, last = samples[0], samples[-1]
+    elapsed = (last.time - first.time) or 1.0
+    moved = []
+
+    for name, counters in last.interfaces.items():
+        deltas = [now - then for now, then in zip(counters, first.interfaces.get(name, counters))]
+
+        if any(deltas):
+            moved.append((deltas[0] + deltas[1], name, deltas))
+
+    moved.sort(reverse=True)
+    lines = ["interface counters over %.1fs (%d of %d moved)" % (elapsed, len(moved), len(last.interfaces))]
+
+    for packets, name, deltas in moved:
+        lines.append("%-16s rx %9.1f/s tx %9.1f/s rx_err %d tx_err %d rx_drop %d tx_drop %d" %
+                     (name, deltas[0] / elapsed, deltas[1] / elapsed, deltas[2], deltas[3], deltas[4], deltas[5]))
+
+    return lines
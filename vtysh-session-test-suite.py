@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+import unittest
+import vtysh_session
+import tempfile
+import shutil
+import json
+import sys
+import os
+import threading
+
+summary_output = """BGP router identifier 10.2.2.2, local AS number 65222
+RIB entries 7, using 784 bytes of memory
+Peers 2, using 17 KiB of memory
+
+Neighbor        V    AS MsgRcvd MsgSent   TblVer  InQ OutQ Up/Down  State/PfxRcd
+192.168.1.1     4 65111   17758   17788        0    0    0 01w3d19h        2
+192.168.2.2     4 65111   17758   17788        0    0    0 01w3d19h        3
+
+Total number of neighbors 2
+"""
+
+recording = {"show ip bgp summary": summary_output,
+             "show version": "Quagga 0.99.23.1+cl2.5\n",
+             "show slow": {"sleep": 2, "output": "too late\n"},
+             }
+
+fake_vtysh = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_vtysh.py")
+
+
+class TestVtyshSession(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        recording_file = os.path.join(self.tmp_dir, "recording.json")
+        json.dump(recording, open(recording_file, "w"))
+        self.command = [sys.executable, fake_vtysh, recording_file, "spine1"]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_replay(self):
+        session = vtysh_session.VtyshSession(self.command)
+        self.assertEqual(session.send("show ip bgp summary"), summary_output)
+        self.assertEqual(session.prompt, "spine1# ")
+        session.close()
+
+    def test_back_to_back_commands(self):
+        session = vtysh_session.VtyshSession(self.command)
+        self.assertEqual(session.send("show version"), "Quagga 0.99.23.1+cl2.5\n")
+        self.assertEqual(session.send("show ip bgp summary"), summary_output)
+        self.assertEqual(session.send("show version"), "Quagga 0.99.23.1+cl2.5\n")
+        session.close()
+
+    def test_timeout(self):
+        session = vtysh_session.VtyshSession(self.command)
+        self.assertRaises(vtysh_session.VtyshError, session.send, "show slow", 0.5)
+        self.assertFalse(session.alive())
+        self.assertEqual(session.send("show version"), "Quagga 0.99.23.1+cl2.5\n")
+        session.close()
+
+    def test_reconnect_after_exit(self):
+        session = vtysh_session.VtyshSession(self.command)
+        session.send("show version")
+        session.process.kill()
+        session.process.wait()
+        self.assertEqual(session.send("show version"), "Quagga 0.99.23.1+cl2.5\n")
+        session.close()
+
+    def test_missing_vtysh(self):
+        session = vtysh_session.VtyshSession([os.path.join(self.tmp_dir, "vtysh")])
+        self.assertRaises(vtysh_session.VtyshError, session.send, "show version")
+
+        pool = vtysh_session.VtyshPool(1, [os.path.join(self.tmp_dir, "vtysh")])
+        self.assertRaises(vtysh_session.VtyshError, pool.send, "show version")
+        # the failed session goes back to the pool instead of leaking its slot
+        self.assertRaises(vtysh_session.VtyshError, pool.send, "show version")
+        pool.close()
+
+    def test_pool_threads(self):
+        pool = vtysh_session.VtyshPool(2, self.command)
+        results = []
+
+        def worker():
+            for i in range(5):
+                results.append(pool.send("show ip bgp summary"))
+
+        threads = [threading.Thread(target=worker) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        pool.close()
+        self.assertEqual(results, [summary_output] * 20)
+        self.assertEqual(len(pool.sessions), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
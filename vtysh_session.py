@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 Cumulus Networks, Inc. All rights reserved.
+# Author: Pete Lumbis, plumbis@cumulusnetworks.com
+#
+
+from subprocess import Popen, PIPE, STDOUT
+import os
+import re
+import select
+import time
+import threading
+import Queue
+
+debug = False
+
+'''
+vtysh_session keeps long lived interactive vtysh processes around
+so that every query doesn't pay for a shell and a new vtysh process.
+
+A command is written to vtysh's stdin and the response is everything
+printed up to the next prompt. The prompt is learned when the session connects
+(ex. "spine1# ") and matched exactly afterwards.
+
+If a session dies or a command times out the session is torn down and the
+next command reconnects.
+'''
+
+# Matches the first prompt printed by vtysh. ex. "spine1# " or "leaf2> "
+prompt_pattern = re.compile(r"^[\w.\-]+[#>] ?$")
+
+
+class VtyshError(Exception):
+
+    '''
+    Raised when a vtysh session times out or exits while running a command
+    '''
+    pass
+
+
+class VtyshSession(object):
+
+    '''
+    A single long lived interactive vtysh process.
+    '''
+
+    def __init__(self, command=None, timeout=10):
+        '''
+        command = argv list used to start vtysh. Defaults to ["vtysh"]
+        timeout = default seconds to wait for a response
+        process = the Popen vtysh process, None when disconnected
+        prompt = the exact prompt string learned when connecting
+        '''
+
+        self.command = command or ["vtysh"]
+        self.timeout = timeout
+        self.process = None
+        self.prompt = None
+
+    def connect(self):
+        '''
+        Starts vtysh, waits for the first prompt and disables paging.
+
+        Raises VtyshError if vtysh can't be started.
+        '''
+
+        self.close()
+
+        try:
+            self.process = Popen(self.command, stdin=PIPE, stdout=PIPE, stderr=STDOUT, bufsize=0)
+        except OSError as e:
+            raise VtyshError("Could not start " + self.command[0] + ": " + str(e))
+
+        self._read_until_prompt(self.timeout)
+        self.send("terminal length 0")
+
+        if debug:
+            print "vtysh session connected, prompt " + repr(self.prompt)
+
+    def close(self):
+        '''
+        Kills the vtysh process if it is running
+        '''
+
+        if self.process is not None:
+            try:
+                self.process.kill()
+                self.process.wait()
+            except OSError:
+                pass
+
+        self.process = None
+        self.prompt = None
+
+    def alive(self):
+        '''
+        Returns True if the vtysh process is running
+        '''
+
+        return self.process is not None and self.process.poll() is None
+
+    def send(self, command, timeout=None):
+        '''
+        Sends a single command and returns the output.
+
+        Keyword Args:
+        command - string to send. ex. "show ip bgp summary"
+        timeout - seconds to wait for the response. Defaults to the session timeout
+
+        Returns string output of the command, without the echoed command or trailing prompt.
+        Raises VtyshError if the session dies or times out. The session reconnects on the next send.
+        '''
+
+        if timeout is None:
+            timeout = self.timeout
+
+        if not self.alive():
+            self.connect()
+
+        try:
+            os.write(self.process.stdin.fileno(), command + "\n")
+        except OSError as e:
+            self.close()
+            raise VtyshError("vtysh session closed: " + str(e))
+
+        output = self._read_until_prompt(timeout)
+
+        # interactive vtysh echoes the command back before the output
+        first_line_end = output.find("\n")
+        if output[:first_line_end].strip() == command:
+            output = output[first_line_end + 1:]
+
+        return output
+
+    def _read_until_prompt(self, timeout):
+        '''
+        Reads stdout until the last line is the prompt.
+
+        Returns everything before the prompt.
+        '''
+
+        fd = self.process.stdout.fileno()
+        deadline = time.time() + timeout
+        buf = ""
+
+        while True:
+            remaining = deadline - time.time()
+
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                self.close()
+                raise VtyshError("vtysh timed out after " + str(timeout) + " seconds")
+
+            data = os.read(fd, 65536)
+
+            if not data:
+                self.close()
+                raise VtyshError("vtysh exited")
+
+            buf += data
+
+            # Only the unterminated last line can be a prompt
+            line_start = buf.rfind("\n") + 1
+            last_line = buf[line_start:]
+
+            if self.prompt is None:
+                if prompt_pattern.match(last_line):
+                    self.prompt = last_line
+                    return buf[:line_start]
+
+            elif last_line == self.prompt:
+                return buf[:line_start]
+
+
+class VtyshPool(object):
+
+    '''
+    A small pool of VtyshSession objects shared between threads.
+
+    Sessions are started lazily, so a pool only runs as many vtysh processes
+    as there have been concurrent commands.
+    '''
+
+    def __init__(self, size=4, command=None, timeout=10):
+        '''
+        size = maximum number of vtysh sessions
+        command = argv list used to start vtysh
+        timeout = default seconds to wait for a response
+        '''
+
+        self.size = size
+        self.command = command
+        self.timeout = timeout
+        self.idle = Queue.Queue()
+        self.lock = threading.Lock()
+        self.sessions = []
+
+    def send(self, command, timeout=None):
+        '''
+        Runs a command on an idle session, waiting for one if all are busy.
+
+        Returns string output of the command. Raises VtyshError on failure.
+        '''
+
+        session = self._checkout()
+
+        try:
+            return session.send(command, timeout)
+        finally:
+            self.idle.put(session)
+
+    def close(self):
+        '''
+        Kills every session in the pool
+        '''
+
+        with self.lock:
+            for session in self.sessions:
+                session.close()
+
+    def _checkout(self):
+        '''
+        Returns an idle session, creating a new one if the pool isn't full yet.
+        '''
+
+        try:
+            return self.idle.get_nowait()
+        except Queue.Empty:
+            pass
+
+        with self.lock:
+            if len(self.sessions) < self.size:
+                session = VtyshSession(self.command, self.timeout)
+                self.sessions.append(session)
+                return session
+
+        return self.idle.get()